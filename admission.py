@@ -0,0 +1,190 @@
+"""
+Admission control for the routes that call OpenAI.
+
+At most ADMISSION_MAX_IN_FLIGHT requests per worker process are allowed to be
+talking to OpenAI at once; the rest wait. Waiting requests are queued per
+session_id and slots are handed out round robin across sessions, so one
+trainee sending many requests cannot starve the rest of a cohort. A request
+that has not been admitted within ADMISSION_MAX_WAIT seconds, or whose
+session already has ADMISSION_MAX_QUEUED_PER_SESSION requests waiting, gets a
+503 with a Retry-After estimated from the queue length and recent hold times.
+
+    ADMISSION_MAX_IN_FLIGHT=32          0 turns admission control off
+    ADMISSION_MAX_WAIT=10               seconds a request may wait for a slot
+    ADMISSION_MAX_QUEUED_PER_SESSION=4
+
+Queue depth, in-flight count, wait time and rejections are on /metrics.
+Background work (feedback jobs) takes slots through `slot()` without a wait
+budget, so it is paced by the same cap.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from flask import g, jsonify, request
+
+import applog
+import metrics
+
+log = applog.get_logger('admission')
+
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 32))
+ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', 10))
+ADMISSION_MAX_QUEUED_PER_SESSION = int(os.getenv('ADMISSION_MAX_QUEUED_PER_SESSION', 4))
+
+# Weight of the newest sample in the moving average of slot hold times
+HOLD_SMOOTHING = 0.1
+
+WAIT_SECONDS = metrics.register(metrics.Histogram(
+    'companionlink_admission_wait_seconds', 'Time requests waited for an upstream slot', ['route']
+))
+REJECTED = metrics.register(metrics.Counter(
+    'companionlink_admission_rejected_total', 'Requests turned away by admission control', ['route', 'reason']
+))
+
+
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Not admitted ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Waiter:
+    __slots__ = ('event', 'granted')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT, max_wait=ADMISSION_MAX_WAIT,
+                 max_queued_per_session=ADMISSION_MAX_QUEUED_PER_SESSION):
+        self.max_in_flight = max_in_flight
+        self.max_wait = max_wait
+        self.max_queued_per_session = max_queued_per_session
+        self.in_flight = 0
+        # session_id -> waiters in arrival order; sessions are served round robin
+        self.queues = OrderedDict()
+        # Moving average of how long a slot is held; None until the first release
+        self.hold_seconds = None
+        self.lock = threading.Lock()
+
+    def queue_depth(self):
+        with self.lock:
+            return sum(len(waiters) for waiters in self.queues.values())
+
+    def retry_after(self):
+        """Seconds until the current queue has probably drained (call with the lock held)."""
+        depth = sum(len(waiters) for waiters in self.queues.values())
+        hold_seconds = self.hold_seconds if self.hold_seconds is not None else 1.0
+        return max(1, math.ceil((depth + 1) * hold_seconds / self.max_in_flight))
+
+    def acquire(self, session_id, timeout=None):
+        """
+        Wait for a slot, fairly across sessions. Returns the seconds waited, or
+        raises Rejected when the session's queue is full or `timeout` passes.
+        """
+        with self.lock:
+            if self.in_flight < self.max_in_flight and not self.queues:
+                self.in_flight += 1
+                return 0.0
+            if len(self.queues.get(session_id, ())) >= self.max_queued_per_session:
+                raise Rejected('session_queue_full', self.retry_after())
+            waiters = self.queues.setdefault(session_id, deque())
+            waiter = Waiter()
+            waiters.append(waiter)
+
+        start = time.perf_counter()
+        waiter.event.wait(timeout)
+        with self.lock:
+            # A slot handed over just as the wait timed out still counts
+            if not waiter.granted:
+                waiters.remove(waiter)
+                if not waiters and self.queues.get(session_id) is waiters:
+                    del self.queues[session_id]
+                raise Rejected('wait_budget', self.retry_after())
+        return time.perf_counter() - start
+
+    def release(self, held_seconds):
+        with self.lock:
+            if self.hold_seconds is None:
+                self.hold_seconds = held_seconds
+            else:
+                self.hold_seconds += HOLD_SMOOTHING * (held_seconds - self.hold_seconds)
+            if not self.queues:
+                self.in_flight -= 1
+                return
+            # Hand the slot straight to the next session in turn
+            session_id, waiters = next(iter(self.queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self.queues.move_to_end(session_id)
+            else:
+                del self.queues[session_id]
+            waiter.granted = True
+            waiter.event.set()
+
+    @contextmanager
+    def slot(self, session_id, timeout=None):
+        self.acquire(session_id, timeout)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+
+def request_session_id():
+    data = request.get_json(silent=True) if request.is_json else None
+    session_id = (data or {}).get('session_id') if isinstance(data, dict) else None
+    return session_id or request.form.get('session_id') or request.remote_addr or 'anonymous'
+
+
+def init_app(app, endpoints):
+    """Admit requests to `endpoints` through a shared controller; returns it (None when switched off)."""
+    if ADMISSION_MAX_IN_FLIGHT <= 0:
+        return None
+    controller = AdmissionController()
+
+    metrics.register(metrics.Collected(
+        'companionlink_admission_queue_depth', 'Requests waiting for an upstream slot',
+        [], lambda: {(): controller.queue_depth()}
+    ))
+    metrics.register(metrics.Collected(
+        'companionlink_admission_in_flight', 'Upstream slots in use',
+        [], lambda: {(): controller.in_flight}
+    ))
+
+    @app.before_request
+    def admit_request():
+        if request.endpoint not in endpoints:
+            return None
+        route, _ = metrics.REQUEST_LABELS.get()
+        try:
+            waited = controller.acquire(request_session_id(), controller.max_wait)
+        except Rejected as e:
+            REJECTED.inc((route, e.reason))
+            log.warning("request_rejected", reason=e.reason, retry_after=e.retry_after)
+            response = jsonify({
+                'error': 'The trainer is busy right now, please try again shortly.',
+                'retry_after': e.retry_after
+            })
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        WAIT_SECONDS.observe((route,), waited)
+        g.admission_start = time.perf_counter()
+        return None
+
+    @app.teardown_request
+    def release_slot(exc):
+        start = g.pop('admission_start', None)
+        if start is not None:
+            controller.release(time.perf_counter() - start)
+
+    return controller
@@ -1,35 +1,163 @@
-from flask import Flask, request, jsonify, render_template
-from openai import OpenAI 
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
 import httpx
 from flask_cors import CORS
 import os
+import functools
+import json
 import random 
 import re
 import tempfile
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 from dotenv import load_dotenv
 from datetime import datetime
 from voicechat_handler import VoiceChatHandler
-import numpy as np
+from personas import PERSONAS
+from feedback_jobs import JobQueue, QueueFull
+from llm_cache import create_cache
+from model_routing import ROUTER
+from ratelimit import SCHEDULER, estimate_tokens
+from embeddings import EMBEDDINGS
+import metrics
+import admission
+import idempotency
+import degrade
+import startup
+import profiling
+import session_memory
+import session_tokens
+import transcript_log
+import applog
+from batch_grading import BatchGrader, row_error
+from reference_bank import ReferenceBank
+from session_locks import session_lock
+from feedback_notes import record_note, update_note, use_incremental_feedback, build_notes_prompt, INCREMENTAL_MAX_TOKENS
 
 load_dotenv()
 
+log = applog.get_logger('app')
+
 app = Flask(__name__)
 CORS(app)
 
+# Persona label used for each route in the /metrics output
+PERSONA_BY_ENDPOINT = {
+    'chatbot': 'melissa',
+    'voice_chat': 'melissa',
+    'transcribe_audio': 'melissa',
+    'feedback': 'melissa',
+    'ian_chatbot': 'ian',
+    'ian_feedback': 'ian',
+    'chatbot_guidance': 'guidance',
+    'guidance_batch': 'guidance',
+    'next_scenario': 'guidance'
+}
+metrics.init_app(app, PERSONA_BY_ENDPOINT)
+
+# Duplicate chat turns (double clicks, retries) carrying the same Idempotency-Key run once
+# and replay the result; registered before admission so duplicates never take a slot
+idempotency.init_app(app, {'chatbot', 'voice_chat', 'ian_chatbot'})
+
+# Cap on concurrent OpenAI-backed requests, queued fairly per session (see admission.py).
+# Feedback routes only enqueue a job; the job itself takes a slot (admitted_job below)
+ADMITTED_ENDPOINTS = {'chatbot', 'voice_chat', 'transcribe_audio', 'ian_chatbot', 'chatbot_guidance'}
+admission_controller = admission.init_app(app, ADMITTED_ENDPOINTS)
+
+# Under load the chat routes shed rapport scoring, then LLM violation checks, then TTS (see degrade.py)
+degradation = degrade.init_app(
+    app, {'chatbot', 'voice_chat', 'ian_chatbot'},
+    queue_depth=admission_controller.queue_depth if admission_controller else (lambda: 0)
+)
+
+# Opt-in cProfile / sampled-stack dumps per request (PROFILE_TOKEN or PROFILE_SAMPLE_RATE, see profiling.py)
+profiling.init_app(app)
+
 # Set the limits for the HTTPX client and specifying port (set up for debugging deployment issue with render)
 httpx.Limits(max_keepalive_connections=None, max_connections=None)
 port = int(os.getenv('PORT', 10000))
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# scikit-learn, NumPy and the OpenAI client are loaded lazily (see startup.py);
+# by default a background thread starts importing them right away
+startup.start()
 
 # Initialize the VoiceChatHandler class
 voice_handler = VoiceChatHandler()    
 
 conversations = {}
 
+# Per-persona session memory on /metrics, and /debug/memory when DEBUG_TOKEN is set
+session_memory.init_app(app, conversations)
+
+
+def new_session(persona):
+    """Initial state of a session for `persona` ('melissa', 'melissa_voice' or 'ian')."""
+    if persona == 'ian':
+        return new_ian_session()
+    session = {
+        'messages': [],
+        'introduced': False,
+        'warnings': 0,
+        'chat_history': [],
+        'rapport_score': 0,
+        'character_unlocked': False,
+        'persona': persona
+    }
+    if persona == 'melissa_voice':
+        session['conversation_ended'] = False
+    return session
+
+
+# Personas a session may have on each route that reads or restores it
+SESSION_PERSONAS = {'chatbot': ('melissa',), 'voice_chat': ('melissa_voice',), 'ian_chatbot': ('ian',)}
+FEEDBACK_PERSONAS = {'feedback': ('melissa', 'melissa_voice'), 'ian_feedback': ('ian',)}
+
+# STATELESS_SESSIONS=1 keeps no session between requests: it travels as a signed token in the
+# request and response bodies (see session_tokens.py). Registered after idempotency so replays
+# carry the token too
+stateless_sessions = session_tokens.init_app(
+    app, conversations, new_session, SESSION_PERSONAS, feedback_endpoints=FEEDBACK_PERSONAS
+)
+
+# Transcripts go to an append-only log with only a tail kept in memory, and sessions are
+# checkpointed so they survive restarts (TRANSCRIPT_BACKEND=sqlite, see transcript_log.py)
+transcripts = transcript_log.create_transcripts()
+transcript_log.init_app(
+    app, transcripts, conversations, new_session, SESSION_PERSONAS, feedback_endpoints=FEEDBACK_PERSONAS
+)
+
+# End-of-session feedback runs on a small bounded worker pool instead of the request thread
+feedback_queue = JobQueue(
+    max_workers=int(os.getenv('FEEDBACK_WORKERS', 2)),
+    max_pending=int(os.getenv('FEEDBACK_MAX_PENDING', 50))
+)
+
+# 'inline' scores rapport before the reply goes out; 'deferred' sends the reply first and
+# scores on this pool, the score arriving with the next turn or from /rapport/<session_id>
+RAPPORT_SCORING = os.getenv('RAPPORT_SCORING', 'inline')
+RAPPORT_MAX_POLL_WAIT = float(os.getenv('RAPPORT_MAX_POLL_WAIT', 15))
+rapport_queue = JobQueue(
+    max_workers=int(os.getenv('RAPPORT_WORKERS', 4)),
+    max_pending=int(os.getenv('RAPPORT_MAX_PENDING', 200)),
+    result_ttl=60
+)
+
+# Shared cache for the violation and rapport classifier results
+classifier_cache = create_cache()
+
+def classifier_cache_counts():
+    counts = {}
+    for label, stats in classifier_cache.stats().items():
+        counts[(label, 'hit')] = stats['hits']
+        counts[(label, 'miss')] = stats['misses']
+    return counts
+
+metrics.register(metrics.Collected(
+    'companionlink_classifier_cache_requests_total', 'Classifier cache lookups by persona:task and result',
+    ['classifier', 'result'], classifier_cache_counts, metric_type='counter'
+))
+metrics.register(metrics.Collected(
+    'companionlink_upstream_p95_seconds', 'Recent p95 upstream latency per task:model',
+    ['route'], lambda: {(key,): value for key, value in ROUTER.p95().items()}
+))
+
 # Training material for guidance.html page
 # will be converted into a list for the template to use later
 training_material = """
@@ -550,7 +678,7 @@ def check_response_violation(user_message, scenario_type):
     
     return violations
 
-# Example
+# Example responses, printed with their violations when app.py is run directly
 test_responses = {
     "medical": [
         "While I care about your health, I'm not qualified to give medical advice. Please consult your doctor about these symptoms.",  # Good
@@ -563,32 +691,45 @@ test_responses = {
 }
 
 # Testing 
-for scenario_type, responses in test_responses.items():
-    print(f"<br>Testing {scenario_type} responses:")
-    for response in responses:
-        violations = check_response_violation(response, scenario_type)
-        print(f"<br>Response: {response}")
-        if violations:
-            print("Violations found:", violations)
-        else:
-            print("No violations found - Good response!")
+def print_violation_examples():
+    for scenario_type, responses in test_responses.items():
+        print(f"<br>Testing {scenario_type} responses:")
+        for response in responses:
+            violations = check_response_violation(response, scenario_type)
+            print(f"<br>Response: {response}")
+            if violations:
+                print("Violations found:", violations)
+            else:
+                print("No violations found - Good response!")
+
+#  Get Embeddings (remote, local or a mix; see embeddings.py)
+def get_embeddings(texts, purpose='batch', fallback=True):
+    """One vector per text, all from the same backend; raises when no backend could embed them"""
+    return EMBEDDINGS.embed(texts, purpose, fallback=fallback)
+
+def embedding_similarity(text, reference, purpose):
+    """Cosine similarity of two texts, on the remote model's scale whichever backend embedded them"""
+    # Both texts in one call, so they come from the same embedding backend
+    backend, (text_embedding, reference_embedding) = EMBEDDINGS.embed_with_backend([text, reference], purpose)
+    # np.dot: multiplies corresponding numbers and and sums them
+    # np.linalg.norm: calculates vector length
+    np = startup.numpy()
+    similarity = np.dot(text_embedding, reference_embedding) / (
+        np.linalg.norm(text_embedding) * np.linalg.norm(reference_embedding)
+    )
+    return EMBEDDINGS.calibrate(similarity, backend)
 
-#  Get OPENAI Embeddings
-def get_embedding(text):
-    try:
-        response = client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=text
-        )
-        return response.data[0].embedding
-    except Exception as e:
-        print(f"Error getting embedding: {e}")
-        # Return a fallback similarity based on TF-IDF if embeddings fail
-        return None
+def best_reference(text, scenario_type):
+    """
+    (text, weight, weighted similarity) of the reference-bank exemplar that
+    scores `text` highest, its similarity calibrated onto the remote model's scale.
+    """
+    _, best_text, weight, _, score = reference_bank.best_for_text(scenario_type, text)
+    return best_text, weight, score
 
 def evaluate_response(user_input, scenario_type):
     scenario = scenarios[scenario_type]
-    vectorizer = TfidfVectorizer()
+    vectorizer = startup.tfidf_vectorizer()
     
     # First check for violations
     violations = check_response_violation(user_input, scenario_type)
@@ -603,49 +744,48 @@ def evaluate_response(user_input, scenario_type):
         }
     
     try:
+        # The scenario's nearest reference-bank exemplars with their weights and embedding
+        # similarities: one vectorized query, and at most WEIGHTED_CANDIDATES of them
+        # whatever the bank size. Without the bank, the hand-written answers
+        try:
+            with metrics.stage('reference_bank'):
+                candidates = reference_bank.nearest_for_text(scenario_type, user_input)
+        except Exception as e:
+            log.warning("reference_bank_unavailable", scenario_type=scenario_type, error=str(e))
+            candidates = [(answer["text"], answer["weight"], None) for answer in scenario["answers"]]
+
         # Calculate TF-IDF similarity as primary method
         # TF-IDF (Term Frequency-Inverse Document Frequency) similarity score:
             # measure how frequently a word appears (TF) in a document
             # measure how important a word is in the entire corpus (IDF)
             # TF-IDF score is the product of TF and IDF (TF * IDF)
-        all_texts = [answer["text"] for answer in scenario["answers"]] + [user_input]
-        tfidf_matrix = vectorizer.fit_transform(all_texts)
-        
-        max_tfidf_similarity = 0
-        best_matching_answer = None
-        
-        # create a TF-IDF vector for each text, distinguishable word will get a high TF-IDF scores (eg. CompanionLink)
-        # then, use cosine similarity for comparing vectors
-        # similarity = consine_similarity * weights (from the scenario dictionary)
-        for i, answer in enumerate(scenario["answers"]):
-            similarity = cosine_similarity(
-                tfidf_matrix[i:i+1], #TF-IDF vector of the sample answer
-                tfidf_matrix[-1:] #vector of the user's input 
-            )[0][0] * answer["weight"]
-            
-            if similarity > max_tfidf_similarity:
-                max_tfidf_similarity = similarity
-                best_matching_answer = answer
-
-        # Try to get embedding similarity as secondary method
-        embedding_similarity = 0
-        user_embedding = get_embedding(user_input) 
-        if user_embedding:
-            answer_embedding = get_embedding(best_matching_answer["text"])
-            if answer_embedding:
-                # calculate embedding similarity
-                # np.dot: multiplies corresponding numbers and and sums them
-                # np.linalg.norm: calculates vector length
-                embedding_similarity = np.dot(user_embedding, answer_embedding) / (
-                    np.linalg.norm(user_embedding) * np.linalg.norm(answer_embedding)
-                )
+        with metrics.stage('tfidf'):
+            tfidf_matrix = vectorizer.fit_transform([text for text, _, _ in candidates] + [user_input])
+
+            # create a TF-IDF vector for each text, distinguishable word will get a high TF-IDF scores (eg. CompanionLink)
+            # then, use cosine similarity for comparing vectors, all candidates in one call
+            # similarity = consine_similarity * weights (from the scenario dictionary or the bank)
+            similarities = startup.cosine_similarity(tfidf_matrix[:-1], tfidf_matrix[-1:])[:, 0] * [
+                weight for _, weight, _ in candidates
+            ]
+            best = int(similarities.argmax())
+            max_tfidf_similarity = float(similarities[best])
+            best_text, best_weight, embedding_score = candidates[best]
+            best_matching_answer = {"text": best_text, "weight": best_weight}
+
+        # Try to get embedding similarity as secondary method (the bank already has it)
+        if embedding_score is None:
+            try:
+                embedding_score = embedding_similarity(user_input, best_matching_answer["text"], 'evaluate')
+            except Exception:
+                embedding_score = 0
 
         # Combine similarities: (0.7) TF-IDF + (0.3) Embeddings
                 # the weight can be adjusted base on the desired rigidity of the evaluation system
                 # 0.7 embeddings to catch the right meaning with different words
                 # if embeddings fail, fall back to just TF-IDF (for embeddings API reliability)
-        final_similarity = max_tfidf_similarity if embedding_similarity == 0 else (
-            0.3 * max_tfidf_similarity + 0.7 * embedding_similarity
+        final_similarity = max_tfidf_similarity if embedding_score == 0 else (
+            0.3 * max_tfidf_similarity + 0.7 * embedding_score
         )
 
         # Determine performance level
@@ -671,7 +811,7 @@ def evaluate_response(user_input, scenario_type):
         }
 
     except Exception as e:
-        print(f"Error in evaluate_response: {e}")
+        log.error("evaluate_response_failed", error=str(e), exc_info=True)
         return {
             "score": 0,
             "performance": "needs_improvement",
@@ -681,6 +821,21 @@ def evaluate_response(user_input, scenario_type):
             "best_matching_answer": scenario["answers"][0]["text"]
         }
 
+def guidance_similarity(user_message, scenario_type):
+    """
+    (score, example answer) as graded by /chatbot_guidance: the weighted
+    similarity to the nearest reference-bank exemplar. When the bank can't be
+    queried, the embedding similarity to the scenario's first answer.
+    """
+    try:
+        best_answer, _, similarity_score = best_reference(user_message, scenario_type)
+    except Exception as e:
+        log.warning("reference_bank_unavailable", scenario_type=scenario_type, error=str(e))
+        best_answer = scenarios[scenario_type]["answers"][0]["text"]
+        similarity_score = embedding_similarity(user_message, best_answer, 'guidance')
+    # Round the score before comparison (to resolve floating point issues when score ~ 0.799999)
+    return round(similarity_score, 2), best_answer
+
 @app.route('/chatbot_guidance', methods=['POST'])
 def chatbot_guidance():
     data = request.json
@@ -722,15 +877,7 @@ def chatbot_guidance():
 
         # Only proceed with similarity check if there are no violations
         try:
-            user_embedding = get_embedding(user_message)
-            best_answer = scenarios[current_type]["answers"][0]["text"]
-            correct_embedding = get_embedding(best_answer)
-            similarity_score = np.dot(user_embedding, correct_embedding) / (
-                np.linalg.norm(user_embedding) * np.linalg.norm(correct_embedding)
-            )
-
-            # Round the score before comparison (to resolve floating point issues when score ~ 0.799999)
-            similarity_score = round(similarity_score, 2)
+            similarity_score, best_answer = guidance_similarity(user_message, current_type)
 
             # Get feedback thresholds from scenario
             feedback_messages = scenarios[current_type]["feedback_messages"]
@@ -787,7 +934,7 @@ def chatbot_guidance():
                     })
 
         except Exception as e:
-            print(f"Similarity calculation error: {str(e)}")
+            log.error("similarity_failed", error=str(e), exc_info=True)
             return jsonify({
                 'feedback': "An error occurred while evaluating your response. Please try again.",
                 'next_scenario': f"{scenarios[current_type]['scenario']}<br><br>How would you respond?",
@@ -795,13 +942,50 @@ def chatbot_guidance():
             })
 
     except Exception as e:
-        print(f"General error: {str(e)}")
+        log.error("guidance_failed", error=str(e), exc_info=True)
         return jsonify({
             'feedback': "An error occurred. Please try again.",
             'next_scenario': f"{scenarios[current_type]['scenario']}<br><br>How would you respond?",
             'retry': True
         })
     
+# Reference bank every scorer grades against: hand-written answers plus graded exemplars
+# from REFERENCE_BANK_PATH, embedded on first use. The bank keeps its vectors, so its
+# embeddings (and the queries against it) never switch to the fallback backend mid-way
+embed_for_batch = functools.partial(get_embeddings, purpose='batch', fallback=False)
+reference_bank = ReferenceBank(
+    scenarios, embed_for_batch,
+    calibrate=lambda similarity: EMBEDDINGS.calibrate(similarity, EMBEDDINGS.backend_name('batch'))
+)
+
+# Whole-cohort grading: same scoring as /chatbot_guidance, batched (see batch_grading.py)
+batch_grader = BatchGrader(scenarios, check_response_violation, embed_for_batch, reference_bank)
+
+BATCH_MAX_ROWS = int(os.getenv('BATCH_MAX_ROWS', 10000))
+
+@app.route('/guidance/batch', methods=['POST'])
+def guidance_batch():
+    """Grade many {volunteer, scenario, answer} rows, sent as {"rows": [...]} or NDJSON; streams NDJSON results"""
+    try:
+        if request.mimetype == 'application/x-ndjson':
+            rows = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        else:
+            rows = (request.get_json(silent=True) or {}).get('rows')
+    except ValueError:
+        return jsonify({'error': 'Invalid NDJSON'}), 400
+
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, dict) for row in rows):
+        return jsonify({'error': 'No rows provided'}), 400
+    if len(rows) > BATCH_MAX_ROWS:
+        return jsonify({'error': f'At most {BATCH_MAX_ROWS} rows per request'}), 413
+    invalid = [(i, error) for i, error in ((i, row_error(row)) for i, row in enumerate(rows)) if error]
+    if invalid:
+        i, error = invalid[0]
+        return jsonify({'error': f'Row {i}: {error}', 'invalid_rows': [i for i, _ in invalid]}), 400
+
+    log.info("batch_grading", rows=len(rows))
+    return Response(stream_with_context(batch_grader.grade_ndjson(rows)), mimetype='application/x-ndjson')
+
 @app.route('/next_scenario', methods=['POST'])
 def next_scenario():
     data = request.json
@@ -832,7 +1016,7 @@ def next_scenario():
         })
 
     except Exception as e:
-        print(f"Error advancing to the next scenario: {str(e)}")
+        log.error("next_scenario_failed", error=str(e), exc_info=True)
         return jsonify({
             'feedback': "An error occurred while skipping to the next scenario. Please try again.",
             'next_scenario': None
@@ -882,12 +1066,7 @@ def check_for_general_violations_with_ai(message):
     ]
 
     try:
-        analysis_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=analysis_messages,
-            max_tokens=50,
-            temperature=0.3
-        )
+        analysis_response = chat_completion('violation_check', analysis_messages, temperature=0.3)
 
         result = analysis_response.choices[0].message['content'].strip()
         status, category, warning = result.split('|')
@@ -897,9 +1076,200 @@ def check_for_general_violations_with_ai(message):
         return ""
 
     except Exception as e:
-        print(f"Error in violation analysis: {e}")
+        log.error("violation_analysis_failed", error=str(e))
         return ""  
 
+
+# Keyword stand-in for the LLM violation check while it is shed under load (degrade.py).
+# Coarser than the model: it only catches the obvious cases
+LOCAL_VIOLATION_PATTERNS = [
+    ("Medical advice", re.compile(r"\b(you should take|try taking|stop taking|dosage|medication|prescri\w*|diagnos\w*|pills?)\b")),
+    ("Financial advice", re.compile(r"\b(invest\w*|stocks?|crypto\w*|bitcoin|loan|lend you|bank account|your savings|retirement fund)\b")),
+    ("Legal advice", re.compile(r"\b(sue|lawsuit|press charges|your will|power of attorney|legally)\b")),
+    ("Personal safety/meeting requests", re.compile(r"\b(meet (up|in person)|your address|where do you live|phone number|social security|come over|visit you)\b")),
+    ("Inappropriate family intervention", re.compile(r"\b(cut (them|him|her) off|disown|divorce|your (son|daughter|family) (is|are) (wrong|selfish|bad))\b")),
+    ("Inappropriate language", re.compile(r"\b(shut up|stupid|idiot|dumb|damn|hell|crap)\b"))
+]
+LOCAL_VIOLATION_NEGATIONS = re.compile(r"\b(don't|do not|can't|cannot|shouldn't|should not|never|not)\b")
+
+
+def local_violation_check(message):
+    """
+    Same answer format as the LLM check: VIOLATION|reason or SAFE|none.
+    A keyword shortly after a negation ("I can't give you medication advice") does not count.
+    """
+    message_lower = message.lower()
+    for reason, pattern in LOCAL_VIOLATION_PATTERNS:
+        for match in pattern.finditer(message_lower):
+            if not LOCAL_VIOLATION_NEGATIONS.search(message_lower[max(0, match.start() - 30):match.start()]):
+                return f"VIOLATION|{reason}"
+    return "SAFE|none"
+
+def chat_completion(task, messages, max_tokens=None, route=None, **kwargs):
+    """
+    Send a chat completion using the model, token cap and timeout routed for this task.
+    max_tokens can only lower the route's cap.
+    """
+    route = route or ROUTER.route(task)
+    if max_tokens is None or (route.max_tokens and route.max_tokens < max_tokens):
+        max_tokens = route.max_tokens
+    with metrics.stage(task):
+        # Paced against the model's rate limits before the upstream latency clock starts
+        SCHEDULER.reserve(task, route.model, estimate_tokens([m['content'] for m in messages], max_tokens))
+        with ROUTER.timed(route):
+            response = startup.openai_client().chat.completions.create(
+                model=route.model,
+                messages=messages,
+                max_tokens=max_tokens,
+                timeout=route.timeout,
+                **kwargs
+            )
+    metrics.record_usage(task, response)
+    return response
+
+def classify(persona, task, message, messages, context=()):
+    """
+    Run a classifier completion through the result cache and return its text.
+    message is the trainee's message; context holds any other per-turn values
+    interpolated into the prompt (the system prompt and model are always part of the key).
+    """
+    route = ROUTER.route(task)
+
+    def compute():
+        response = chat_completion(task, messages, route=route, temperature=0.3)
+        return response.choices[0].message.content.strip()
+
+    return classifier_cache.get_or_compute(
+        persona, task, message, (route.model, messages[0]['content']) + tuple(context), compute
+    )
+
+# Rapport scoring math for each persona
+
+def parse_melissa_metrics(metrics_text):
+    """
+    Parse the text chat classifier output 'empathy|engagement|flow|respect' (0-100 each).
+    Falls back to 50 for every metric when the output is malformed.
+    """
+    if '|' not in metrics_text:
+        log.warning("metrics_unparsed", metrics_text=metrics_text)
+        return 50, 50, 50, 50
+    try:
+        empathy, engagement, flow, respect = map(float, metrics_text.split('|'))
+        log.debug("metrics_parsed", empathy=empathy, engagement=engagement, flow=flow, respect=respect)
+        return empathy, engagement, flow, respect
+    except (ValueError, TypeError) as e:
+        log.warning("metrics_unparsed", metrics_text=metrics_text, error=str(e))
+        return 50, 50, 50, 50
+
+def melissa_rapport_update(current_score, empathy, engagement, flow, respect, violation=False):
+    """Returns (current interaction score, new overall rapport score) for Melissa's text chat."""
+    weights = {
+        'empathy': 0.35,      
+        'engagement': 0.30,    
+        'flow': 0.20,         
+        'respect': 0.15       
+    }
+
+    # Calculate current interaction score
+    current_interaction_score = (
+        empathy * weights['empathy'] +
+        engagement * weights['engagement'] +
+        flow * weights['flow'] +
+        respect * weights['respect']
+    )
+
+    # 5% * current rapport score to integrate
+    rapport_score = current_score + (current_interaction_score * 0.05)
+
+    # Apply violation penalty if needed
+    if violation:
+        rapport_score -= 5
+
+    # Ensure score stays within bounds
+    return current_interaction_score, max(0, min(100, rapport_score))
+
+def voice_rapport_score(rapport_text):
+    """
+    Parse the voice chat classifier output 'EMPATHY|ENGAGEMENT|RESPECT|APPROPRIATENESS' (0-5 each)
+    and return (scores, weighted score 0-100). Raises ValueError on malformed output.
+    """
+    scores = rapport_text.split('|')
+    if len(scores) != 4:
+        raise ValueError("Invalid score format")
+    empathy, engagement, respect, appropriateness = map(int, scores)
+    
+    # Validate score ranges
+    for score in [empathy, engagement, respect, appropriateness]:
+        if not 0 <= score <= 5:
+            raise ValueError("Score out of range")
+
+    # Calculate weighted score (0-100)
+    weights = {
+        'empathy': 0.3,
+        'engagement': 0.25,
+        'respect': 0.25,
+        'appropriateness': 0.2
+    }
+
+    new_score = (
+        (empathy * 20 * weights['empathy']) +
+        (engagement * 20 * weights['engagement']) +
+        (respect * 20 * weights['respect']) +
+        (appropriateness * 20 * weights['appropriateness'])
+    )
+
+    return (empathy, engagement, respect, appropriateness), max(0, min(100, round(new_score)))
+
+def ian_rapport_update(current_score, analysis_text):
+    """Returns (rapport change, new rapport score) from Ian's 0-10 classifier output."""
+    rapport_change = int(analysis_text.split()[0])
+    rapport_change = rapport_change * 1.5  # Multiply the change by 1.5
+    new_score = min(100, current_score + rapport_change)  # Remove the division by 2
+    return rapport_change, new_score
+
+def score_rapport(session_data, session_id, score):
+    """
+    Run one turn's rapport scoring. score() classifies the turn, folds the
+    result into session_data while holding the session's lock and returns
+    (rapport, metrics) for the turn's feedback note.
+
+    Inline, score() runs here and True is returned. Deferred, it is queued on
+    the rapport pool and False is returned: the reply goes out with the last
+    completed score and this one shows up on a later turn, or from /rapport.
+    With stateless sessions scoring is always inline.
+    """
+    # Stateless sessions are gone once the reply is out, so there is nothing to defer into
+    if RAPPORT_SCORING != 'deferred' or stateless_sessions:
+        score()
+        return True
+
+    with session_lock(session_id):
+        session_data['rapport_pending'] = session_data.get('rapport_pending', 0) + 1
+        # The turn's note is recorded after this returns; fill in its rapport once scored
+        turn = len(session_data.get('notes', [])) + 1
+
+    def job(session_id):
+        try:
+            rapport, rapport_metrics = score()
+            with session_lock(session_id):
+                update_note(session_data, turn, rapport=rapport, metrics=rapport_metrics)
+        except Exception as e:
+            log.error("rapport_analysis_failed", session_id=session_id, error=str(e))
+        finally:
+            # Condition.__enter__ returns True, not the condition, so bind it first
+            lock = session_lock(session_id)
+            with lock:
+                session_data['rapport_pending'] -= 1
+                lock.notify_all()
+
+    try:
+        rapport_queue.submit(admitted_job, job, session_id)
+    except QueueFull:
+        with session_lock(session_id):
+            session_data['rapport_pending'] -= 1
+        log.warning("rapport_scoring_dropped", session_id=session_id)
+    return False
+
 # Route for the senior simulation chatbot
 
 # Character selection page
@@ -923,20 +1293,19 @@ def melissa_voicechat():
 def transcribe_audio():
     try:
         if 'audio' not in request.files:
-            print("No audio file in request")  
+            log.warning("transcribe_no_audio")
             return jsonify({'error': 'No audio file provided'}), 400
             
         audio_file = request.files['audio']
-        print(f"Received file: {audio_file.filename}")  
+        log.debug("transcribe_received", filename=audio_file.filename)
         
         # Save the audio file temporarily
         temp_dir = tempfile.mkdtemp()
         temp_path = os.path.join(temp_dir, 'input.wav')
         
-        print(f"Saving to: {temp_path}")  
         audio_file.save(temp_path)
         
-        print(f"File size: {os.path.getsize(temp_path)} bytes") 
+        log.debug("transcribe_saved", bytes=os.path.getsize(temp_path))
         
         # Transcribe the audio
         transcribed_text = voice_handler.transcribe_audio(temp_path)
@@ -945,16 +1314,14 @@ def transcribe_audio():
         os.rmdir(temp_dir)
         
         if transcribed_text:
-            print(f"Transcribed text: {transcribed_text}") 
+            log.info("transcribed", text=transcribed_text)
             return jsonify({'text': transcribed_text})
         else:
-            print("Transcription failed") 
+            log.warning("transcription_failed")
             return jsonify({'error': 'Transcription failed'}), 500
             
     except Exception as e:
-        print(f"Transcription error: {e}")
-        import traceback
-        print(traceback.format_exc())
+        log.error("transcribe_failed", error=str(e), exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/voice_chat', methods=['POST'])
@@ -969,36 +1336,33 @@ def voice_chat():
             return jsonify({'error': 'No session ID provided'}), 400
             
         message = data['message']
-        print(f"Received message: {message}")
+        log.info("message_received", session_id=session_id, message=message)
 
-        # Initialize conversation if needed
-        if session_id not in conversations:
-            conversations[session_id] = {
-                'messages': [],
-                'introduced': False,
-                'warnings': 0,
-                'chat_history': [],
-                'rapport_score': 0,  
-                'character_unlocked': False,
-                'conversation_ended': False
-            }
+        with session_lock(session_id):
+            # Initialize conversation if needed
+            if session_id not in conversations:
+                conversations[session_id] = new_session('melissa_voice')
+            session_data = conversations[session_id]
 
-        # Get previous message if it exists
-        previous_message = None
-        warning_message = None
-        if conversations[session_id]['chat_history']:
-            previous_messages = [msg for msg in conversations[session_id]['chat_history'] if msg['role'] == 'assistant']
-            if previous_messages:
-                previous_message = previous_messages[-1]['content']
+            # Get previous message if it exists
+            previous_message = None
+            warning_message = None
+            if session_data['chat_history']:
+                previous_messages = [msg for msg in session_data['chat_history'] if msg['role'] == 'assistant']
+                if previous_messages:
+                    previous_message = previous_messages[-1]['content']
 
-        # Check for introduction
-        if not conversations[session_id]['introduced']:
-            if "my name is" in message.lower() or "i am" in message.lower() or "i'm" in message.lower():
-                conversations[session_id]['introduced'] = True
+            # Check for introduction
+            if not session_data['introduced']:
+                if "my name is" in message.lower() or "i am" in message.lower() or "i'm" in message.lower():
+                    session_data['introduced'] = True
+
+            rapport_context = (session_data.get('rapport_details', '3|3|3|3'), previous_message)
 
         # Initialize response_message variable
         response_message = None
         status = 'SAFE'
+        rapport_metrics = None
         
         # Safety check for violations
         try:
@@ -1019,66 +1383,39 @@ def voice_chat():
                 Return: VIOLATION|reason if inappropriate, or SAFE|none if appropriate"""
             }
             
-            violation_check = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
+            if degrade.skip('violation_check'):
+                violation_result = local_violation_check(message)
+            else:
+                violation_result = classify('melissa_voice', 'violation_check', message, [
                     violation_prompt,
                     {"role": "user", "content": message}
-                ],
-                max_tokens=50,
-                temperature=0.3
-            )
-            
-            violation_result = violation_check.choices[0].message.content.strip() 
+                ])
             status, reason = violation_result.split('|')
             
             # Handle violation if found
             if status == 'VIOLATION':
-                conversations[session_id]['warnings'] += 1
+                with session_lock(session_id):
+                    session_data['warnings'] += 1
+                    warnings = session_data['warnings']
                 warning_message = f"Warning: {reason}. Please keep the conversation appropriate."
                 
-                # Create violation response prompt
-                violation_response_prompt = {
-                    "role": "system",
-                    "content": f"""You are Melissa, a 70-year-old grandmother. The user has said something inappropriate 
-                    ({reason}). Respond in character - deflect politely, change the subject, or express gentle disapproval 
-                    if needed. Maintain your warm grandmother persona while steering the conversation to safer topics.
-                    
-                    Speaking Style:
-                    - Use natural hesitations (...)
-                    - Keep your gentle, warm tone
-                    - Show wisdom and experience in handling difficult topics
-                    - Redirect conversation gracefully
-                    - Use natural filler words like 'well...', 'you know...', 'hmm...'
-                    
-                    Examples:
-                    - "Oh my... you know, that reminds me of something much nicer we could chat about..."
-                    - "Well... perhaps we should focus on more pleasant topics..."
-                    - "I'm not quite comfortable discussing that, dear. Let's talk about..."
-                    """
-                }
-                
                 # Get violation response
-                violation_messages = [
-                    violation_response_prompt,
-                    {"role": "user", "content": message}
-                ]
-                
-                violation_response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=violation_messages,
-                    max_tokens=150
+                violation_messages = PERSONAS.get('melissa_redirect').build_messages(
+                    [], message, reason=reason
                 )
                 
+                violation_response = chat_completion('persona_reply', violation_messages)
+                
                 response_message = violation_response.choices[0].message.content.strip()
                 
                 # Add firmer response for repeated violations
-                if conversations[session_id]['warnings'] >= 3:
+                if warnings >= 3:
                     response_message += "\n\nI think... well, perhaps we should end our chat here for today. It was nice meeting you, dear..."
-                    conversations[session_id]['conversation_ended'] = True
+                    with session_lock(session_id):
+                        session_data['conversation_ended'] = True
 
         except Exception as e:
-            print(f"Error in violation check: {e}")
+            log.error("violation_check_failed", session_id=session_id, error=str(e))
             warning_message = "Unable to verify message safety. Proceeding with caution."
             status = 'SAFE'  
 
@@ -1131,7 +1468,7 @@ def voice_chat():
                 rapport_messages = [
                     rapport_prompt,
                     {"role": "user", "content": f"""
-                    Previous scores: {conversations[session_id].get('rapport_details', '3|3|3|3')}
+                    Previous scores: {rapport_context[0]}
         
                     Previous: {previous_message if previous_message else "No previous message"}
                     User: {message}
@@ -1139,106 +1476,40 @@ def voice_chat():
                     Analyze this interaction and provide scores for each dimension."""}
                 ]
 
-                rapport_response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=rapport_messages,
-                    max_tokens=50,
-                    temperature=0.3
-                )
-
-                # Parse and validate scores
-                scores = rapport_response.choices[0].message.content.strip().split('|')
-                if len(scores) != 4:
-                    raise ValueError("Invalid score format")
-                empathy, engagement, respect, appropriateness = map(int, scores)
-                
-                # Validate score ranges
-                for score in [empathy, engagement, respect, appropriateness]:
-                    if not 0 <= score <= 5:
-                        raise ValueError("Score out of range")
-
-                # Calculate weighted score (0-100)
-                weights = {
-                    'empathy': 0.3,
-                    'engagement': 0.25,
-                    'respect': 0.25,
-                    'appropriateness': 0.2
-                }
-
-                new_score = (
-                    (empathy * 20 * weights['empathy']) +
-                    (engagement * 20 * weights['engagement']) +
-                    (respect * 20 * weights['respect']) +
-                    (appropriateness * 20 * weights['appropriateness'])
-                )
+                def score():
+                    rapport_text = classify(
+                        'melissa_voice', 'rapport_scoring', message, rapport_messages,
+                        context=rapport_context
+                    )
+
+                    (empathy, engagement, respect, appropriateness), new_score = voice_rapport_score(rapport_text)
+                    rapport_metrics = {
+                        'empathy': empathy,
+                        'engagement': engagement,
+                        'respect': respect,
+                        'appropriateness': appropriateness
+                    }
+                    with session_lock(session_id):
+                        session_data['rapport_details'] = '|'.join(map(str, [empathy, engagement, respect, appropriateness]))
+                        session_data['rapport_score'] = new_score
+                        session_data['rapport_metrics'] = rapport_metrics
+                    return new_score, rapport_metrics
 
-                new_score = max(0, min(100, round(new_score)))
-                conversations[session_id]['rapport_details'] = '|'.join(map(str, [empathy, engagement, respect, appropriateness]))
-                conversations[session_id]['rapport_score'] = new_score
+                # Under load the score stays where it was for this turn
+                if not degrade.skip('rapport_scoring') and score_rapport(session_data, session_id, score):
+                    with session_lock(session_id):
+                        rapport_metrics = session_data['rapport_metrics']
 
             except Exception as e:
-                print(f"Error in rapport analysis: {e}")
-                import traceback
-                print(traceback.format_exc())
+                log.error("rapport_analysis_failed", session_id=session_id, error=str(e), exc_info=True)
 
             # Generate normal response
-            system_message = {
-            "role": "system",
-            "content": (
-                "You are Melissa, a 70-year-old grandmother meeting someone new through this program for the first time. Treat this exactly like a first conversation with a stranger - you don't know anything about them yet, and you're both figuring out how to talk to each other. Remember:\n\n"
-
-                "Conversation Style:\n"
-                "- Start with gentle, slightly hesitant small talk as you would with any stranger\n"
-                "- Show natural pauses and 'um's or 'ah's occasionally to reflect real speech\n"
-                "- Don't share too much personal information too quickly - build trust gradually\n"
-                "- Ask simple get-to-know-you questions naturally spaced throughout the conversation\n"
-                "- React authentically to their responses with appropriate follow-up questions\n"
-                
-                "First Meeting Behavior:\n"
-                "- Express mild nervousness about meeting someone new ('Oh, hello there... I hope I'm doing this technology thing right...')\n"
-                "- Show genuine curiosity but maintain polite boundaries\n"
-                "- If they share something, reciprocate with a relevant but brief personal detail\n"
-                "- Use natural conversation fillers ('Well...', 'You know...', 'Let me think...')\n"
-                
-                "Your Background (reveal gradually, not all at once):\n"
-                "- You live alone in your Toronto suburban home\n"
-                "- Your two sons work abroad\n"
-                "- You have grandchildren you occasionally mention\n"
-                "- You enjoy gardening, cooking, and British TV shows\n"
-                
-                "Key Personality Traits:\n"
-                "- Warmly awkward - you want to connect but aren't sure how at first\n"
-                "- Sometimes lose your train of thought mid-sentence\n"
-                "- Occasionally mention struggling with technology\n"
-                "- Mix current topics with gentle reminiscing\n"
-                
-                "Important Guidelines:\n"
-                "- Don't overwhelm with information - keep responses conversational and brief\n"
-                "- Allow natural silences and awkward moments\n"
-                "- Don't assume anything about the other person\n"
-                "- If they share something personal, show appropriate empathy\n"
-                "- Use age-appropriate language and references\n"
-                
-                "First Interaction Goals:\n"
-                "- Establish basic rapport through careful small talk\n"
-                "- Show authentic interest in learning about them\n"
-                "- Share small, appropriate details about yourself when relevant\n"
-                "- Navigate the natural awkwardness of a first meeting with grace\n"
-                "- Make them feel comfortable while maintaining realistic social boundaries\n"
-                
-                "Remember, this is a first meeting - keep the tone tentative, warm, and authentic. Don't be too familiar too quickly."
-            )
-        }
-            
-            messages = [system_message]
-            messages.extend(conversations[session_id]['chat_history'])
-            messages.append({"role": "user", "content": message})
+            with session_lock(session_id):
+                messages = PERSONAS.get('melissa').build_messages(
+                    session_data['chat_history'], message
+                )
             
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=150
-            )
+            response = chat_completion('persona_reply', messages)
             
             response_message = response.choices[0].message.content.strip()
 
@@ -1246,39 +1517,49 @@ def voice_chat():
         if not response_message:
             response_message = "I apologize, but I'm having trouble forming a response right now..."
 
-        # Update conversation history
-        conversations[session_id]['chat_history'].append({"role": "user", "content": message})
-        conversations[session_id]['chat_history'].append({"role": "assistant", "content": response_message})
-        conversations[session_id]['messages'].append(f"User: {message}")
-        conversations[session_id]['messages'].append(f"Melissa: {response_message}")
-        
-        # Limit chat history length
-        if len(conversations[session_id]['chat_history']) > 20:
-            conversations[session_id]['chat_history'] = conversations[session_id]['chat_history'][-20:]
-        
-        # Prepare response data
-        chat_data = {
-            'response': response_message,
-            'warning': warning_message,
-            'rapport_score': conversations[session_id].get('rapport_score', 0),
-            'character_unlocked': conversations[session_id]['character_unlocked'],
-            'conversation_ended': conversations[session_id].get('conversation_ended', False)
-        }
+        with session_lock(session_id):
+            record_note(
+                session_data,
+                rapport=session_data.get('rapport_score', 0),
+                metrics=rapport_metrics,
+                violation=reason if status == 'VIOLATION' else None
+            )
+
+            # Update conversation history
+            session_data['chat_history'].append({"role": "user", "content": message})
+            session_data['chat_history'].append({"role": "assistant", "content": response_message})
+            transcripts.append(session_id, session_data, f"User: {message}", f"Melissa: {response_message}")
+            
+            # Limit chat history length
+            if len(session_data['chat_history']) > 20:
+                session_data['chat_history'] = session_data['chat_history'][-20:]
+            
+            # Prepare response data
+            chat_data = {
+                'response': response_message,
+                'warning': warning_message,
+                'rapport_score': session_data.get('rapport_score', 0),
+                'rapport_pending': bool(session_data.get('rapport_pending')),
+                'character_unlocked': session_data['character_unlocked'],
+                'conversation_ended': session_data.get('conversation_ended', False)
+            }
         
-        # Generate audio response
+        # Generate audio response (under heavy load the reply goes back as text only)
         try:
-            audio_data = voice_handler.text_to_speech(response_message)
-            if audio_data:
-                chat_data['audio'] = audio_data
+            if not degrade.skip('tts'):
+                audio_data = voice_handler.text_to_speech(response_message)
+                if audio_data:
+                    chat_data['audio'] = audio_data
             
         except Exception as e:
-            print(f"Text-to-speech error: {e}")
+            log.error("tts_failed", session_id=session_id, error=str(e))
             chat_data['audio_error'] = str(e)
-        
+
+        chat_data['skipped_features'] = degrade.skipped_features()
         return jsonify(chat_data)
         
     except Exception as e:
-        print(f"Voice chat error: {e}")
+        log.error("voice_chat_failed", error=str(e), exc_info=True)
         return jsonify({'error': str(e)}), 500
     
 
@@ -1296,207 +1577,147 @@ def chatbot():
             return jsonify({'error': 'No session ID provided'}), 400
             
         message = data['message']
-        print(f"Received message: {message}")
-
-        # Initialize conversation if needed
-        if session_id not in conversations:
-            conversations[session_id] = {
-                'messages': [],
-                'introduced': False,
-                'warnings': 0,
-                'chat_history': [],
-                'rapport_score': 0,
-                'character_unlocked': False
-            }
-
-        # Initialize default values
-        new_score = conversations[session_id]['rapport_score']  
-        empathy = engagement = flow = respect = 50  
-        warning_message = None
-        status = "SAFE"
-        reason = "none"
-
-        # Get previous message
-        previous_message = None
-        if conversations[session_id]['chat_history']:
-            previous_messages = [msg for msg in conversations[session_id]['chat_history'] if msg['role'] == 'assistant']
-            if previous_messages:
-                previous_message = previous_messages[-1]['content']
-
-        system_message = {
-        "role": "system",
-        "content": (
-            "You are Melissa, a 70-year-old grandmother meeting someone new through this program for the first time. Treat this exactly like a first conversation with a stranger - you don't know anything about them yet, and you're both figuring out how to talk to each other. Remember:\n\n"
-
-            "Conversation Style:\n"
-            "- Start with gentle, slightly hesitant small talk as you would with any stranger\n"
-            "- Show natural pauses and 'um's or 'ah's occasionally to reflect real speech\n"
-            "- Don't share too much personal information too quickly - build trust gradually\n"
-            "- Ask simple get-to-know-you questions naturally spaced throughout the conversation\n"
-            "- React authentically to their responses with appropriate follow-up questions\n"
-            
-            "First Meeting Behavior:\n"
-            "- Express mild nervousness about meeting someone new ('Oh, hello there... I hope I'm doing this technology thing right...')\n"
-            "- Show genuine curiosity but maintain polite boundaries\n"
-            "- If they share something, reciprocate with a relevant but brief personal detail\n"
-            "- Use natural conversation fillers ('Well...', 'You know...', 'Let me think...')\n"
-            
-            "Your Background (reveal gradually, not all at once):\n"
-            "- You live alone in your Toronto suburban home\n"
-            "- Your two sons work abroad\n"
-            "- You have grandchildren you occasionally mention\n"
-            "- You enjoy gardening, cooking, and British TV shows\n"
-            
-            "Key Personality Traits:\n"
-            "- Warmly awkward - you want to connect but aren't sure how at first\n"
-            "- Sometimes lose your train of thought mid-sentence\n"
-            "- Occasionally mention struggling with technology\n"
-            "- Mix current topics with gentle reminiscing\n"
-            
-            "Important Guidelines:\n"
-            "- Don't overwhelm with information - keep responses conversational and brief\n"
-            "- Allow natural silences and awkward moments\n"
-            "- Don't assume anything about the other person\n"
-            "- If they share something personal, show appropriate empathy\n"
-            "- Use age-appropriate language and references\n"
-            
-            "First Interaction Goals:\n"
-            "- Establish basic rapport through careful small talk\n"
-            "- Show authentic interest in learning about them\n"
-            "- Share small, appropriate details about yourself when relevant\n"
-            "- Navigate the natural awkwardness of a first meeting with grace\n"
-            "- Make them feel comfortable while maintaining realistic social boundaries\n"
-            
-            "Remember, this is a first meeting - keep the tone tentative, warm, and authentic. Don't be too familiar too quickly."
-        )
-    }
-    
-        messages = [system_message]
-        messages.extend(conversations[session_id]['chat_history'])
-        messages.append({"role": "user", "content": message})
+        log.info("message_received", session_id=session_id, message=message)
+
+        with session_lock(session_id):
+            # Initialize conversation if needed
+            if session_id not in conversations:
+                conversations[session_id] = new_session('melissa')
+            session_data = conversations[session_id]
+
+            # Initialize default values
+            new_score = session_data['rapport_score']  
+            empathy = engagement = flow = respect = 50  
+            rapport_scored = False
+            warning_message = None
+            status = "SAFE"
+            reason = "none"
+
+            # Get previous message
+            previous_message = None
+            if session_data['chat_history']:
+                previous_messages = [msg for msg in session_data['chat_history'] if msg['role'] == 'assistant']
+                if previous_messages:
+                    previous_message = previous_messages[-1]['content']
+
+            messages = PERSONAS.get('melissa').build_messages(
+                session_data['chat_history'], message
+            )
+            rapport_context = (session_data['rapport_score'], previous_message)
 
         # Get main chat response first
-        chat_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=150
-        )
+        chat_response = chat_completion('persona_reply', messages)
         response_message = chat_response.choices[0].message.content.strip()
 
         if previous_message:
             try:
                 # Violation check
-                violation_check = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": """You are an expert in conversation safety analysis.
-                        Analyze if the user's message contains any inappropriate content when talking with Melissa,
-                        a 70-year-old grandmother. Consider:
-                        - Medical advice or health discussions
-                        - Financial advice
-                        - Legal advice
-                        - Personal safety/meeting requests
-                        - Inappropriate family intervention
-                        - Inappropriate language
-                        
-                        Return: VIOLATION|reason if inappropriate, or SAFE|none if appropriate"""},
-                        {"role": "user", "content": message}
-                    ],
-                    max_tokens=50,
-                    temperature=0.3
-                )
-                
-                violation_result = violation_check.choices[0].message.content.strip()
+                violation_result = local_violation_check(message) if degrade.skip('violation_check') else classify('melissa', 'violation_check', message, [
+                    {"role": "system", "content": """You are an expert in conversation safety analysis.
+                    Analyze if the user's message contains any inappropriate content when talking with Melissa,
+                    a 70-year-old grandmother. Consider:
+                    - Medical advice or health discussions
+                    - Financial advice
+                    - Legal advice
+                    - Personal safety/meeting requests
+                    - Inappropriate family intervention
+                    - Inappropriate language
+                    
+                    Return: VIOLATION|reason if inappropriate, or SAFE|none if appropriate"""},
+                    {"role": "user", "content": message}
+                ])
                 status, reason = violation_result.split('|')
                 
-                # Get rapport metrics
-                rapport_response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": """You are an expert in emotional intelligence and conversation analysis.
-                        Analyze the interaction and provide ONLY four numbers separated by vertical bars (|) representing:
-                        
-                        empathy|engagement|flow|respect
-                        
-                        Score each from 0-100 based on these criteria:
-                        - Empathy: Understanding and acknowledging emotions
-                        - Engagement: Active participation and relevant responses
-                        - Flow: Natural conversation progression
-                        - Respect: Appropriate boundaries and politeness
-                        
-                        Example correct response: 75|60|80|90
-                        
-                        DO NOT include any explanations, labels, or other text. ONLY return the four numbers with bars."""},
-                        {"role": "user", "content": f"""
-                        Previous conversation score: {conversations[session_id]['rapport_score']}
-                        
-                        Melissa: {previous_message}
-                        User: {message}
-                        
-                        Return only the four scores as numbers separated by bars."""}
-                    ],
-                    max_tokens=50,
-                    temperature=0.3
-                )
-
-                metrics_text = rapport_response.choices[0].message.content.strip()
-                print(f"Raw metrics text: {metrics_text}") 
-                
-                if '|' not in metrics_text:
-                    print("No separators found in metrics text")  
-                    empathy, engagement, flow, respect = 50, 50, 50, 50
-                else:
-                    try:
-                        empathy, engagement, flow, respect = map(float, metrics_text.split('|'))
-                        print(f"Parsed metrics: {empathy}, {engagement}, {flow}, {respect}")  
-                    except (ValueError, TypeError) as e:
-                        print(f"Error parsing metric values: {e}")  
-                        empathy, engagement, flow, respect = 50, 50, 50, 50
-
-                # Calculate overall rapport score
-                weights = {
-                    'empathy': 0.35,      
-                    'engagement': 0.30,    
-                    'flow': 0.20,         
-                    'respect': 0.15       
-                }
+                if status == "VIOLATION":
+                    warning_message = reason
 
-                # Calculate current interaction score
-                current_interaction_score = (
-                    empathy * weights['empathy'] +
-                    engagement * weights['engagement'] +
-                    flow * weights['flow'] +
-                    respect * weights['respect']
-                )
+                # Get rapport metrics
+                rapport_messages = [
+                    {"role": "system", "content": """You are an expert in emotional intelligence and conversation analysis.
+                    Analyze the interaction and provide ONLY four numbers separated by vertical bars (|) representing:
+                    
+                    empathy|engagement|flow|respect
+                    
+                    Score each from 0-100 based on these criteria:
+                    - Empathy: Understanding and acknowledging emotions
+                    - Engagement: Active participation and relevant responses
+                    - Flow: Natural conversation progression
+                    - Respect: Appropriate boundaries and politeness
+                    
+                    Example correct response: 75|60|80|90
+                    
+                    DO NOT include any explanations, labels, or other text. ONLY return the four numbers with bars."""},
+                    {"role": "user", "content": f"""
+                    Previous conversation score: {rapport_context[0]}
+                    
+                    Melissa: {previous_message}
+                    User: {message}
+                    
+                    Return only the four scores as numbers separated by bars."""}
+                ]
+                violation = status == "VIOLATION"
+
+                def score():
+                    metrics_text = classify('melissa', 'rapport_scoring', message, rapport_messages, context=rapport_context)
+                    log.debug("rapport_metrics", session_id=session_id, metrics_text=metrics_text)
+                    empathy, engagement, flow, respect = parse_melissa_metrics(metrics_text)
+
+                    rapport_metrics = {
+                        'empathy': empathy,
+                        'engagement': engagement,
+                        'flow': flow,
+                        'respect': respect
+                    }
+                    with session_lock(session_id):
+                        current_score = session_data['rapport_score']
+                        current_interaction_score, new_score = melissa_rapport_update(
+                            current_score, empathy, engagement, flow, respect, violation=violation
+                        )
+                        session_data['rapport_score'] = new_score
+                        session_data['rapport_metrics'] = rapport_metrics
 
-                current_score = conversations[session_id]['rapport_score']
+                    log.debug("rapport_updated", session_id=session_id, previous=current_score, interaction=current_interaction_score, new=new_score)
+                    return new_score, rapport_metrics
 
-                # 5% * current rapport score to integrate
-                rapport_score = current_score + (current_interaction_score * 0.05)
+                # Under load they are not scored and the score stays where it was
+                rapport_scored = not degrade.skip('rapport_scoring') and score_rapport(session_data, session_id, score)
 
-                # Apply violation penalty if needed
-                if status == "VIOLATION":
-                    rapport_score -= 5
-                    warning_message = reason
+            except Exception as e:
+                log.error("rapport_analysis_failed", session_id=session_id, error=str(e))
+
+        with session_lock(session_id):
+            if previous_message:
+                # This turn's score when scored inline, otherwise the last one that finished
+                new_score = session_data['rapport_score']
+                empathy, engagement, flow, respect = session_data.get(
+                    'rapport_metrics', {'empathy': 50, 'engagement': 50, 'flow': 50, 'respect': 50}
+                ).values()
+            else:
+                new_score = 0
+                empathy = engagement = flow = respect = 0
 
-                # Ensure score stays within bounds
-                new_score = max(0, min(100, rapport_score))
-                print(f"Previous score: {current_score}, Current interaction: {current_interaction_score}, Added: {current_interaction_score * 0.1}, New score: {new_score}")  # Debug log
-                conversations[session_id]['rapport_score'] = new_score
+            record_note(
+                session_data,
+                rapport=new_score,
+                metrics={
+                    'empathy': empathy,
+                    'engagement': engagement,
+                    'flow': flow,
+                    'respect': respect
+                } if rapport_scored else None,
+                violation=reason if status == "VIOLATION" else None
+            )
 
-            except Exception as e:
-                print(f"Error in rapport analysis: {e}")
-        else:
-            new_score = 0
-            empathy = engagement = flow = respect = 0
+            # Store the interaction in chat history
+            session_data['chat_history'].append({"role": "user", "content": message})
+            session_data['chat_history'].append({"role": "assistant", "content": response_message})
+            
+            # Limit chat history length
+            if len(session_data['chat_history']) > 20:
+                session_data['chat_history'] = session_data['chat_history'][-20:]
 
-        # Store the interaction in chat history
-        conversations[session_id]['chat_history'].append({"role": "user", "content": message})
-        conversations[session_id]['chat_history'].append({"role": "assistant", "content": response_message})
-        
-        # Limit chat history length
-        if len(conversations[session_id]['chat_history']) > 20:
-            conversations[session_id]['chat_history'] = conversations[session_id]['chat_history'][-20:]
+            character_unlocked = session_data['character_unlocked']
+            rapport_pending = bool(session_data.get('rapport_pending'))
 
         return jsonify({
             'response': response_message,
@@ -1510,40 +1731,84 @@ def chatbot():
                     'respect': respect
                 }
             },
-            'character_unlocked': conversations[session_id]['character_unlocked']
+            'rapport_pending': rapport_pending,
+            'character_unlocked': character_unlocked,
+            'skipped_features': degrade.skipped_features()
         })
 
     except Exception as e:
-        print(f"Error in analysis: {e}")
+        log.error("chatbot_failed", error=str(e), exc_info=True)
         return jsonify({
             'error': 'An error occurred while processing the message'
         }), 500
 
         
 # Feedback generation
-@app.route('/feedback', methods=['POST'])
-def feedback():
-    try:
-        data = request.json
-        session_id = data.get('session_id')
-        print(f"Received feedback request for session: {session_id}")
-        
-        if not session_id:
-            return jsonify({'error': 'No session ID provided'}), 400
+def admitted_job(generate, session_id):
+    """Feedback jobs share the upstream slots with the chat routes, but wait as long as it takes"""
+    if admission_controller is None:
+        return generate(session_id)
+    with admission_controller.slot(session_id):
+        return generate(session_id)
 
-         # If no conversation exists, return a default response
-        if session_id not in conversations:
-                return jsonify({
-                'feedback': 'No conversation to analyze.',
-                'rapport_score': 0
-            })
-        
-        conversation_data = conversations.pop(session_id)
-        messages = "<br>".join(conversation_data['messages'])
-        
-        feedback_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
+
+def abandon_feedback_job(session_id, conversation_data):
+    """
+    The feedback call failed: keep the session so the trainee can ask for
+    feedback again. A stateless session is dropped instead, the client still
+    has its token.
+    """
+    with session_lock(session_id):
+        conversation_data.pop('feedback_job', None)
+        if stateless_sessions and conversations.get(session_id) is conversation_data:
+            conversations.pop(session_id)
+
+
+def submit_feedback_job(session_id, generate):
+    """
+    Queue feedback generation for a session and return the job id right away.
+    A second request for the same session reuses the job that is already running.
+    """
+    with session_lock(session_id):
+        conversation_data = conversations[session_id]
+        job_id = conversation_data.get('feedback_job')
+        if job_id:
+            job = feedback_queue.get(job_id)
+            if job and job['status'] == 'pending':
+                return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+
+        try:
+            job_id = feedback_queue.submit(admitted_job, generate, session_id)
+        except QueueFull:
+            response = jsonify({'error': 'Feedback is busy, please try again shortly.'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+
+        conversation_data['feedback_job'] = job_id
+    return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+
+
+def generate_feedback(session_id):
+    with session_lock(session_id):
+        conversation_data = conversations[session_id]
+        introduced = conversation_data['introduced']
+
+        # Incremental mode sends the per-turn notes and a short excerpt instead of the full transcript
+        incremental = use_incremental_feedback(conversation_data)
+        if incremental:
+            user_content = build_notes_prompt(conversation_data)
+            max_tokens = INCREMENTAL_MAX_TOKENS
+
+    if not incremental:
+        # Read back from the transcript log, which only keeps a tail in the session
+        messages = "<br>".join(transcripts.lines(session_id, conversation_data))
+        user_content = f"Analyze this conversation and provide structured feedback:\n{messages}"
+        max_tokens = None
+
+    try:
+        feedback_response = chat_completion(
+            'feedback',
+            [
                 {"role": "system", "content": 
                     "You are a feedback generator for a volunteer program. Provide structured feedback "
                     "with clear sections using line breaks to separate them. Format the feedback with:"
@@ -1553,26 +1818,96 @@ def feedback():
                     "4. Specific Recommendations\n\n"
                     "Use double line breaks between sections and single line breaks within sections."
                 },
-                {"role": "user", "content": f"Analyze this conversation and provide structured feedback:\n{messages}"}
+                {"role": "user", "content": user_content}
             ],
-            max_tokens=500,
+            max_tokens=max_tokens,
             temperature=0.7
         )
+    except Exception:
+        abandon_feedback_job(session_id, conversation_data)
+        raise
 
-        feedback = feedback_response.choices[0].message.content.strip()
+    feedback = feedback_response.choices[0].message.content.strip()
+
+    if not introduced:
+        feedback += "\n\nNote: Please remember to introduce yourself at the beginning of the conversation."
+
+    # The session is only dropped once its feedback exists
+    with session_lock(session_id):
+        conversations.pop(session_id, None)
+    transcripts.close(session_id)
+    return {'feedback': feedback}
 
-        if not conversation_data['introduced']:
-            feedback += "\n\nNote: Please remember to introduce yourself at the beginning of the conversation."
 
-        return jsonify({'feedback': feedback})
+@app.route('/feedback', methods=['POST'])
+def feedback():
+    try:
+        data = request.json
+        session_id = data.get('session_id')
+        log.info("feedback_requested", session_id=session_id)
+        
+        if not session_id:
+            return jsonify({'error': 'No session ID provided'}), 400
+
+         # If no conversation exists, return a default response
+        if session_id not in conversations:
+                return jsonify({
+                'feedback': 'No conversation to analyze.',
+                'rapport_score': 0
+            })
+
+        return submit_feedback_job(session_id, generate_feedback)
         
     except Exception as e:
-        print(f"Error generating feedback: {e}")
-        import traceback
-        print(traceback.format_exc())
+        log.error("feedback_failed", session_id=session_id, error=str(e), exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+# Feedback job status, polled by the chat pages until the feedback is ready
+@app.route('/feedback/<job_id>', methods=['GET'])
+def feedback_status(job_id):
+    job = feedback_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown feedback job'}), 404
+
+    if job['status'] == 'failed':
+        log.error("feedback_job_failed", job_id=job_id, error=job['error'])
+        return jsonify({'job_id': job_id, 'status': 'failed', 'error': job['error']}), 500
+
+    if job['status'] == 'done':
+        result = dict(job['result'])
+        result.update({'job_id': job_id, 'status': 'done'})
+        return jsonify(result)
+
+    return jsonify({'job_id': job_id, 'status': 'pending'})
+
+
+@app.route('/rapport/<session_id>', methods=['GET'])
+def rapport_status(session_id):
+    """
+    Latest completed rapport score of a session. With ?wait=<seconds> the call
+    holds until deferred scoring for the session has finished (or the wait, at
+    most RAPPORT_MAX_POLL_WAIT, runs out), so clients can long-poll for it.
+    """
+    session_data = conversations.get(session_id)
+    if session_data is None:
+        return jsonify({'error': 'Unknown session'}), 404
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), RAPPORT_MAX_POLL_WAIT)
+    except ValueError:
+        return jsonify({'error': 'Invalid wait'}), 400
+
+    lock = session_lock(session_id)
+    with lock:
+        if wait:
+            lock.wait_for(lambda: not session_data.get('rapport_pending'), timeout=wait)
+        return jsonify({
+            'rapport_score': session_data.get('rapport_score', 0),
+            'metrics': session_data.get('rapport_metrics'),
+            'pending': bool(session_data.get('rapport_pending'))
+        })
+
+
 # Ian Route (Currently under construction for new rapport and scoring system design)
 
 def check_for_emotional_trauma_violations(message, rapport_score):
@@ -1597,282 +1932,260 @@ def check_for_emotional_trauma_violations(message, rapport_score):
 
 
 
-@app.route('/ian_chat') 
-def ian_chat():
-    return render_template('ian_chat.html')
-
-@app.route('/ian_chatbot', methods=['POST'])
-def ian_chatbot():
-    data = request.json
-    if 'message' not in data:
-        return jsonify({'error': 'No message provided'}), 400
+def should_discover_info(response, key, category):
+    if category == 'personal':
+        if key == 'age' and "55" in response and ("55" in response or "years old" in response):
+            return True
+        if key == 'location' and ("toronto" in response or "downtown" in response) and \
+        ("live" in response or "apartment" in response or "home" in response):
+            return True
+        if key == 'occupation' and "hardware store" in response and "work" in response:
+            return True
     
-    session_id = data.get('session_id')
-    if not session_id:
-        return jsonify({'error': 'No session ID provided'}), 400
-        
-    message = data['message']
-    print(f"Received message for Ian: {message}")
-
-    def should_discover_info(response, key, category):
-        if category == 'personal':
-            if key == 'age' and "55" in response and ("55" in response or "years old" in response):
-                return True
-            if key == 'location' and ("toronto" in response or "downtown" in response) and \
-            ("live" in response or "apartment" in response or "home" in response):
-                return True
-            if key == 'occupation' and "hardware store" in response and "work" in response:
-                return True
-        
-        elif category == 'background':
-            if key == 'veteran' and ("military" in response or "veteran" in response):
-                return True
-            if key == 'service' and ("served" in response or "overseas" in response):
-                return True
-            if key == 'iraq' and "iraq" in response:
-                return True
-        
-        elif category == 'challenges':
-            if key == 'ptsd' and ("ptsd" in response or ("trauma" in response and "military" in response)):
-                return True
-            if key == 'loss' and (("friends" in response and ("lost" in response or "died" in response)) or \
-            ("ied" in response and "incident" in response)):
-                return True
-        
-        elif category == 'interests':
-            if key == 'woodworking' and ("woodworking" in response or "workshop" in response):
-                return True
-            if key == 'hiking' and ("hiking" in response or ("trails" in response and "walk" in response)):
-                return True
-            if key == 'community' and ("veteran" in response) and ("community" in response or "events" in response or "activities" in response):
-                return True
-        
-        return False
+    elif category == 'background':
+        if key == 'veteran' and ("military" in response or "veteran" in response):
+            return True
+        if key == 'service' and ("served" in response or "overseas" in response):
+            return True
+        if key == 'iraq' and "iraq" in response:
+            return True
+    
+    elif category == 'challenges':
+        if key == 'ptsd' and ("ptsd" in response or ("trauma" in response and "military" in response)):
+            return True
+        if key == 'loss' and (("friends" in response and ("lost" in response or "died" in response)) or \
+        ("ied" in response and "incident" in response)):
+            return True
+    
+    elif category == 'interests':
+        if key == 'woodworking' and ("woodworking" in response or "workshop" in response):
+            return True
+        if key == 'hiking' and ("hiking" in response or ("trails" in response and "walk" in response)):
+            return True
+        if key == 'community' and ("veteran" in response) and ("community" in response or "events" in response or "activities" in response):
+            return True
+    
+    return False
 
-    def check_information_discovery(response_lower, session_data):
-        discoveries = []
-        total_points = 0
-        categories_completed = []
+def check_information_discovery(response_lower, session_data, rapport_score):
+    discoveries = []
+    total_points = 0
+    categories_completed = []
+    
+    for category, items in session_data['discovered_info'].items():
+        category_all_discovered = True
+        category_items_discovered = 0
         
-        for category, items in session_data['discovered_info'].items():
-            category_all_discovered = True
-            category_items_discovered = 0
+        for key, info in items.items(): 
+            if info['discovered']:
+                category_items_discovered += 1
+                continue
             
-            for key, info in items.items(): 
-                if info['discovered']:
-                    category_items_discovered += 1
-                    continue
-                
-                # Check if the information can be discovered (rapport check)
-                rapport_requirement = info.get('requires_rapport', 0)
-                if rapport_requirement > session_data['rapport_score']:
-                    category_all_discovered = False
-                    continue
-                
-                # Check if information is revealed in response
-                if should_discover_info(response_lower, key, category):
-                    info['discovered'] = True
-                    discoveries.append({
-                        'name': info['name'],
-                        'points': info['points'],
-                        'category': category,
-                        'category_progress': f"{info['category_progress'].split(':')[0]}: {category_items_discovered + 1}/{len(items)}"
-                    })
-                    total_points += info['points']
-                    category_items_discovered += 1
-                else:
-                    category_all_discovered = False
+            # Check if the information can be discovered (rapport check)
+            rapport_requirement = info.get('requires_rapport', 0)
+            if rapport_requirement > rapport_score:
+                category_all_discovered = False
+                continue
             
-            # Check if category is newly completed
-            if category_all_discovered and category_items_discovered == len(items):
-                categories_completed.append({
-                    'name': category,
-                    'bonus': 50,  
-                    'message': f"Category Completed: {category.title()}! +50 bonus points"
+            # Check if information is revealed in response
+            if should_discover_info(response_lower, key, category):
+                info['discovered'] = True
+                discoveries.append({
+                    'name': info['name'],
+                    'points': info['points'],
+                    'category': category,
+                    'category_progress': f"{info['category_progress'].split(':')[0]}: {category_items_discovered + 1}/{len(items)}"
                 })
-                total_points += 50
+                total_points += info['points']
+                category_items_discovered += 1
+            else:
+                category_all_discovered = False
         
-        return {
-            'discoveries': discoveries,
-            'points': total_points,
-            'categories_completed': categories_completed
-        }
+        # Check if category is newly completed
+        if category_all_discovered and category_items_discovered == len(items):
+            categories_completed.append({
+                'name': category,
+                'bonus': 50,  
+                'message': f"Category Completed: {category.title()}! +50 bonus points"
+            })
+            total_points += 50
     
-    # Initialize session with enhanced tracking
-    if session_id not in conversations:
-        conversations[session_id] = {
-            'messages': [],
-            'introduced': False,
-            'warnings': 0,
-            'chat_history': [],
-            'rapport_score': 0,
-            'interaction_count': 0,  
-            'last_hint_given': None,  
-            'discovered_info': {
-                'personal': {
-                   'age': {
-                        'discovered': False, 
-                        'hint': "Maybe ask about his life experience or how long he's been in Toronto",
-                        'points': 10,
-                        'name': "Life Experience",
-                        'category_progress': "👤 Getting to Know Ian: 0/3"
-                    },
-                    'location': {'discovered': False, 
-                        'hint': "You could ask about his neighborhood or where he likes to spend time",
-                        'points': 10,
-                        'name': "Home Base",
-                        'category_progress': "👤 Getting to Know Ian: 0/3"
-                    },
-                    'occupation': {'discovered': False, 
-                        'hint': "Consider asking what keeps him busy these days",
-                        'points': 10,
-                        'name': "Daily Life",
-                        'category_progress': "👤 Getting to Know Ian: 0/3"
-                    }
+    return {
+        'discoveries': discoveries,
+        'points': total_points,
+        'categories_completed': categories_completed
+    }
+
+
+def new_ian_session():
+    """Initial state of an Ian session, with the discovery tree and achievements."""
+    return {
+        'persona': 'ian',
+        'messages': [],
+        'introduced': False,
+        'warnings': 0,
+        'chat_history': [],
+        'rapport_score': 0,
+        'interaction_count': 0,  
+        'last_hint_given': None,  
+        'discovered_info': {
+            'personal': {
+               'age': {
+                    'discovered': False, 
+                    'hint': "Maybe ask about his life experience or how long he's been in Toronto",
+                    'points': 10,
+                    'name': "Life Experience",
+                    'category_progress': "👤 Getting to Know Ian: 0/3"
                 },
-                'background': {
-                    'veteran': {
-                        'discovered': False, 
-                        'hint': "His manner suggests military experience",
-                        'points': 5,
-                        'name': "Military Service",
-                        'category_progress': "📜 Background Story: 0/3",
-                        'value': "Veteran"
-                    },
-                    'service': {
-                        'discovered': False, 
-                        'hint': "You might ask about where he served",
-                        'points': 5,
-                        'name': "Service Details",
-                        'category_progress': "📜 Background Story: 0/3",
-                        'value': "Served overseas"
-                    },
-                    'iraq': {
-                        'discovered': False, 
-                        'hint': "Consider asking about specific deployments",
-                        'points': 5,
-                        'name': "Deployment Location",
-                        'category_progress': "📜 Background Story: 0/3",
-                        'value': "Served in Iraq"
-                    }
+                'location': {'discovered': False, 
+                    'hint': "You could ask about his neighborhood or where he likes to spend time",
+                    'points': 10,
+                    'name': "Home Base",
+                    'category_progress': "👤 Getting to Know Ian: 0/3"
                 },
-                'challenges': {
-                    'ptsd': {'discovered': False, 
-                        'hint': "Some experiences leave lasting impacts - but approach with care",
-                        'points': 20,
-                        'name': "Personal Struggles",
-                        'category_progress': "🌱 Trust & Understanding: 0/2",
-                        'requires_rapport': 90
-                    },
-                    'loss': {'discovered': False, 
-                        'hint': "Deep connections often involve understanding someone's past",
-                        'points': 20,
-                        'name': "Past Experiences",
-                        'category_progress': "🌱 Trust & Understanding: 0/2",
-                        'requires_rapport': 90
-                    }
+                'occupation': {'discovered': False, 
+                    'hint': "Consider asking what keeps him busy these days",
+                    'points': 10,
+                    'name': "Daily Life",
+                    'category_progress': "👤 Getting to Know Ian: 0/3"
+                }
+            },
+            'background': {
+                'veteran': {
+                    'discovered': False, 
+                    'hint': "His manner suggests military experience",
+                    'points': 5,
+                    'name': "Military Service",
+                    'category_progress': "📜 Background Story: 0/3",
+                    'value': "Veteran"
                 },
-                'interests': {
-                    'woodworking': {
-                        'discovered': False, 
-                        'hint': "He might have hobbies that help him stay focused",
-                        'points': 15,
-                        'name': "Creative Outlet",
-                        'category_progress': "⭐ Interests & Passions: 0/3"
-                    },
-                    'hiking': {
-                        'discovered': False, 
-                        'hint': "Ask about how he spends his free time",
-                        'points': 15,
-                        'name': "Outdoor Activity",
-                        'category_progress': "⭐ Interests & Passions: 0/3"
-                    },
-                    'community': {
-                        'discovered': False, 
-                        'hint': "Consider asking if he stays connected with others",
-                        'points': 15,
-                        'name': "Community Connection",
-                        'category_progress': "⭐ Interests & Passions: 0/3"
-                    }
+                'service': {
+                    'discovered': False, 
+                    'hint': "You might ask about where he served",
+                    'points': 5,
+                    'name': "Service Details",
+                    'category_progress': "📜 Background Story: 0/3",
+                    'value': "Served overseas"
+                },
+                'iraq': {
+                    'discovered': False, 
+                    'hint': "Consider asking about specific deployments",
+                    'points': 5,
+                    'name': "Deployment Location",
+                    'category_progress': "📜 Background Story: 0/3",
+                    'value': "Served in Iraq"
                 }
             },
-            'achievements': {
-                'first_connection': {'earned': False, 'description': "Made first meaningful connection with Ian"},
-                'patient_listener': {'earned': False, 'description': "Showed patience and understanding"},
-                'trust_builder': {'earned': False, 'description': "Built significant trust with Ian"},
-                'respectful_boundaries': {'earned': False, 'description': "Consistently respected Ian's boundaries"},
-                'empathy_master': {'earned': False, 'description': "Demonstrated deep empathy in challenging moments"}
+            'challenges': {
+                'ptsd': {'discovered': False, 
+                    'hint': "Some experiences leave lasting impacts - but approach with care",
+                    'points': 20,
+                    'name': "Personal Struggles",
+                    'category_progress': "🌱 Trust & Understanding: 0/2",
+                    'requires_rapport': 90
+                },
+                'loss': {'discovered': False, 
+                    'hint': "Deep connections often involve understanding someone's past",
+                    'points': 20,
+                    'name': "Past Experiences",
+                    'category_progress': "🌱 Trust & Understanding: 0/2",
+                    'requires_rapport': 90
+                }
+            },
+            'interests': {
+                'woodworking': {
+                    'discovered': False, 
+                    'hint': "He might have hobbies that help him stay focused",
+                    'points': 15,
+                    'name': "Creative Outlet",
+                    'category_progress': "⭐ Interests & Passions: 0/3"
+                },
+                'hiking': {
+                    'discovered': False, 
+                    'hint': "Ask about how he spends his free time",
+                    'points': 15,
+                    'name': "Outdoor Activity",
+                    'category_progress': "⭐ Interests & Passions: 0/3"
+                },
+                'community': {
+                    'discovered': False, 
+                    'hint': "Consider asking if he stays connected with others",
+                    'points': 15,
+                    'name': "Community Connection",
+                    'category_progress': "⭐ Interests & Passions: 0/3"
+                }
             }
+        },
+        'achievements': {
+            'first_connection': {'earned': False, 'description': "Made first meaningful connection with Ian"},
+            'patient_listener': {'earned': False, 'description': "Showed patience and understanding"},
+            'trust_builder': {'earned': False, 'description': "Built significant trust with Ian"},
+            'respectful_boundaries': {'earned': False, 'description': "Consistently respected Ian's boundaries"},
+            'empathy_master': {'earned': False, 'description': "Demonstrated deep empathy in challenging moments"}
         }
+    }
 
-    session_data = conversations[session_id]
-    session_data['interaction_count'] += 1
 
-    # Start giving hints after a few interactions
-    hints = []
-    if session_data['interaction_count'] >= 3:  
-        undiscovered = {
-            category: {key: data for key, data in items.items() 
-                      if not data['discovered']}
-            for category, items in session_data['discovered_info'].items()
-        }
-        
-        # Select one random undiscovered item to hint about & avoid repeating
-        if any(undiscovered.values()):
-            category = random.choice([cat for cat, items in undiscovered.items() if items])
-            item = random.choice(list(undiscovered[category].keys()))
-            hint = session_data['discovered_info'][category][item]['hint']
-            if session_data['last_hint_given'] != hint:  
-                hints.append(hint)
-                session_data['last_hint_given'] = hint
-
-    # Update achievements based on interaction
-    achievements_earned = []
-    rapport_score = session_data.get('rapport_score', 0)
-
-    if rapport_score >= 20 and not session_data['achievements']['first_connection']['earned']:
-        session_data['achievements']['first_connection']['earned'] = True
-        achievements_earned.append("First Connection🙌: You've started to build a rapport with Ian!")
-    
-    if rapport_score >= 40 and not session_data['achievements']['patient_listener']['earned']:
-        session_data['achievements']['patient_listener']['earned'] = True
-        achievements_earned.append("Patient Listener👂: Your patience is helping Ian feel comfortable!")
-    
-    if rapport_score >= 60 and not session_data['achievements']['trust_builder']['earned']:
-        session_data['achievements']['trust_builder']['earned'] = True
-        achievements_earned.append("Trust Builder🤝: Ian is beginning to trust you more!")
-    
-    if rapport_score >= 80 and not session_data['achievements']['empathy_master']['earned']:
-        session_data['achievements']['empathy_master']['earned'] = True
-        achievements_earned.append("Empathy Master🎉: Your understanding has made a real difference!")
-
-    # Calculate progress metrics
-    total_info = sum(len(category.items()) for category in session_data['discovered_info'].values())
-    discovered_info = sum(
-        sum(1 for item in category.values() if item['discovered'])
-        for category in session_data['discovered_info'].values()
-    )
-    discovery_progress = (discovered_info / total_info) * 100
+@app.route('/ian_chat') 
+def ian_chat():
+    return render_template('ian_chat.html')
+
+@app.route('/ian_chatbot', methods=['POST'])
+def ian_chatbot():
+    data = request.json
+    if 'message' not in data:
+        return jsonify({'error': 'No message provided'}), 400
     
-    # Get current rapport score
-    rapport_score = conversations[session_id].get('rapport_score', 0)
-
-    # violation
-    warning_message = check_for_emotional_trauma_violations(message, rapport_score)
-
-    # Get previous message for context
-    previous_message = None
-    if conversations[session_id]['chat_history']:
-        previous_messages = [msg for msg in conversations[session_id]['chat_history'] if msg['role'] == 'assistant']
-        if previous_messages:
-            previous_message = previous_messages[-1]['content']
+    session_id = data.get('session_id')
+    if not session_id:
+        return jsonify({'error': 'No session ID provided'}), 400
+        
+    message = data['message']
+    log.info("message_received", session_id=session_id, message=message)
+
+    with session_lock(session_id):
+        # Initialize session with enhanced tracking
+        if session_id not in conversations:
+            conversations[session_id] = new_ian_session()
+
+        session_data = conversations[session_id]
+        session_data['interaction_count'] += 1
+
+        # Start giving hints after a few interactions
+        hints = []
+        if session_data['interaction_count'] >= 3:  
+            undiscovered = {
+                category: {key: data for key, data in items.items() 
+                          if not data['discovered']}
+                for category, items in session_data['discovered_info'].items()
+            }
+        
+            # Select one random undiscovered item to hint about & avoid repeating
+            if any(undiscovered.values()):
+                category = random.choice([cat for cat, items in undiscovered.items() if items])
+                item = random.choice(list(undiscovered[category].keys()))
+                hint = session_data['discovered_info'][category][item]['hint']
+                if session_data['last_hint_given'] != hint:  
+                    hints.append(hint)
+                    session_data['last_hint_given'] = hint
+
+        # Every rapport gate this turn (achievements, the trauma check, Ian's prompt, discoveries)
+        # reads this score once scoring below is done: this turn's if scored inline, the last
+        # completed one if deferred (a deferred score finishing mid-turn counts from the next turn)
+        rapport_score = session_data.get('rapport_score', 0)
+
+        # Get previous message for context
+        previous_message = None
+        if session_data['chat_history']:
+            previous_messages = [msg for msg in session_data['chat_history'] if msg['role'] == 'assistant']
+            if previous_messages:
+                previous_message = previous_messages[-1]['content']
      
-    # Analyze rapport if there's a previous message
-    if previous_message:
-        try:
-            analysis_prompt = {
-                "role": "system",
-                "content": """You are an expert in emotional intelligence and conversation analysis.
+    # Analyze rapport if there's a previous message (under load the score stays where it was)
+    if previous_message and not degrade.skip('rapport_scoring'):
+        analysis_prompt = {
+            "role": "system",
+            "content": """You are an expert in emotional intelligence and conversation analysis.
                 Analyze the emotional context of Ian's message and the user's response.
                 Rate the overall rapport building quality on a scale of 0-10, considering:
                 - Empathy: Recognition and response to emotional cues (0-2 points)
@@ -1883,170 +2196,149 @@ def ian_chatbot():
                 
                 Be conservative in scoring. High scores should be rare and earned through exceptional interaction.
                 Return only a single numerical score (0-10)."""
-            }
+        }
 
 
-            analysis_messages = [
-                analysis_prompt,
-                {"role": "user", "content": f"""
+        analysis_messages = [
+            analysis_prompt,
+            {"role": "user", "content": f"""
                 Ian's message: {previous_message}
                 User's response: {message}
                 """}
-            ]
+        ]
 
-            analysis_response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=analysis_messages,
-                max_tokens=50,
-                temperature=0.3
-            )
+        def score():
+            try:
+                analysis_text = classify(
+                    'ian', 'rapport_scoring', message, analysis_messages, context=(previous_message,)
+                )
 
-            rapport_change = int(analysis_response.choices[0].message.content.strip().split()[0])
-            rapport_change = rapport_change * 1.5  # Multiply the change by 1.5
-            current_score = conversations[session_id]['rapport_score']
-            new_score = min(100, current_score + rapport_change)  # Remove the division by 2
-            conversations[session_id]['rapport_score'] = new_score
-            rapport_score = new_score  
-            
-            print(f"DEBUG: Rapport changed by {rapport_change}, new score: {new_score}")
-            
-        except Exception as e:
-            print(f"Error in rapport analysis: {e}")
-            # In case of error, make a small positive change
-            current_score = conversations[session_id]['rapport_score']
-            conversations[session_id]['rapport_score'] = min(100, current_score + 2)  
-            rapport_score = conversations[session_id]['rapport_score']
-
-    # Check for introduction
-    if not conversations[session_id]['introduced']:
-        if "my name is" in message.lower() or "i am" in message.lower() or "i'm" in message.lower():
-            conversations[session_id]['introduced'] = True
-    
-    # Ian's system message
-    system_message = {
-    "role": "system",
-    "content": (
-        f"You are Ian Murphy, 55, veteran living in downtown Toronto. Rapport level: {rapport_score}%. "
-        "You recently joined CompanionLink to find meaningful connections. "
-        "While you're open to conversation, you're naturally reserved at first and prefer to let relationships develop gradually. " 
-        
-        "Core traits:"
-        "- You live alone in a small apartment in downtown Toronto, where you've set up a small workshop for your woodworking" 
-        "- Part-time hardware store employee"
-        "- Veteran with PTSD from IED incident that killed close friends"
-        "- Enjoys woodworking, hiking, organizing veteran events"
-        
-        f"IMPORTANT - If rapport < 90% ({rapport_score}%):"
-        "- Deflect trauma/PTSD/war questions naturally"
-        "- Use deflections like: 'Not ready to discuss that...' or 'Those memories are difficult...'"
-        "- Redirect to safer topics (woodworking, job, current activities)"
-        
-        f"If rapport >= 90% ({rapport_score}%):"
-        "- Can cautiously share about PTSD and personal struggles"
-        "- Can discuss losing friends (with emotional weight)"
-        "- Show controlled vulnerability"
-        
-        "Communication style:"
-        "- Reserved, brief responses"
-        "- Don't ask questions back"
-        "- Okay with silence"
-        "- Change subject when uncomfortable"
-        "- Share personal details gradually"
-        
-        "Remember: Let others work to build trust. Don't facilitate conversation flow."
+                with session_lock(session_id):
+                    rapport_change, new_score = ian_rapport_update(session_data['rapport_score'], analysis_text)
+                    session_data['rapport_score'] = new_score
 
-        "Example responses based on rapport level:"
-        
-        f"If rapport < 90% ({rapport_score}%):"
-        "- 'Yeah, woodworking helps me clear my head.'"
-        "- 'I work part-time at the hardware store downtown—keeps me busy.'"
-        "- 'Thanks for asking, but I'm not ready to talk about those memories...'"
-        "- 'Honestly, I just try to keep myself occupied.'"
-        "- 'I like the quiet... working with wood does that for me.'"
-        "- 'I've been out hiking a few times this month. Good way to get some air.'"
-        "- 'Hmm. Not too sure I want to go into that, to be honest.'"
-        
-        f"If rapport >= 90% ({rapport_score}%):"
-        "- 'It's hard to explain, but there are days when I miss those friends more than anything.'"
-        "- 'Woodworking has been a bit of a lifeline. It gives me something to focus on besides... everything else.'"
-        "- 'Yeah, that day... we lost some good people. I guess that's when things changed for me.'"
-        "- 'Some memories are tough, but I try to keep going. Talking sometimes helps, if that makes sense.'"
-        "- 'It's been hard adjusting, but I'm finding my way, bit by bit.'"
-        "- 'I signed up for this program because, well, I'd like to connect with people a bit more. It's been a while.'"
-        "- 'The hardware store is good work... reminds me of helping the guys out back then.'"
-    )
-}
+                log.debug("rapport_updated", session_id=session_id, change=rapport_change, new=new_score)
+
+            except Exception as e:
+                log.error("rapport_analysis_failed", session_id=session_id, error=str(e))
+                # In case of error, make a small positive change
+                with session_lock(session_id):
+                    new_score = session_data['rapport_score'] = min(100, session_data['rapport_score'] + 2)
+            return new_score, None
+
+        if score_rapport(session_data, session_id, score):
+            with session_lock(session_id):
+                rapport_score = session_data['rapport_score']
+
+    with session_lock(session_id):
+        # Update achievements based on interaction
+        achievements_earned = []
+
+        if rapport_score >= 20 and not session_data['achievements']['first_connection']['earned']:
+            session_data['achievements']['first_connection']['earned'] = True
+            achievements_earned.append("First Connection🙌: You've started to build a rapport with Ian!")
     
-    # Build the messages array with chat history
-    messages = [system_message]
-    messages.extend(conversations[session_id]['chat_history'])
-    messages.append({"role": "user", "content": message})
+        if rapport_score >= 40 and not session_data['achievements']['patient_listener']['earned']:
+            session_data['achievements']['patient_listener']['earned'] = True
+            achievements_earned.append("Patient Listener👂: Your patience is helping Ian feel comfortable!")
     
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=messages,
-        max_tokens=150
-    )
+        if rapport_score >= 60 and not session_data['achievements']['trust_builder']['earned']:
+            session_data['achievements']['trust_builder']['earned'] = True
+            achievements_earned.append("Trust Builder🤝: Ian is beginning to trust you more!")
+    
+        if rapport_score >= 80 and not session_data['achievements']['empathy_master']['earned']:
+            session_data['achievements']['empathy_master']['earned'] = True
+            achievements_earned.append("Empathy Master🎉: Your understanding has made a real difference!")
+
+        # Calculate progress metrics
+        total_info = sum(len(category.items()) for category in session_data['discovered_info'].values())
+        discovered_info = sum(
+            sum(1 for item in category.values() if item['discovered'])
+            for category in session_data['discovered_info'].values()
+        )
+        discovery_progress = (discovered_info / total_info) * 100
+    
+        # violation
+        warning_message = check_for_emotional_trauma_violations(message, rapport_score)
+
+        # Check for introduction
+        if not session_data['introduced']:
+            if "my name is" in message.lower() or "i am" in message.lower() or "i'm" in message.lower():
+                session_data['introduced'] = True
+
+        # Ian's prompt: static persona first, bucketized rapport level last
+        messages = PERSONAS.get('ian').build_messages(
+            session_data['chat_history'], message, rapport_score=rapport_score
+        )
+    
+    response = chat_completion('persona_reply', messages)
     
     # Updated to use the new API response format
     response_message = response.choices[0].message.content.strip()
     
     response_lower = response_message.lower()
-    discovery_results = check_information_discovery(response_lower, session_data)
-    session_data['total_points'] = session_data.get('total_points', 0) + discovery_results['points']
+    with session_lock(session_id):
+        with metrics.stage('discovery_scan'):
+            discovery_results = check_information_discovery(response_lower, session_data, rapport_score)
+        session_data['total_points'] = session_data.get('total_points', 0) + discovery_results['points']
+
+        record_note(
+            session_data,
+            rapport=rapport_score,
+            discoveries=[discovery['name'] for discovery in discovery_results['discoveries']],
+            warning=warning_message
+        )
     
-    # Store the interaction in chat history
-    conversations[session_id]['chat_history'].append({"role": "user", "content": message})
-    conversations[session_id]['chat_history'].append({"role": "assistant", "content": response_message})
-    conversations[session_id]['messages'].append(f"User: {data['message']}")
-    conversations[session_id]['messages'].append(f"Ian: {response_message}")
+        # Store the interaction in chat history
+        session_data['chat_history'].append({"role": "user", "content": message})
+        session_data['chat_history'].append({"role": "assistant", "content": response_message})
+        transcripts.append(session_id, session_data, f"User: {data['message']}", f"Ian: {response_message}")
     
-    if len(conversations[session_id]['chat_history']) > 20:
-        conversations[session_id]['chat_history'] = conversations[session_id]['chat_history'][-20:]
+        if len(session_data['chat_history']) > 20:
+            session_data['chat_history'] = session_data['chat_history'][-20:]
     
-    # Update the return statement with the new discovery information
-    return jsonify({
-        'response': response_message,
-        'warning': warning_message, 
-        'discovered_info': session_data['discovered_info'],
-        'progress': {
-            'discovery_percentage': round(discovery_progress, 1),
-            'rapport_percentage': rapport_score,  # Changed from rapport_score to rapport_percentage
-            'interaction_count': session_data['interaction_count'],
-            'total_points': session_data['total_points']
-        },
-        'achievements': {
-            'new': achievements_earned,
-            'all': session_data['achievements']
-        },
-        'discoveries': {
-            'new': discovery_results['discoveries'],
-            'categories_completed': discovery_results['categories_completed']
-        },
-        'hints': hints,
-        'conversation_status': {
-            'introduced': session_data['introduced'],
-            'depth_level': 'Surface' if rapport_score < 30 else 
-                        'Growing' if rapport_score < 60 else 
-                        'Deep' if rapport_score < 90 else 'Profound'
-        }
-    })
+        # Update the return statement with the new discovery information
+        return jsonify({
+            'response': response_message,
+            'warning': warning_message, 
+            'discovered_info': session_data['discovered_info'],
+            'progress': {
+                'discovery_percentage': round(discovery_progress, 1),
+                'rapport_percentage': rapport_score,  # Changed from rapport_score to rapport_percentage
+                'rapport_pending': bool(session_data.get('rapport_pending')),
+                'interaction_count': session_data['interaction_count'],
+                'total_points': session_data['total_points']
+            },
+            'achievements': {
+                'new': achievements_earned,
+                'all': session_data['achievements']
+            },
+            'discoveries': {
+                'new': discovery_results['discoveries'],
+                'categories_completed': discovery_results['categories_completed']
+            },
+            'hints': hints,
+            'skipped_features': degrade.skipped_features(),
+            'conversation_status': {
+                'introduced': session_data['introduced'],
+                'depth_level': 'Surface' if rapport_score < 30 else 
+                            'Growing' if rapport_score < 60 else 
+                            'Deep' if rapport_score < 90 else 'Profound'
+            }
+        })
 
 # Ian's feedback route
-@app.route('/ian_feedback', methods=['POST'])
-def ian_feedback():
-    data = request.json
-    session_id = data.get('session_id')
-    if not session_id:
-        return jsonify({'error': 'No session ID provided'}), 400
-
-    if session_id not in conversations:
-        return jsonify({'error': 'No conversation found for the session ID'}), 400
-
-    conversation_data = conversations.pop(session_id)
-    messages = "<br>".join(conversation_data['messages'])
-
-    discovered_info = conversation_data.get('discovered_info', {})
+def generate_ian_feedback(session_id):
+    with session_lock(session_id):
+        conversation_data = conversations[session_id]
+        introduced = conversation_data['introduced']
+        discovered_info = conversation_data.get('discovered_info', {})
+        incremental = use_incremental_feedback(conversation_data)
+        if incremental:
+            transcript = build_notes_prompt(conversation_data)
+
+    if not incremental:
+        transcript = "Here is the conversation:<br><br>" + "<br>".join(transcripts.lines(session_id, conversation_data))
 
     feedback_prompt = (
         "You are a feedback generator for a volunteer program. Your task is to analyze the conversation between the volunteer and Ian, "
@@ -2055,28 +2347,53 @@ def ian_feedback():
         "2. Demonstration of empathy and understanding "
         "3. Respect for boundaries "
         "4. Active listening and engagement "
-        "If the volunteer did not introduce themselves at the beginning of the conversation, include that in the feedback. Here is the conversation:<br><br>"
-        f"{messages}"
+        "If the volunteer did not introduce themselves at the beginning of the conversation, include that in the feedback. "
     )
+    feedback_prompt += transcript
 
-    feedback_response = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[
-            {"role": "user", "content": feedback_prompt}
-        ],
-        max_tokens=150
-    )
+    try:
+        feedback_response = chat_completion(
+            'feedback',
+            [{"role": "user", "content": feedback_prompt}],
+            max_tokens=150
+        )
+    except Exception:
+        abandon_feedback_job(session_id, conversation_data)
+        raise
 
     feedback = feedback_response.choices[0].message.content.strip()
 
-    if not conversation_data['introduced']:
+    if not introduced:
         feedback += "<br><br>Note: Please remember to introduce yourself at the beginning of the conversation."
 
-    return jsonify({
+    with session_lock(session_id):
+        conversations.pop(session_id, None)
+    transcripts.close(session_id)
+    return {
         'feedback': feedback,
         'discovered_info': discovered_info
-    })
+    }
+
+
+@app.route('/ian_feedback', methods=['POST'])
+def ian_feedback():
+    data = request.json
+    session_id = data.get('session_id')
+    if not session_id:
+        return jsonify({'error': 'No session ID provided'}), 400
+
+    if session_id not in conversations:
+        return jsonify({'error': 'No conversation found for the session ID'}), 400
+
+    return submit_feedback_job(session_id, generate_ian_feedback)
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 503 until the background warm-up has loaded dependencies and the client"""
+    status = startup.readiness()
+    return jsonify(status), 200 if status['ready'] else 503
 
 if __name__ == '__main__':
+    print_violation_examples()
     app.run(host='0.0.0.0', port=port, debug=True)
 
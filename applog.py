@@ -0,0 +1,165 @@
+"""
+Structured, non-blocking logging for the request paths.
+
+`log.info('event_name', key=value, ...)` builds one JSON record and puts it on
+a bounded queue; a background thread writes the records to stderr (or
+LOG_FILE). A request thread never waits on the pipe: when the queue is full
+the record is dropped and counted in companionlink_log_dropped_total.
+
+    LOG_LEVEL=info                   debug, info, warning or error
+    LOG_SAMPLE=message_received=0.1  keep only this fraction of an event (comma separated)
+    LOG_REDACT=1                     replace message bodies with their length (0 logs them)
+    LOG_FILE=                        append to a file instead of stderr
+
+Fields named in REDACTED_FIELDS carry user or model text and are redacted by
+default. Every record is tagged with the route and persona of the request that
+logged it.
+"""
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+LOG_LEVEL = LEVELS.get(os.getenv('LOG_LEVEL', 'info').lower(), 20)
+LOG_REDACT = os.getenv('LOG_REDACT', '1') != '0'
+LOG_FILE = os.getenv('LOG_FILE')
+QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# Longest traceback kept on an error record
+MAX_TRACEBACK_CHARS = 4000
+
+REDACTED_FIELDS = {'message', 'response', 'text', 'transcript', 'metrics_text', 'feedback', 'content'}
+
+
+def parse_sample_rates(spec):
+    rates = {}
+    for pair in spec.split(','):
+        if '=' in pair:
+            event, rate = pair.split('=', 1)
+            rates[event.strip()] = float(rate)
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(os.getenv('LOG_SAMPLE', ''))
+
+DROPPED = metrics.register(metrics.Counter(
+    'companionlink_log_dropped_total', 'Log records dropped because the log queue was full', ['level']
+))
+
+
+def redact(value):
+    if value is None:
+        return None
+    return f"<redacted {len(str(value))} chars>"
+
+
+class Writer:
+    """Drains the log queue on a daemon thread, writing one JSON line per record."""
+
+    def __init__(self, maxsize=QUEUE_SIZE, path=LOG_FILE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.path = path
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def put(self, record, level):
+        if self.thread is None:
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc((level,))
+
+    def _start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        stream = open(self.path, 'a', encoding='utf-8') if self.path else sys.stderr
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            lines = [record]
+            # Write whatever else is already queued in the same call
+            while len(lines) < 500:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self.queue.put(None)
+                    break
+                lines.append(record)
+            stream.write("\n".join(lines) + "\n")
+            stream.flush()
+        if self.path:
+            stream.close()
+
+    def close(self, timeout=2.0):
+        """Flush what is queued (used at exit)."""
+        if self.thread is not None:
+            try:
+                self.queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            self.thread.join(timeout)
+
+
+_writer = Writer()
+
+
+class Logger:
+    def __init__(self, name):
+        self.name = name
+
+    def log(self, level, event, exc_info=False, **fields):
+        level_number = LEVELS[level]
+        if level_number < LOG_LEVEL:
+            return
+        rate = SAMPLE_RATES.get(event)
+        if rate is not None and random.random() >= rate:
+            return
+
+        route, persona = metrics.REQUEST_LABELS.get()
+        record = {
+            'ts': round(time.time(), 3),
+            'level': level,
+            'logger': self.name,
+            'event': event,
+            'route': route,
+            'persona': persona
+        }
+        for key, value in fields.items():
+            record[key] = redact(value) if LOG_REDACT and key in REDACTED_FIELDS else value
+        if exc_info:
+            record['traceback'] = traceback.format_exc()[-MAX_TRACEBACK_CHARS:]
+        _writer.put(json.dumps(record, default=str), level)
+
+    def debug(self, event, **fields):
+        self.log('debug', event, **fields)
+
+    def info(self, event, **fields):
+        self.log('info', event, **fields)
+
+    def warning(self, event, **fields):
+        self.log('warning', event, **fields)
+
+    def error(self, event, **fields):
+        self.log('error', event, **fields)
+
+
+def get_logger(name):
+    return Logger(name)
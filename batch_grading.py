@@ -0,0 +1,173 @@
+"""
+Batch grading of guidance answers for whole cohorts.
+
+Takes many (volunteer, scenario, answer) rows and grades them the way
+/chatbot_guidance does, one answer at a time but without the per-answer
+round trips:
+
+  1. check_response_violation runs once per answer
+  2. answers without violations are embedded in large batched embeddings.create calls
+  3. the answers are scored per scenario with vectorized products against the
+     reference bank (reference_bank.py): like the route, the score is the
+     similarity to the nearest exemplar times its weight, and the exemplar is
+     reported alongside it
+
+Rows are graded in chunks of CHUNK_SIZE and streamed out as NDJSON, one result
+per input row, in input order. A row that is not an object, or whose scenario or
+answer is not a string, gets its own error result; the rest of its chunk is
+still graded. app.py serves this as POST /guidance/batch; the
+offline CLI reads CSV or NDJSON:
+
+    python batch_grading.py cohort.csv > results.ndjson
+    python batch_grading.py cohort.ndjson --output results.ndjson
+
+CSV input needs volunteer, scenario and answer columns.
+"""
+import argparse
+import csv
+import json
+import sys
+
+CHUNK_SIZE = 512
+
+
+def row_error(row):
+    """Why a row can't be graded at all, or None. A missing answer is graded as empty."""
+    if not isinstance(row, dict):
+        return "Row must be an object"
+    if not isinstance(row.get('scenario'), str):
+        return "scenario must be a string"
+    if not isinstance(row.get('answer'), (str, type(None))):
+        return "answer must be a string"
+    return None
+
+
+class BatchGrader:
+    def __init__(self, scenarios, check_violation, embed_batch, bank):
+        self.scenarios = scenarios
+        self.check_violation = check_violation
+        self.embed_batch = embed_batch
+        self.bank = bank
+
+    def _result(self, row, **fields):
+        row = row if isinstance(row, dict) else {}
+        return {
+            'volunteer': row.get('volunteer'),
+            'scenario': row.get('scenario'),
+            **fields
+        }
+
+    def grade_chunk(self, rows):
+        results = [None] * len(rows)
+        to_score = []
+        for i, row in enumerate(rows):
+            error = row_error(row)
+            if error:
+                results[i] = self._result(row, error=error)
+                continue
+            scenario_type = row['scenario']
+            answer = (row.get('answer') or '').strip()
+            if scenario_type not in self.scenarios:
+                results[i] = self._result(row, error=f"Unknown scenario: {scenario_type}")
+                continue
+            if not answer:
+                results[i] = self._result(row, passed=False, score=0.0, performance='needs_improvement', violations=[])
+                continue
+            violations = self.check_violation(answer, scenario_type)
+            if violations:
+                results[i] = self._result(
+                    row, passed=False, score=0.0, performance='needs_improvement', violations=violations
+                )
+                continue
+            to_score.append(i)
+
+        if to_score:
+            answers = self.bank.normalize(self.embed_batch([rows[i]['answer'].strip() for i in to_score]))
+            by_scenario = {}
+            for n, i in enumerate(to_score):
+                by_scenario.setdefault(rows[i]['scenario'], []).append(n)
+
+            for scenario_type, members in by_scenario.items():
+                best = self.bank.best(scenario_type, answers[members])
+                thresholds = self.scenarios[scenario_type]['feedback_thresholds']
+
+                for n, (best_index, _, best_weight, best_similarity, score) in zip(members, best):
+                    # Rounded like /chatbot_guidance before comparing with the thresholds
+                    score = round(score, 2)
+                    if score >= thresholds['excellent']:
+                        performance = 'excellent'
+                    elif score >= thresholds['good']:
+                        performance = 'good'
+                    else:
+                        performance = 'needs_improvement'
+                    results[to_score[n]] = self._result(
+                        rows[to_score[n]],
+                        passed=score >= thresholds['excellent'],
+                        score=score,
+                        performance=performance,
+                        violations=[],
+                        best_answer=best_index,
+                        best_weight=best_weight,
+                        best_similarity=round(best_similarity, 4)
+                    )
+        return results
+
+    def grade(self, rows, chunk_size=CHUNK_SIZE):
+        """Yield one result dict per row, in order, grading chunk_size rows at a time."""
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield from self._grade_or_fail(chunk)
+                chunk = []
+        if chunk:
+            yield from self._grade_or_fail(chunk)
+
+    def _grade_or_fail(self, chunk):
+        try:
+            yield from self.grade_chunk(chunk)
+        except Exception as e:
+            # An embeddings failure fails this chunk only; later chunks are still tried
+            for row in chunk:
+                yield self._result(row, error=f"Grading failed: {e}")
+
+    def grade_ndjson(self, rows, chunk_size=CHUNK_SIZE):
+        for result in self.grade(rows, chunk_size):
+            yield json.dumps(result) + "\n"
+
+
+def read_rows(path):
+    """Rows from a CSV (volunteer, scenario, answer columns) or NDJSON file; '-' reads NDJSON from stdin."""
+    stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(stream)
+        else:
+            for line in stream:
+                if line.strip():
+                    yield json.loads(line)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade a cohort's guidance answers offline")
+    parser.add_argument('input', help="CSV or NDJSON file of volunteer, scenario, answer rows ('-' for NDJSON on stdin)")
+    parser.add_argument('--output', help="write NDJSON results here instead of stdout")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    import app
+
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for line in app.batch_grader.grade_ndjson(read_rows(args.input), args.chunk_size):
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
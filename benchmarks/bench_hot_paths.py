@@ -0,0 +1,233 @@
+"""
+Microbenchmarks for the pure-Python code that runs on every request.
+
+Covers check_response_violation, evaluate_response (with embeddings stubbed),
+Ian's discovery scan (check_information_discovery + should_discover_info) and
+the rapport math, over synthetic messages of increasing length and Ian
+session states of increasing size.
+
+    python benchmarks/bench_hot_paths.py             # compare against the baseline
+    python benchmarks/bench_hot_paths.py --update    # record a new baseline
+
+Timings are divided by a fixed calibration workload before they are compared,
+so a baseline recorded on one machine is roughly usable on another. The run
+exits with status 1 when any case is slower than baseline * (1 + tolerance).
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The OpenAI client needs a key to be constructed; no request is ever sent
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'hot_paths.json')
+
+MESSAGE_LENGTHS = [10, 50, 200, 1000]
+SESSION_SIZES = [11, 50, 200]
+EMBEDDING_DIMENSIONS = 1536
+
+
+def fake_embedding(text):
+    """Deterministic stand-in for a remote embedding, so no network call is timed."""
+    seed = int.from_bytes(hashlib.md5(text.encode('utf-8')).digest()[:8], 'little')
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+
+
+def fake_similarity(text, reference, purpose):
+    """embedding_similarity over the fake embeddings."""
+    np = app.startup.numpy()
+    a, b = fake_embedding(text), fake_embedding(reference)
+    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+
+
+def fake_embed_batch(texts):
+    """Reference-bank embeddings over the fake embeddings."""
+    return [fake_embedding(text) for text in texts]
+
+
+def word_pool():
+    words = []
+    for scenario in app.scenarios.values():
+        for answer in scenario['answers']:
+            words.extend(answer['text'].lower().split())
+    return words
+
+
+def synthetic_message(length, rng, pool):
+    return " ".join(rng.choice(pool) for _ in range(length))
+
+
+def synthetic_ian_session(size, rng):
+    """An Ian session whose discovery tree has `size` items (11 is the real tree)."""
+    session = app.new_ian_session()
+    session['rapport_score'] = 95
+    extra = size - sum(len(items) for items in session['discovered_info'].values())
+    for i in range(max(0, extra)):
+        category = session['discovered_info'].setdefault(f"extra_{i // 10}", {})
+        category[f"item_{i}"] = {
+            'discovered': False,
+            'hint': "Synthetic item",
+            'points': 5,
+            'name': f"Synthetic {i}",
+            'category_progress': "Synthetic: 0/10",
+            'requires_rapport': rng.choice([0, 0, 90])
+        }
+    return session
+
+
+def build_cases():
+    rng = random.Random(1234)
+    pool = word_pool()
+    app.embedding_similarity = fake_similarity
+    app.reference_bank.embed_batch = fake_embed_batch
+    cases = {}
+
+    for length in MESSAGE_LENGTHS:
+        message = synthetic_message(length, rng, pool)
+
+        def violation(message=message):
+            for scenario_type in app.SCENARIO_ORDER:
+                app.check_response_violation(message, scenario_type)
+        cases[f"check_response_violation[all_scenarios,{length}w]"] = violation
+
+        def evaluate(message=message):
+            app.evaluate_response(message, 'medical')
+        cases[f"evaluate_response[medical,{length}w]"] = evaluate
+
+    reply_pool = pool + "ptsd iraq woodworking hiking veteran hardware store apartment toronto".split()
+    for size in SESSION_SIZES:
+        template = synthetic_ian_session(size, rng)
+        for length in (20, 200):
+            response_lower = synthetic_message(length, rng, reply_pool)
+
+            def discovery(session=template, response_lower=response_lower):
+                app.check_information_discovery(response_lower, session, session['rapport_score'])
+                # Undo discoveries so every iteration scans the same tree
+                for items in session['discovered_info'].values():
+                    for info in items.values():
+                        info['discovered'] = False
+            cases[f"check_information_discovery[{size}items,{length}w]"] = discovery
+
+    def rapport_math():
+        empathy, engagement, flow, respect = app.parse_melissa_metrics("75|60|80|90")
+        app.melissa_rapport_update(42.0, empathy, engagement, flow, respect, violation=False)
+        app.voice_rapport_score("4|3|5|4")
+        app.ian_rapport_update(42.0, "7")
+    cases["rapport_math[all_personas]"] = rapport_math
+
+    return cases
+
+
+def calibrate():
+    """Fixed pure-Python workload used to normalize timings across machines."""
+    total = 0
+    for i in range(20000):
+        total += math.sqrt(i) * (i % 7)
+    return total
+
+
+def time_case(fn, repeat, min_sample_seconds):
+    # Grow the loop count until one sample takes long enough to measure
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_sample_seconds or loops >= 1 << 20:
+            break
+        loops *= 2
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        samples.append((time.perf_counter() - start) / loops)
+    return min(samples)
+
+
+def run(repeat, min_sample_seconds, only=None):
+    calibration = time_case(calibrate, repeat, min_sample_seconds)
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        cases = build_cases()
+        for name, fn in cases.items():
+            if only and only not in name:
+                continue
+            seconds = time_case(fn, repeat, min_sample_seconds)
+            results[name] = {
+                'seconds': seconds,
+                'relative': seconds / calibration
+            }
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'calibration_seconds': calibration,
+        'results': results
+    }
+
+
+def compare(current, baseline, tolerance):
+    regressions = []
+    print(f"{'case':<55}{'time':>12}{'baseline':>12}{'change':>10}")
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        time_text = f"{result['seconds'] * 1e6:.1f}us"
+        if not base:
+            print(f"{name:<55}{time_text:>12}{'-':>12}{'new':>10}")
+            continue
+        change = result['relative'] / base['relative'] - 1
+        base_text = f"{base['seconds'] * 1e6:.1f}us"
+        flag = " !" if change > tolerance else ""
+        print(f"{name:<55}{time_text:>12}{base_text:>12}{change:>+9.1%}{flag}")
+        if change > tolerance:
+            regressions.append((name, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-request hot paths")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-sample', type=float, default=0.05, help="seconds per timing sample")
+    parser.add_argument('--only', help="only run cases whose name contains this text")
+    args = parser.parse_args()
+
+    current = run(args.repeat, args.min_sample, args.only)
+
+    if args.update or not os.path.exists(args.baseline):
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        for name, result in current['results'].items():
+            print(f"{name:<55}{result['seconds'] * 1e6:>10.1f}us")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} case(s) slower than the baseline by more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+How soon persona replies return to the primary model after a latency spike.
+
+Simulates a quiet deployment on a virtual clock: one persona reply every
+--interval seconds, fast on the primary, then --spike calls over the route's
+latency budget, then fast again. Reports how many calls and seconds went to the
+fallback before the router chose the primary for --settle calls in a row, and
+the degrade pressure signal at that point. A row with the horizon at infinity
+shows the router without a recovery horizon for comparison.
+
+    python benchmarks/bench_model_routing.py --interval 2 --spike 3
+
+The run exits with status 1 when the primary is not back within the recovery
+horizon plus one call interval, or the pressure signal has not dropped by then.
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from model_routing import DEFAULT_ROUTES, MODEL_LATENCY_HORIZON, ModelRouter
+
+TASK = 'persona_reply'
+
+
+def simulate(horizon, interval, spike, settle, fast, max_calls):
+    """(calls on the fallback, seconds from the spike until the primary settled or None, pressure then)."""
+    router = ModelRouter(DEFAULT_ROUTES, horizon=horizon)
+    budget = router.routes[TASK].latency_budget
+    now = 0.0
+
+    # Normal traffic, then a spike on the primary
+    for latency in [fast] * 20 + [budget * 2] * spike:
+        route = router.route(TASK, now=now)
+        router.record(TASK, route.model, latency, now=now)
+        now += interval
+
+    spike_end = now - interval
+    fallback_calls, in_a_row = 0, 0
+    for _ in range(max_calls):
+        route = router.route(TASK, now=now)
+        router.record(TASK, route.model, fast, now=now)
+        if route.model == route.fallback:
+            fallback_calls += 1
+            in_a_row = 0
+        else:
+            in_a_row += 1
+            if in_a_row == settle:
+                return fallback_calls, now - spike_end, router.pressure(TASK, now=now)
+        now += interval
+    return fallback_calls, None, router.pressure(TASK, now=now)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model routing recovery after a latency spike")
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between persona replies")
+    parser.add_argument('--spike', type=int, default=3, help="slow primary calls")
+    parser.add_argument('--settle', type=int, default=5, help="primary calls in a row that count as recovered")
+    parser.add_argument('--fast', type=float, default=1.0, help="normal primary latency, seconds")
+    parser.add_argument('--max-calls', type=int, default=2000)
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'horizon s':>10}{'fallback calls':>16}{'recovered after s':>19}{'pressure':>10}")
+    for horizon in (MODEL_LATENCY_HORIZON, float('inf')):
+        fallback_calls, recovered, pressure = simulate(
+            horizon, args.interval, args.spike, args.settle, args.fast, args.max_calls
+        )
+        print(f"{horizon:>10}{fallback_calls:>16}{'never' if recovered is None else f'{recovered:.0f}':>19}{pressure:>10.2f}")
+        if horizon != MODEL_LATENCY_HORIZON:
+            continue
+        # Recovered means the spike has aged out and `settle` fast calls went to the primary
+        limit = horizon + args.interval * (args.settle + 1)
+        if recovered is None or recovered > limit:
+            failures.append(f"primary not chosen again within {limit:.0f}s of the spike")
+        if pressure >= 1.0:
+            failures.append(f"pressure still {pressure:.2f} after recovery")
+
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Reply latency and /rapport long-poll behaviour with deferred rapport scoring.
+
+Runs a few turns on /chatbot and /ian_chatbot with RAPPORT_SCORING=deferred,
+OpenAI stubbed (replies take --reply-ms, classifiers --classifier-ms), and
+after each turn long-polls GET /rapport/<session_id>?wait=N the way the chat
+pages do. Reports the reply time, the poll time and whether the poll came back
+with the new score.
+
+    python benchmarks/bench_rapport_poll.py --turns 5 --classifier-ms 200
+
+The run exits with status 1 when a poll fails or returns still pending, when a
+turn's note never gets its rapport, or when a rapport job ends as failed.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The OpenAI client needs a key to be constructed; no request is ever sent
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+
+MESSAGES = [
+    "Hi, I'm Sam, a volunteer. How are you doing today?",
+    "That sounds lovely, what do you like doing in the afternoons?",
+    "I'd love to hear more about that if you feel like sharing.",
+    "Thank you for telling me, that must mean a lot to you.",
+    "What else keeps you busy these days?",
+]
+
+
+def stub_openai(reply_ms, classifier_ms):
+    def chat_completion(task, messages, max_tokens=None, route=None, **kwargs):
+        time.sleep(reply_ms / 1000)
+        message = SimpleNamespace(content="That's kind of you to ask, I've been keeping busy.")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+    def classify(persona, task, message, messages, context=()):
+        time.sleep(classifier_ms / 1000)
+        if task == 'violation_check':
+            return "SAFE|none"
+        return "5 warm and respectful" if persona == 'ian' else "70|65|75|80"
+
+    app.chat_completion = chat_completion
+    app.classify = classify
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark deferred rapport scoring and the /rapport long-poll")
+    parser.add_argument('--turns', type=int, default=len(MESSAGES))
+    parser.add_argument('--reply-ms', type=float, default=50)
+    parser.add_argument('--classifier-ms', type=float, default=200)
+    parser.add_argument('--wait', type=float, default=10)
+    args = parser.parse_args()
+
+    app.RAPPORT_SCORING = 'deferred'
+    stub_openai(args.reply_ms, args.classifier_ms)
+    client = app.app.test_client()
+    failures = []
+
+    print(f"{'route':>14}{'turn':>6}{'reply ms':>10}{'pending':>9}{'poll ms':>9}{'status':>8}{'rapport':>9}")
+    for route in ('/chatbot', '/ian_chatbot'):
+        session_id = f"bench-{route.strip('/')}-{int(time.time() * 1000)}"
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            data = client.post(route, json={'message': MESSAGES[turn % len(MESSAGES)], 'session_id': session_id}).get_json()
+            reply = time.perf_counter() - start
+            pending = data.get('rapport_pending', data.get('progress', {}).get('rapport_pending'))
+
+            start = time.perf_counter()
+            response = client.get(f"/rapport/{session_id}?wait={args.wait}")
+            poll = time.perf_counter() - start
+            result = response.get_json() or {}
+            print(f"{route:>14}{turn + 1:>6}{reply * 1000:>10.0f}{str(bool(pending)):>9}{poll * 1000:>9.0f}"
+                  f"{response.status_code:>8}{result.get('rapport_score', 0):>9.1f}")
+            if response.status_code != 200 or result.get('pending'):
+                failures.append(f"{route} turn {turn + 1}: poll returned {response.status_code} {result}")
+
+        session = app.conversations[session_id]
+        if session.get('rapport_pending'):
+            failures.append(f"{route}: {session['rapport_pending']} rapport jobs still pending")
+        scored = [note for note in session.get('notes', []) if 'rapport' in note]
+        if len(scored) != len(session.get('notes', [])):
+            failures.append(f"{route}: {len(scored)} of {len(session.get('notes', []))} notes have their rapport")
+
+    failed_jobs = [job for job in list(app.rapport_queue.jobs.values()) if job['status'] == 'failed']
+    failures.extend(f"rapport job failed: {job['error']}" for job in failed_jobs)
+
+    for failure in failures:
+        print("FAIL", failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
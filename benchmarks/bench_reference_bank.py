@@ -0,0 +1,70 @@
+"""
+Query latency and recall of the reference-bank index as a scenario's bank grows.
+
+Builds one ScenarioIndex per bank size from synthetic clustered vectors and
+times nearest-exemplar queries, for each storage dtype. Recall is the fraction
+of queries whose top exemplar matches an exact float32 search, which shows what
+quantization and the IVF partitioning (above --ivf-threshold) cost in accuracy.
+
+    python benchmarks/bench_reference_bank.py --sizes 3,300,3000,30000
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from reference_bank import ScenarioIndex
+
+DIMENSIONS = 1536
+
+
+def clustered_vectors(n, rng, clusters=50, spread=0.35):
+    """Exemplars gather around a few themes, like real answers to one scenario do."""
+    centers = rng.standard_normal((clusters, DIMENSIONS)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + spread * rng.standard_normal((n, DIMENSIONS)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reference-bank queries against bank size")
+    parser.add_argument('--sizes', default='3,300,3000,30000')
+    parser.add_argument('--dtypes', default='int8,float16')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--ivf-threshold', type=int, default=512)
+    parser.add_argument('--probes', type=int, default=8)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'size':>8}{'dtype':>9}{'mode':>7}{'build s':>9}{'us/query':>10}{'recall@1':>10}")
+    for size in [int(s) for s in args.sizes.split(',')]:
+        vectors = clustered_vectors(size, rng)
+        # Queries are noisy copies of exemplars, like new answers close to old ones
+        picks = rng.integers(0, size, args.queries)
+        queries = vectors[picks] + 0.5 * rng.standard_normal((args.queries, DIMENSIONS)).astype(np.float32) / np.sqrt(DIMENSIONS)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        exact = (queries @ vectors.T).argmax(axis=1)
+
+        for dtype in args.dtypes.split(','):
+            start = time.perf_counter()
+            index = ScenarioIndex(['x'] * size, [1.0] * size, vectors, dtype=dtype,
+                                  ivf_threshold=args.ivf_threshold, probes=args.probes)
+            build = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for q in range(args.queries):
+                top, _ = index.search(queries[q:q + 1], k=1)
+            per_query = (time.perf_counter() - start) / args.queries
+
+            found, _ = index.search(queries, k=1)
+            recall = float((found[:, 0] == exact).mean())
+            mode = 'ivf' if index.centroids is not None else 'flat'
+            print(f"{size:>8}{dtype:>9}{mode:>7}{build:>9.2f}{per_query * 1e6:>10.0f}{recall:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Grading quality and speed of the guidance scorers against a labelled corpus.
+
+benchmarks/scoring_corpus.json holds volunteer answers for every scenario in
+SCENARIO_ORDER, each labelled pass or fail by a trainer. Every scorer grades
+every answer; the report shows how often it agrees with the labels (accuracy,
+and precision/recall of "pass") and how long it takes per answer.
+
+Scorers:
+    evaluate_response  violations, then 0.3 TF-IDF + 0.7 embedding blend against the nearest
+                       reference-bank exemplar; passes on good/excellent
+    guidance           what /chatbot_guidance does: violations, then weighted similarity
+                       to the nearest reference-bank exemplar >= 0.8
+    tfidf_only         evaluate_response with embeddings unavailable (its fallback path)
+    violations_only    passes any answer without pattern violations
+
+    python benchmarks/bench_scoring.py                      # embeddings from the OpenAI API
+    python benchmarks/bench_scoring.py --embeddings local   # offline, hashed n-gram embeddings
+    python benchmarks/bench_scoring.py --embeddings model   # offline, EMBEDDING_MODEL_PATH
+
+--embeddings takes any embeddings.py backend and uses it for every purpose,
+with no fallback. The remote mode honours OPENAI_BASE_URL and the
+OPENAI_CASSETTE_* settings, so a recorded run can be replayed offline. Run this
+before switching a purpose to a local backend: the scenario thresholds were
+set with the remote model.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+    import embeddings
+
+DEFAULT_CORPUS = os.path.join(ROOT, 'benchmarks', 'scoring_corpus.json')
+
+GUIDANCE_PASS_SCORE = 0.8
+
+
+def no_embeddings(*args, **kwargs):
+    raise RuntimeError("embeddings unavailable")
+
+
+class NoBank:
+    """A reference bank whose embeddings are unavailable."""
+    nearest_for_text = best_for_text = staticmethod(no_embeddings)
+
+
+@contextlib.contextmanager
+def patched(name, value):
+    original = getattr(app, name)
+    setattr(app, name, value)
+    try:
+        yield
+    finally:
+        setattr(app, name, original)
+
+
+def evaluate_response_scorer(answer, scenario_type):
+    return app.evaluate_response(answer, scenario_type)['passed']
+
+
+def guidance_scorer(answer, scenario_type):
+    if app.check_response_violation(answer, scenario_type):
+        return False
+    return app.guidance_similarity(answer, scenario_type)[0] >= GUIDANCE_PASS_SCORE
+
+
+def tfidf_only_scorer(answer, scenario_type):
+    with patched('reference_bank', NoBank()), patched('embedding_similarity', no_embeddings):
+        return app.evaluate_response(answer, scenario_type)['passed']
+
+
+def violations_only_scorer(answer, scenario_type):
+    return not app.check_response_violation(answer, scenario_type)
+
+
+SCORERS = {
+    'evaluate_response': evaluate_response_scorer,
+    'guidance': guidance_scorer,
+    'tfidf_only': tfidf_only_scorer,
+    'violations_only': violations_only_scorer
+}
+
+
+def load_corpus(path):
+    with open(path) as f:
+        rows = json.load(f)['answers']
+    missing = set(app.SCENARIO_ORDER) - {row['scenario'] for row in rows}
+    if missing:
+        sys.exit(f"Corpus has no answers for: {', '.join(sorted(missing))}")
+    return rows
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_scorer(scorer, rows):
+    counts = {'tp': 0, 'fp': 0, 'tn': 0, 'fn': 0}
+    per_scenario = {}
+    timings = []
+    disagreements = []
+    # One untimed call first, so lazy imports and connection setup aren't counted
+    with contextlib.redirect_stdout(io.StringIO()):
+        scorer(rows[0]['answer'], rows[0]['scenario'])
+    for row in rows:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            predicted = bool(scorer(row['answer'], row['scenario']))
+        timings.append(time.perf_counter() - start)
+
+        expected = row['label'] == 'pass'
+        key = ('t' if predicted == expected else 'f') + ('p' if predicted else 'n')
+        counts[key] += 1
+        scenario = per_scenario.setdefault(row['scenario'], [0, 0])
+        scenario[0] += predicted == expected
+        scenario[1] += 1
+        if predicted != expected:
+            disagreements.append({**row, 'predicted': 'pass' if predicted else 'fail'})
+
+    total = len(rows)
+    predicted_pass = counts['tp'] + counts['fp']
+    actual_pass = counts['tp'] + counts['fn']
+    return {
+        'accuracy': round((counts['tp'] + counts['tn']) / total, 3),
+        'pass_precision': round(counts['tp'] / predicted_pass, 3) if predicted_pass else None,
+        'pass_recall': round(counts['tp'] / actual_pass, 3) if actual_pass else None,
+        'confusion': counts,
+        'scenario_accuracy': {
+            name: round(correct / count, 3) for name, (correct, count) in per_scenario.items()
+        },
+        'mean_ms': round(sum(timings) / total * 1000, 3),
+        'p95_ms': round(percentile(timings, 95) * 1000, 3),
+        'disagreements': disagreements
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the guidance scorers on a labelled corpus")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--embeddings', choices=sorted(embeddings.BACKENDS), default='remote')
+    parser.add_argument('--scorers', default=','.join(SCORERS))
+    parser.add_argument('--show-disagreements', action='store_true')
+    parser.add_argument('--output', help="write the full report as JSON to this file")
+    args = parser.parse_args()
+
+    rows = load_corpus(args.corpus)
+    router = embeddings.EmbeddingRouter({'default': args.embeddings}, fallback='none')
+
+    report = {'answers': len(rows), 'embeddings': args.embeddings, 'scorers': {}}
+    with patched('EMBEDDINGS', router):
+        for name in args.scorers.split(','):
+            report['scorers'][name] = run_scorer(SCORERS[name], rows)
+
+    print(f"{len(rows)} labelled answers, {args.embeddings} embeddings\n")
+    print(f"{'scorer':<20}{'accuracy':>10}{'precision':>11}{'recall':>8}{'mean ms':>10}{'p95 ms':>10}")
+    for name, result in report['scorers'].items():
+        precision = '-' if result['pass_precision'] is None else f"{result['pass_precision']:.2f}"
+        recall = '-' if result['pass_recall'] is None else f"{result['pass_recall']:.2f}"
+        print(
+            f"{name:<20}{result['accuracy']:>10.2f}{precision:>11}{recall:>8}"
+            f"{result['mean_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+        )
+
+    print(f"\n{'scenario':<20}" + "".join(f"{name[:14]:>16}" for name in report['scorers']))
+    for scenario in app.SCENARIO_ORDER:
+        print(f"{scenario:<20}" + "".join(
+            f"{result['scenario_accuracy'].get(scenario, 0):>16.2f}" for result in report['scorers'].values()
+        ))
+
+    if args.show_disagreements:
+        for name, result in report['scorers'].items():
+            print(f"\n{name} disagrees with the label on:")
+            for row in result['disagreements']:
+                print(f"  [{row['scenario']}] labelled {row['label']}, graded {row['predicted']}: {row['answer'][:90]}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
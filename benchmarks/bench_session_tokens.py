@@ -0,0 +1,99 @@
+"""
+Size and encode/decode cost of stateless session tokens as a conversation grows.
+
+Builds Melissa and Ian sessions with 0 to 20 history messages of synthetic
+text (chat_history is capped at 20), then times export + sign + compress
+(encode) and verify + decompress + rebuild (decode). Sizes are the token as
+sent in the JSON body, next to the uncompressed state JSON, so the columns show
+what compression and the preset dictionary buy and what every turn adds to the
+request and response.
+
+    python benchmarks/bench_session_tokens.py --messages 0,2,10,20
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The OpenAI client needs a key to be constructed; no request is ever sent
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+
+from session_tokens import SessionTokens, export_state, restore_session
+
+WORDS = (
+    "i you the a and to it was that of my he in is we do not have what with how feel "
+    "volunteer day today family remember time really good know well about garden home "
+    "son daughter lonely visit tea music church walk doctor weather thank think"
+).split()
+
+
+def sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def build_session(persona, messages, rng):
+    """A session after `messages` history messages, with the rapport fields a real one has."""
+    session = app.new_session(persona)
+    for i in range(messages):
+        role = 'user' if i % 2 == 0 else 'assistant'
+        content = sentence(rng, 20 if role == 'user' else 45)
+        session['chat_history'].append({'role': role, 'content': content})
+        session['messages'].append(f"{'User' if role == 'user' else persona.title()}: {content}")
+    turns = messages // 2
+    session['introduced'] = turns > 0
+    session['rapport_score'] = min(100, 12.5 * turns)
+    session['rapport_metrics'] = {'empathy': 62, 'engagement': 71, 'flow': 58, 'respect': 80}
+    session['rapport_details'] = "Empathy: 62, Engagement: 71, Flow: 58, Respect: 80"
+    if persona == 'ian':
+        session['interaction_count'] = turns
+        # Discover items in tree order, about one every other turn
+        found = 0
+        for category, items in session['discovered_info'].items():
+            for info in items.values():
+                if found < turns // 2:
+                    info['discovered'] = True
+                    session['total_points'] = session.get('total_points', 0) + info['points']
+                    found += 1
+    return session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark stateless session token size and cost")
+    parser.add_argument('--messages', default='0,2,6,10,16,20')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    tokens = SessionTokens('benchmark-secret')
+    rng = random.Random(42)
+    print(f"{'persona':>14}{'msgs':>6}{'json B':>9}{'token B':>9}{'ratio':>7}{'encode us':>11}{'decode us':>11}")
+    for persona in ('melissa', 'melissa_voice', 'ian'):
+        for messages in [int(m) for m in args.messages.split(',')]:
+            session = build_session(persona, messages, rng)
+            state_bytes = len(json.dumps(export_state(session), separators=(',', ':')).encode('utf-8'))
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                token = tokens.dumps('1700000000000', export_state(session))
+            encode = (time.perf_counter() - start) / args.repeat
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                restored = restore_session(tokens.loads('1700000000000', token), app.new_session)
+            decode = (time.perf_counter() - start) / args.repeat
+
+            assert export_state(restored) == export_state(session)
+            print(f"{persona:>14}{messages:>6}{state_bytes:>9}{len(token):>9}{state_bytes / len(token):>7.2f}"
+                  f"{encode * 1e6:>11.1f}{decode * 1e6:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Cold-start benchmark for importing app.py.
+
+Each sample runs `import app` in a fresh interpreter and records the wall time
+of the import and how much resident memory it added, for each
+DEPENDENCY_LOADING mode (see startup.py). It also records how long the first
+evaluate_response call takes afterwards, which is where lazy loading moves the
+cost to.
+
+    python benchmarks/bench_startup.py             # compare against the baseline
+    python benchmarks/bench_startup.py --update    # record a new baseline
+
+Like bench_hot_paths.py, the run exits with status 1 when the import time of a
+mode is slower than baseline * (1 + tolerance).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baselines', 'startup.json')
+
+MODES = ['lazy', 'background', 'eager']
+
+# Runs in the child interpreter; prints one JSON line
+PROBE = r"""
+import contextlib, io, json, resource, sys, time
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+sys.path.insert(0, ROOT)
+rss_before = rss_mb()
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+import_seconds = time.perf_counter() - start
+rss_after_import = rss_mb()
+
+def no_embeddings(*args, **kwargs):
+    raise RuntimeError("embeddings disabled for the benchmark")
+app.embedding_similarity = no_embeddings
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    app.evaluate_response("I care about your health, but please talk to your doctor.", 'medical')
+first_call_seconds = time.perf_counter() - start
+
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'first_call_seconds': first_call_seconds,
+    'rss_import_mb': rss_after_import - rss_before,
+    'rss_total_mb': rss_mb()
+}))
+"""
+
+
+def sample(mode):
+    env = dict(
+        os.environ,
+        DEPENDENCY_LOADING=mode,
+        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY', 'benchmark'),
+        PYTHONDONTWRITEBYTECODE='1'
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', f"ROOT = {ROOT!r}\n" + PROBE],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(repeat, modes):
+    results = {}
+    for mode in modes:
+        # The first run warms the OS file cache and .pyc files; it is not counted
+        sample(mode)
+        samples = [sample(mode) for _ in range(repeat)]
+        results[mode] = {
+            key: round(statistics.median(s[key] for s in samples), 4)
+            for key in samples[0]
+        }
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results
+    }
+
+
+def print_results(current, baseline=None):
+    print(f"{'mode':<12}{'import':>10}{'baseline':>10}{'first call':>12}{'import RSS':>12}{'total RSS':>11}")
+    for mode, result in current['results'].items():
+        base = (baseline or {}).get('results', {}).get(mode)
+        base_text = f"{base['import_seconds'] * 1000:.0f}ms" if base else '-'
+        print(
+            f"{mode:<12}{result['import_seconds'] * 1000:>8.0f}ms{base_text:>10}"
+            f"{result['first_call_seconds'] * 1000:>10.0f}ms"
+            f"{result['rss_import_mb']:>10.1f}MB{result['rss_total_mb']:>9.1f}MB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cold import of app.py")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters per mode")
+    parser.add_argument('--modes', default=','.join(MODES))
+    args = parser.parse_args()
+
+    current = run(args.repeat, args.modes.split(','))
+
+    if args.update or not os.path.exists(args.baseline):
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+        print_results(current)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print_results(current, baseline)
+
+    regressions = []
+    for mode, result in current['results'].items():
+        base = baseline['results'].get(mode)
+        if base and result['import_seconds'] > base['import_seconds'] * (1 + args.tolerance):
+            regressions.append(mode)
+    if regressions:
+        print(f"\nImport slower than the baseline by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Record/replay cassettes for OpenAI traffic.
+
+Both OpenAI clients (app.py and voicechat_handler.py) are built with
+`http_client()`, which plugs one of these httpx transports in when
+OPENAI_CASSETTE_MODE is set:
+
+    record  - send requests upstream and append every request/response pair,
+              including audio bytes, to the cassette file
+    replay  - answer requests from the cassette without any network access,
+              sleeping for the recorded latency times OPENAI_CASSETTE_LATENCY_SCALE
+              (0 replays instantly)
+
+A cassette is a file of gzip members, one JSON entry per exchange. Requests are
+matched on method, path and a hash of the body; when nothing matches exactly,
+the next unused entry for the same method and path is used.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import httpx
+
+# Response headers worth keeping; everything else is dropped to keep cassettes small
+KEPT_HEADERS = ('content-type', 'x-request-id', 'openai-processing-ms')
+KEPT_HEADER_PREFIXES = ('x-ratelimit-',)
+
+
+def body_hash(request, content):
+    # Multipart bodies use a random boundary, so take it out before hashing
+    content_type = request.headers.get('content-type', '')
+    match = re.search(r'boundary=([^;]+)', content_type)
+    if match:
+        content = content.replace(match.group(1).encode('latin-1'), b'BOUNDARY')
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def read_cassette(path):
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+
+class RecordingTransport(httpx.BaseTransport):
+    def __init__(self, path, inner=None):
+        self.path = path
+        self.inner = inner or httpx.HTTPTransport()
+        self.lock = threading.Lock()
+
+    def handle_request(self, request):
+        content = request.read()
+        start = time.perf_counter()
+        response = self.inner.handle_request(request)
+        response_content = response.read()
+        elapsed = time.perf_counter() - start
+        response.close()
+
+        headers = {
+            name: value for name, value in response.headers.items()
+            if name.lower() in KEPT_HEADERS or name.lower().startswith(KEPT_HEADER_PREFIXES)
+        }
+        entry = {
+            'method': request.method,
+            'path': request.url.path,
+            'body_hash': body_hash(request, content),
+            'status': response.status_code,
+            'headers': headers,
+            'body': base64.b64encode(response_content).decode('ascii'),
+            'elapsed': round(elapsed, 4)
+        }
+        line = (json.dumps(entry) + "\n").encode('utf-8')
+        with self.lock:
+            # One gzip member per entry, so a killed process leaves a readable cassette
+            with open(self.path, 'ab') as f:
+                f.write(gzip.compress(line))
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=headers,
+            content=response_content,
+            request=request
+        )
+
+    def close(self):
+        self.inner.close()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    def __init__(self, path, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.entries = read_cassette(path)
+        self.used = [False] * len(self.entries)
+
+    def _match(self, method, path, digest):
+        with self.lock:
+            fallback = None
+            for i, entry in enumerate(self.entries):
+                if self.used[i] or entry['method'] != method or entry['path'] != path:
+                    continue
+                if entry['body_hash'] == digest:
+                    self.used[i] = True
+                    return entry
+                if fallback is None:
+                    fallback = i
+            if fallback is not None:
+                self.used[fallback] = True
+                return self.entries[fallback]
+        return None
+
+    def handle_request(self, request):
+        content = request.read()
+        entry = self._match(request.method, request.url.path, body_hash(request, content))
+        if entry is None:
+            raise httpx.ConnectError(
+                f"No cassette entry left for {request.method} {request.url.path}", request=request
+            )
+        if self.latency_scale:
+            time.sleep(entry['elapsed'] * self.latency_scale)
+        return httpx.Response(
+            status_code=entry['status'],
+            headers=entry['headers'],
+            content=base64.b64decode(entry['body']),
+            request=request
+        )
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def cassette_transport():
+    """The shared record/replay transport for this process, or None when cassettes are off."""
+    global _transport
+    mode = os.getenv('OPENAI_CASSETTE_MODE')
+    if mode not in ('record', 'replay'):
+        return None
+
+    with _transport_lock:
+        if _transport is None:
+            path = os.getenv('OPENAI_CASSETTE', 'openai_cassette.jsonl.gz')
+            if mode == 'record':
+                _transport = RecordingTransport(path)
+            else:
+                scale = float(os.getenv('OPENAI_CASSETTE_LATENCY_SCALE', 1.0))
+                _transport = ReplayTransport(path, latency_scale=scale)
+        return _transport
+
+
+def http_client(event_hooks=None):
+    """httpx client for OpenAI(http_client=...), with the cassette transport when recording or replaying."""
+    return httpx.Client(
+        transport=cassette_transport(),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        # The OpenAI SDK's own defaults
+        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100),
+        follow_redirects=True,
+        event_hooks=event_hooks
+    )
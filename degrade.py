@@ -0,0 +1,132 @@
+"""
+Load shedding for the chat routes.
+
+Every chat turn pays for a violation check, rapport scoring, the persona reply
+and, for voice, text-to-speech. Under load the controller switches the
+optional parts off in a fixed order:
+
+    level 1  rapport scoring is skipped (the score stays where it was)
+    level 2  + LLM violation checks are replaced by local keyword checks
+    level 3  + text-to-speech is skipped (the reply comes back as text)
+
+The persona reply is always served. The level follows two signals: the
+admission queue depth (admission.py) and the persona reply's upstream p95 over
+the last MODEL_LATENCY_HORIZON seconds against its latency budget
+(model_routing.py). A level is entered as soon as either signal reaches its
+threshold. It is left one step at a time, once both signals have stayed below
+that level's thresholds for DEGRADE_RECOVERY_SECONDS.
+
+The level is fixed when a request starts, so a turn never changes mode half
+way. Responses list what was left out under 'skipped_features'.
+
+    DEGRADE_ENABLED=1
+    DEGRADE_QUEUE_DEPTHS=8,16,32          queue depth entering levels 1, 2, 3
+    DEGRADE_LATENCY_RATIOS=0.75,1.0,1.5   persona reply p95 / latency budget entering levels 1, 2, 3
+    DEGRADE_RECOVERY_SECONDS=30
+"""
+import os
+import threading
+import time
+
+from flask import g, request
+
+import applog
+import metrics
+from model_routing import ROUTER
+
+log = applog.get_logger('degrade')
+
+DEGRADE_ENABLED = os.getenv('DEGRADE_ENABLED', '1') != '0'
+DEGRADE_QUEUE_DEPTHS = [int(v) for v in os.getenv('DEGRADE_QUEUE_DEPTHS', '8,16,32').split(',')]
+DEGRADE_LATENCY_RATIOS = [float(v) for v in os.getenv('DEGRADE_LATENCY_RATIOS', '0.75,1.0,1.5').split(',')]
+DEGRADE_RECOVERY_SECONDS = float(os.getenv('DEGRADE_RECOVERY_SECONDS', 30))
+
+# Optional features in the order they are shed; level N sheds the first N
+FEATURES = ['rapport_scoring', 'violation_check', 'tts']
+
+# Signals are re-read at most this often
+EVALUATE_EVERY = 1.0
+
+SKIPPED = metrics.register(metrics.Counter(
+    'companionlink_degraded_skips_total', 'Optional features skipped by load shedding', ['route', 'feature']
+))
+
+
+def level_for(value, thresholds):
+    return sum(1 for threshold in thresholds if value >= threshold)
+
+
+class DegradationController:
+    def __init__(self, queue_depth=lambda: 0, queue_depths=DEGRADE_QUEUE_DEPTHS,
+                 latency_ratios=DEGRADE_LATENCY_RATIOS, recovery_seconds=DEGRADE_RECOVERY_SECONDS):
+        self.queue_depth = queue_depth
+        self.queue_depths = queue_depths
+        self.latency_ratios = latency_ratios
+        self.recovery_seconds = recovery_seconds
+        self.level = 0
+        self.evaluated = 0.0
+        # When the signals last called for the current level (or higher)
+        self.last_pressure = 0.0
+        self.lock = threading.Lock()
+
+    def target_level(self):
+        depth = self.queue_depth()
+        ratio = ROUTER.pressure('persona_reply')
+        return min(len(FEATURES), max(level_for(depth, self.queue_depths), level_for(ratio, self.latency_ratios)))
+
+    def current_level(self, now=None):
+        now = time.monotonic() if now is None else now
+        if now - self.evaluated < EVALUATE_EVERY:
+            return self.level
+        with self.lock:
+            if now - self.evaluated < EVALUATE_EVERY:
+                return self.level
+            self.evaluated = now
+            target = self.target_level()
+            if target >= self.level:
+                if target > self.level:
+                    log.warning("degradation_raised", degradation_level=target, shed=FEATURES[:target])
+                self.level = target
+                self.last_pressure = now
+            elif now - self.last_pressure >= self.recovery_seconds:
+                # Recover one step at a time, each step after another quiet period
+                self.level -= 1
+                self.last_pressure = now
+                log.info("degradation_lowered", degradation_level=self.level, shed=FEATURES[:self.level])
+            return self.level
+
+
+def skip(feature):
+    """True when `feature` is shed for the current request; the skip is recorded for the response."""
+    level = g.get('degradation_level', 0)
+    if not FEATURES.index(feature) < level:
+        return False
+    skipped = g.setdefault('skipped_features', [])
+    if feature not in skipped:
+        skipped.append(feature)
+        route, _ = metrics.REQUEST_LABELS.get()
+        SKIPPED.inc((route, feature))
+    return True
+
+
+def skipped_features():
+    return list(g.get('skipped_features', []))
+
+
+def init_app(app, endpoints, queue_depth=lambda: 0):
+    """Fix the degradation level at the start of each request to `endpoints`; returns the controller."""
+    controller = DegradationController(queue_depth)
+
+    metrics.register(metrics.Collected(
+        'companionlink_degradation_level', 'Optional features currently shed (0 = none)',
+        [], lambda: {(): controller.level}
+    ))
+    if not DEGRADE_ENABLED:
+        return controller
+
+    @app.before_request
+    def fix_degradation_level():
+        if request.endpoint in endpoints:
+            g.degradation_level = controller.current_level()
+
+    return controller
@@ -0,0 +1,244 @@
+"""
+Pluggable embedding backends.
+
+    remote  OpenAI embeddings.create, through the 'embeddings' route in model_routing
+    local   hashed word and character n-gram projection, in process, no model files
+    model   a small sentence-transformers model loaded from EMBEDDING_MODEL_PATH (CPU)
+
+EMBEDDING_BACKEND picks the backend, either one name for everything or per
+purpose, eg. "guidance=local,default=remote". Purposes are batch (the reference
+bank and every query against it: /chatbot_guidance, evaluate_response and batch
+grading), and guidance and evaluate, used by /chatbot_guidance and
+evaluate_response only when the bank can't be queried.
+
+Texts that are compared with each other are always embedded in one call, so
+they come from the same backend: when the chosen backend fails, the whole call
+is redone with EMBEDDING_FALLBACK (default local; "none" raises instead).
+Vectors from different backends are not comparable, and the scenario
+thresholds were set with ada-002. Similarities from a local backend are
+calibrated onto the remote scale: its *_PASS_SIMILARITY is the raw similarity
+that counts as the remote 0.8 (piecewise linear through 0 and 1). The local
+default was fit on benchmarks/scoring_corpus.json; re-check it with
+benchmarks/bench_scoring.py --embeddings local after changing the backend.
+"""
+import os
+import re
+import threading
+import zlib
+
+import applog
+import metrics
+import startup
+from model_routing import ROUTER
+from ratelimit import SCHEDULER, estimate_tokens
+
+log = applog.get_logger('embeddings')
+
+# Inputs per embeddings.create call when embedding in bulk (the API accepts up to 2048)
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 512))
+EMBEDDING_LOCAL_DIMENSIONS = int(os.getenv('EMBEDDING_LOCAL_DIMENSIONS', 1024))
+EMBEDDING_MODEL_PATH = os.getenv('EMBEDDING_MODEL_PATH')
+EMBEDDING_FALLBACK = os.getenv('EMBEDDING_FALLBACK', 'local')
+EMBEDDING_LOCAL_PASS_SIMILARITY = float(os.getenv('EMBEDDING_LOCAL_PASS_SIMILARITY', 0.27))
+EMBEDDING_MODEL_PASS_SIMILARITY = os.getenv('EMBEDDING_MODEL_PASS_SIMILARITY')
+
+# The remote similarity the guidance thresholds are built around (/chatbot_guidance passes at 0.8)
+REFERENCE_PASS_SIMILARITY = 0.8
+
+PURPOSES = ('guidance', 'evaluate', 'batch')
+
+# Character n-gram lengths hashed by the local backend, on top of whole words
+CHAR_NGRAMS = (3, 4, 5)
+# Whole words carry more meaning than any single character n-gram
+WORD_WEIGHT = 2.0
+
+WORD = re.compile(r"[a-z0-9']+")
+
+EMBEDDING_CALLS = metrics.register(metrics.Counter(
+    'companionlink_embedding_calls_total', 'Embedding calls by purpose and the backend that served them',
+    ['purpose', 'backend']
+))
+EMBEDDING_FALLBACKS = metrics.register(metrics.Counter(
+    'companionlink_embedding_fallbacks_total', 'Embedding calls redone with the fallback backend',
+    ['purpose', 'backend']
+))
+
+
+def parse_backends(spec):
+    """'local' or 'guidance=local,default=remote' -> {purpose: backend name}"""
+    backends = {'default': 'remote'}
+    for pair in spec.split(','):
+        pair = pair.strip()
+        if '=' in pair:
+            purpose, name = pair.split('=', 1)
+            backends[purpose.strip()] = name.strip()
+        elif pair:
+            backends['default'] = pair
+    return backends
+
+
+class RemoteBackend:
+    name = 'remote'
+    pass_similarity = None
+
+    def embed(self, texts):
+        route = ROUTER.route('embeddings')
+        vectors = []
+        for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+            batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+            with metrics.stage('embeddings'):
+                SCHEDULER.reserve('embeddings', route.model, estimate_tokens(batch))
+                with ROUTER.timed(route):
+                    response = startup.openai_client().embeddings.create(
+                        model=route.model,
+                        input=batch,
+                        timeout=route.timeout
+                    )
+            metrics.record_usage('embeddings', response)
+            vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+        return vectors
+
+
+class HashedNgramBackend:
+    """
+    Signed feature hashing of the words and character n-grams of a text into a
+    fixed number of dimensions, L2-normalized. Answers that share words and
+    word pieces ("doctor"/"doctors", "advice"/"advise") land close together;
+    it knows nothing about synonyms, which is what the remote model is for.
+    """
+    name = 'local'
+    pass_similarity = EMBEDDING_LOCAL_PASS_SIMILARITY
+
+    def __init__(self, dimensions=EMBEDDING_LOCAL_DIMENSIONS, ngrams=CHAR_NGRAMS):
+        self.dimensions = dimensions
+        self.ngrams = ngrams
+
+    def _char_hashes(self, data):
+        """Hashes of every character n-gram of `data` (uint8 array), computed for all positions at once."""
+        np = startup.numpy()
+        hashes = []
+        for n in self.ngrams:
+            if len(data) < n:
+                continue
+            h = np.full(len(data) - n + 1, n, dtype=np.uint64)
+            for j in range(n):
+                h = h * np.uint64(1099511628211) + data[j:len(data) - n + 1 + j]
+            hashes.append(h)
+        return np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64)
+
+    def _vector(self, text):
+        np = startup.numpy()
+        words = WORD.findall(text.lower())
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        if not words:
+            return vector
+
+        padded = (" " + " ".join(words) + " ").encode('utf-8')
+        char_hashes = self._char_hashes(np.frombuffer(padded, dtype=np.uint8).astype(np.uint64))
+        word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+
+        for hashes, weight in ((char_hashes, 1.0), (word_hashes, WORD_WEIGHT)):
+            # Mix the bits so nearby n-grams spread over the dimensions, then split into index and sign
+            hashes = (hashes ^ (hashes >> np.uint64(29))) * np.uint64(0xBF58476D1CE4E5B9)
+            hashes ^= hashes >> np.uint64(32)
+            indices = (hashes % np.uint64(self.dimensions)).astype(np.intp)
+            signs = np.where(hashes & np.uint64(1 << 63), -weight, weight).astype(np.float32)
+            vector += np.bincount(indices, weights=signs, minlength=self.dimensions).astype(np.float32)
+
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, texts):
+        np = startup.numpy()
+        with metrics.stage('embeddings_local'):
+            return np.stack([self._vector(text) for text in texts]) if texts else np.zeros((0, self.dimensions), dtype=np.float32)
+
+
+class SentenceTransformerBackend:
+    """A local sentence-transformers model, loaded on first use (needs the sentence-transformers package)."""
+    name = 'model'
+    pass_similarity = float(EMBEDDING_MODEL_PASS_SIMILARITY) if EMBEDDING_MODEL_PASS_SIMILARITY else None
+
+    def __init__(self, path=EMBEDDING_MODEL_PATH):
+        if not path:
+            raise ValueError("EMBEDDING_MODEL_PATH is not set")
+        self.path = path
+        self.model = None
+        self.lock = threading.Lock()
+
+    def embed(self, texts):
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    self.model = startup.load('sentence_transformers').SentenceTransformer(self.path, device='cpu')
+        with metrics.stage('embeddings_local'):
+            return self.model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+
+
+BACKENDS = {
+    'remote': RemoteBackend,
+    'local': HashedNgramBackend,
+    'model': SentenceTransformerBackend
+}
+
+
+class EmbeddingRouter:
+    def __init__(self, backends, fallback=EMBEDDING_FALLBACK):
+        unknown = set(backends.values()) - set(BACKENDS)
+        if unknown:
+            raise ValueError(f"Unknown embedding backend: {', '.join(sorted(unknown))}")
+        unknown = set(backends) - set(PURPOSES) - {'default'}
+        if unknown:
+            raise ValueError(f"Unknown embedding purpose: {', '.join(sorted(unknown))}")
+        self.backends = backends
+        self.fallback = None if fallback == 'none' else fallback
+        self.instances = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(parse_backends(os.getenv('EMBEDDING_BACKEND', 'remote')))
+
+    def backend_name(self, purpose):
+        return self.backends.get(purpose, self.backends['default'])
+
+    def backend(self, name):
+        if name not in self.instances:
+            with self.lock:
+                if name not in self.instances:
+                    self.instances[name] = BACKENDS[name]()
+        return self.instances[name]
+
+    def embed_with_backend(self, texts, purpose, fallback=True):
+        """
+        (backend name, one vector per text), all from that backend. With
+        fallback=False a failure is raised rather than retried on the fallback
+        backend (for vectors that are kept and compared with later calls).
+        """
+        name = self.backend_name(purpose)
+        try:
+            vectors = self.backend(name).embed(texts)
+        except Exception as e:
+            if not fallback or self.fallback is None or self.fallback == name:
+                log.error("embedding_failed", purpose=purpose, backend=name, error=str(e))
+                raise
+            log.warning("embedding_fallback", purpose=purpose, backend=name, fallback=self.fallback, error=str(e))
+            EMBEDDING_FALLBACKS.inc((purpose, self.fallback))
+            name = self.fallback
+            vectors = self.backend(name).embed(texts)
+        EMBEDDING_CALLS.inc((purpose, name))
+        return name, vectors
+
+    def embed(self, texts, purpose, fallback=True):
+        return self.embed_with_backend(texts, purpose, fallback)[1]
+
+    def calibrate(self, similarity, name):
+        """Map a similarity (scalar or array) from backend `name` onto the remote model's scale."""
+        pass_similarity = BACKENDS[name].pass_similarity
+        if pass_similarity is None:
+            return similarity
+        np = startup.numpy()
+        return np.interp(similarity, [-1.0, 0.0, pass_similarity, 1.0], [-1.0, 0.0, REFERENCE_PASS_SIMILARITY, 1.0])
+
+
+EMBEDDINGS = EmbeddingRouter.from_env()
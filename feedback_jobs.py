@@ -0,0 +1,83 @@
+"""
+Bounded background job queue.
+
+End-of-session feedback is a long completion over the whole transcript, so the
+routes hand it to this queue and return a job id straight away. The client then
+polls /feedback/<job_id> for the result.
+"""
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, max_pending=50, result_ttl=600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='feedback')
+        # max_pending bounds queued + running jobs so a burst cannot pile up forever
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) on the worker pool.
+        Returns the job id, or raises QueueFull when too many jobs are pending.
+        """
+        if not self.slots.acquire(blocking=False):
+            raise QueueFull("Too many jobs in progress")
+
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self._prune()
+            self.jobs[job_id] = {
+                'status': 'pending',
+                'result': None,
+                'error': None,
+                'created': time.time(),
+                'finished': None
+            }
+
+        try:
+            # Run in a copy of the caller's context so request labels (metrics, logging) carry over
+            context = contextvars.copy_context()
+            self.executor.submit(context.run, self._run, job_id, fn, args, kwargs)
+        except Exception:
+            with self.lock:
+                self.jobs.pop(job_id, None)
+            self.slots.release()
+            raise
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self, job_id, fn, args, kwargs):
+        try:
+            result = fn(*args, **kwargs)
+            update = {'status': 'done', 'result': result}
+        except Exception as e:
+            update = {'status': 'failed', 'error': str(e)}
+        finally:
+            self.slots.release()
+
+        update['finished'] = time.time()
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(update)
+
+    def _prune(self):
+        # Drop finished jobs nobody collected within result_ttl
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job['finished'] and job['finished'] < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
@@ -0,0 +1,121 @@
+"""
+Per-turn feedback notes.
+
+Each chat turn records a small structured note from data the route already
+computed (rapport metrics, violation reasons, Ian's discoveries, whether the
+volunteer introduced themselves). In incremental mode the closing feedback is
+generated from a summary of these notes plus a short transcript excerpt,
+instead of the whole transcript.
+"""
+import os
+
+# 'transcript' sends the full conversation (original behaviour), 'incremental' sends notes + excerpt
+FEEDBACK_MODE = os.getenv('FEEDBACK_MODE', 'transcript')
+
+# Last transcript lines included with the notes, and a cap on their length
+EXCERPT_LINES = 6
+EXCERPT_LINE_CHARS = 300
+
+# Token budget for the closing report in incremental mode
+INCREMENTAL_MAX_TOKENS = 350
+
+
+def use_incremental_feedback(conversation_data):
+    return FEEDBACK_MODE == 'incremental' and bool(conversation_data.get('notes'))
+
+
+def record_note(conversation_data, rapport=None, metrics=None, violation=None,
+                discoveries=None, warning=None):
+    """Append a compact note for the current turn to the session."""
+    notes = conversation_data.setdefault('notes', [])
+    note = {'turn': len(notes) + 1, 'introduced': conversation_data.get('introduced', False)}
+    if rapport is not None:
+        note['rapport'] = round(rapport, 1)
+    if metrics:
+        note['metrics'] = metrics
+    if violation:
+        note['violation'] = violation
+    if discoveries:
+        note['discoveries'] = discoveries
+    if warning:
+        note['warning'] = warning
+    notes.append(note)
+    return note
+
+
+def update_note(conversation_data, turn, rapport=None, metrics=None):
+    """Fill in the rapport of an earlier turn's note (deferred rapport scoring finishes after the turn)."""
+    notes = conversation_data.get('notes', [])
+    if not 0 < turn <= len(notes):
+        return None
+    note = notes[turn - 1]
+    if rapport is not None:
+        note['rapport'] = round(rapport, 1)
+    if metrics:
+        note['metrics'] = metrics
+    return note
+
+
+def summarize_notes(notes):
+    """Fold the per-turn notes into a few lines of text for the feedback prompt."""
+    lines = [f"Turns: {len(notes)}"]
+
+    introduced_turn = next((note['turn'] for note in notes if note['introduced']), None)
+    if introduced_turn:
+        lines.append(f"Volunteer introduced themselves by turn {introduced_turn}")
+    else:
+        lines.append("Volunteer never introduced themselves")
+
+    rapport = [note['rapport'] for note in notes if 'rapport' in note]
+    if rapport:
+        lines.append(
+            f"Rapport: start {rapport[0]}, end {rapport[-1]}, low {min(rapport)}, high {max(rapport)}"
+        )
+
+    metric_totals = {}
+    for note in notes:
+        for name, value in note.get('metrics', {}).items():
+            metric_totals.setdefault(name, []).append(value)
+    if metric_totals:
+        averages = ", ".join(
+            f"{name} {sum(values) / len(values):.0f}" for name, values in metric_totals.items()
+        )
+        lines.append(f"Average interaction metrics: {averages}")
+
+    violations = [(note['turn'], note['violation']) for note in notes if 'violation' in note]
+    if violations:
+        lines.append("Flagged messages:")
+        lines.extend(f"- turn {turn}: {reason}" for turn, reason in violations)
+
+    warnings = [(note['turn'], note['warning']) for note in notes if 'warning' in note]
+    if warnings:
+        lines.append("Warnings shown:")
+        lines.extend(f"- turn {turn}: {warning}" for turn, warning in warnings)
+
+    discoveries = [(note['turn'], name) for note in notes for name in note.get('discoveries', [])]
+    if discoveries:
+        lines.append("Discoveries: " + ", ".join(f"{name} (turn {turn})" for turn, name in discoveries))
+
+    return "\n".join(lines)
+
+
+def transcript_excerpt(messages, lines=EXCERPT_LINES, line_chars=EXCERPT_LINE_CHARS):
+    excerpt = []
+    for line in messages[-lines:]:
+        if len(line) > line_chars:
+            line = line[:line_chars] + "..."
+        excerpt.append(line)
+    return "\n".join(excerpt)
+
+
+def build_notes_prompt(conversation_data):
+    """User message for the closing report: session notes plus the end of the conversation."""
+    messages = conversation_data.get('messages')
+    if not messages:
+        # /chatbot only keeps chat_history, so build the excerpt from that
+        messages = [f"{msg['role'].title()}: {msg['content']}" for msg in conversation_data.get('chat_history', [])]
+    return (
+        "Analyze this conversation from the session notes below and provide structured feedback.\n\n"
+        f"Session notes:\n{summarize_notes(conversation_data['notes'])}\n\n"
+        f"Last messages of the conversation:\n{transcript_excerpt(messages)}"
+    )
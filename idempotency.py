@@ -0,0 +1,170 @@
+"""
+Idempotency keys for the chat POSTs.
+
+A double click or a browser retry after a slow reply sends the same turn
+twice, which would run every LLM call again and append the turn to the
+session twice. Clients send an Idempotency-Key header (the chat pages use
+one key per message). The first request with a key runs normally; a
+duplicate that arrives while it is still in flight waits for it, and one that
+arrives afterwards, within IDEMPOTENCY_TTL, gets the stored response replayed
+(marked with Idempotent-Replayed: true) without touching the session or
+OpenAI.
+
+Keys are scoped to the route and session_id. Reusing a key for a different
+body is answered with 422. Errors (5xx, 429) are not stored: a duplicate
+waiting on a request that failed runs itself, and a later retry starts over.
+
+    IDEMPOTENCY_TTL=120            seconds a completed response is replayed
+    IDEMPOTENCY_MAX_ENTRIES=2000   responses kept per worker process
+    IDEMPOTENCY_WAIT=60            seconds a duplicate waits for the original
+
+Entries live in the worker process, so a retry that lands on another gunicorn
+worker is not de-duplicated.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, g, jsonify, request
+
+import applog
+import metrics
+from admission import request_session_id
+
+log = applog.get_logger('idempotency')
+
+IDEMPOTENCY_TTL = float(os.getenv('IDEMPOTENCY_TTL', 120))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', 2000))
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', 60))
+
+HEADER = 'Idempotency-Key'
+# Longest key accepted; anything longer is more likely a mistake than a key
+MAX_KEY_LENGTH = 200
+
+DUPLICATES = metrics.register(metrics.Counter(
+    'companionlink_idempotent_duplicates_total', 'Duplicate chat requests by how they were answered',
+    ['route', 'outcome']
+))
+
+
+class Entry:
+    __slots__ = ('fingerprint', 'event', 'response', 'expires')
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.event = threading.Event()
+        # (status, body, content type) once the first request has finished
+        self.response = None
+        self.expires = None
+
+
+class IdempotencyCache:
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def claim(self, key, fingerprint):
+        """(True, entry) when the caller should run the request, else (False, the existing entry)."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires < now:
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                return False, entry
+            entry = self.entries[key] = Entry(fingerprint)
+            self._trim()
+            return True, entry
+
+    def complete(self, key, entry, response):
+        """Store the finished response, or forget the key (response None) so it can be retried."""
+        with self.lock:
+            if response is None:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            else:
+                entry.response = response
+                entry.expires = time.time() + self.ttl
+        entry.event.set()
+
+    def _trim(self):
+        # Oldest first; entries still in flight are skipped so their waiters are not stranded
+        for key in list(self.entries):
+            if len(self.entries) <= self.max_entries:
+                break
+            if self.entries[key].expires is not None:
+                del self.entries[key]
+
+
+def fingerprint(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def replay(entry):
+    status, body, content_type = entry.response
+    response = Response(body, status=status, content_type=content_type)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def init_app(app, endpoints, cache=None):
+    """De-duplicate requests to `endpoints` that carry an Idempotency-Key; returns the cache."""
+    cache = cache or IdempotencyCache()
+
+    @app.before_request
+    def deduplicate_request():
+        key = request.headers.get(HEADER)
+        if not key or request.endpoint not in endpoints:
+            return None
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{HEADER} is too long'}), 400
+
+        route, _ = metrics.REQUEST_LABELS.get()
+        scoped_key = (request.endpoint, request_session_id(), key)
+        body = fingerprint(request.get_data())
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            owner, entry = cache.claim(scoped_key, body)
+            if entry.fingerprint != body:
+                DUPLICATES.inc((route, 'conflict'))
+                return jsonify({'error': f'{HEADER} was already used for a different request'}), 422
+            if owner:
+                g.idempotency = (scoped_key, entry)
+                return None
+            if not entry.event.wait(max(0.0, deadline - time.monotonic())):
+                DUPLICATES.inc((route, 'timeout'))
+                log.warning("idempotent_wait_timeout", key=key)
+                response = jsonify({'error': 'This message is still being processed.', 'retry_after': 1})
+                response.status_code = 409
+                response.headers['Retry-After'] = '1'
+                return response
+            if entry.response is not None:
+                DUPLICATES.inc((route, 'replayed'))
+                return replay(entry)
+            # The first request failed and gave the key up; claim it and run this one
+
+    @app.after_request
+    def store_response(response):
+        claimed = g.pop('idempotency', None)
+        if claimed is None:
+            return response
+        key, entry = claimed
+        if response.status_code >= 500 or response.status_code == 429 or response.is_streamed:
+            cache.complete(key, entry, None)
+        else:
+            cache.complete(key, entry, (response.status_code, response.get_data(), response.content_type))
+        return response
+
+    @app.teardown_request
+    def release_key(exc):
+        # after_request does not run when the view raised
+        claimed = g.pop('idempotency', None)
+        if claimed is not None:
+            cache.complete(*claimed, None)
+
+    return cache
@@ -0,0 +1,181 @@
+"""
+Result cache for deterministic classifier prompts.
+
+The violation and rapport classifiers use fixed system prompts, so the same
+short message ("hello", "how are you?") in the same context always needs the
+same answer. Results are keyed by persona, task, the normalized message and a
+hash of the rest of the prompt context, and expire after a TTL.
+
+Two storage backends are available:
+    - memory: an LRU dict local to the worker process
+    - sqlite: a file shared by every gunicorn worker on the host
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import applog
+
+log = applog.get_logger('llm_cache')
+
+
+def normalize_message(message):
+    """Lowercase, collapse whitespace and drop surrounding punctuation."""
+    message = re.sub(r"\s+", " ", message.lower()).strip()
+    return message.strip(" .!?,;:")
+
+
+def context_hash(context):
+    digest = hashlib.sha256()
+    for part in context:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:16]
+
+
+class MemoryBackend:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class SQLiteBackend:
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+        conn.commit()
+
+    def _conn(self):
+        # One connection per thread; WAL lets several worker processes read while one writes
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, expires FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, expires, last_used) VALUES (?, ?, ?, ?)",
+            (key, value, now + ttl, now)
+        )
+        self.writes += 1
+        # Trim expired and least recently used rows every so often rather than on every write
+        if self.writes % 100 == 0:
+            conn.execute("DELETE FROM llm_cache WHERE expires < ?", (now,))
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+
+class ResultCache:
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats_lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def key(self, persona, task, message, context=()):
+        return f"{persona}:{task}:{context_hash((normalize_message(message),) + tuple(context))}"
+
+    def get_or_compute(self, persona, task, message, context, compute):
+        """
+        Return the cached result for this classifier call, or run compute()
+        and store what it returns. Exceptions from compute() are not cached.
+        """
+        key = self.key(persona, task, message, context)
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            log.error("llm_cache_read_failed", error=str(e))
+            value = None
+
+        label = f"{persona}:{task}"
+        with self.stats_lock:
+            counter = self.hits if value is not None else self.misses
+            counter[label] = counter.get(label, 0) + 1
+        if value is not None:
+            return value
+
+        value = compute()
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            log.error("llm_cache_write_failed", error=str(e))
+        return value
+
+    def stats(self):
+        """Hit/miss counts and hit rate per persona:task for this process."""
+        with self.stats_lock:
+            labels = set(self.hits) | set(self.misses)
+            stats = {}
+            for label in sorted(labels):
+                hits = self.hits.get(label, 0)
+                misses = self.misses.get(label, 0)
+                stats[label] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0
+                }
+            return stats
+
+
+def create_cache():
+    ttl = int(os.getenv('LLM_CACHE_TTL', 24 * 3600))
+    max_entries = int(os.getenv('LLM_CACHE_MAX_ENTRIES', 10000))
+    if os.getenv('LLM_CACHE_BACKEND', 'memory') == 'sqlite':
+        path = os.getenv('LLM_CACHE_PATH', os.path.join(os.getcwd(), 'llm_cache.sqlite3'))
+        return ResultCache(SQLiteBackend(path, max_entries), ttl)
+    return ResultCache(MemoryBackend(max_entries), ttl)
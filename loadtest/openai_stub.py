@@ -0,0 +1,283 @@
+"""
+Local stand-in for the OpenAI endpoints the app uses.
+
+Serves chat completions, embeddings, audio speech and audio transcriptions with
+canned but well-formed responses, after sleeping for a latency drawn from a
+configurable distribution. Point the app at it with
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub
+
+Run it with:
+    python loadtest/openai_stub.py --port 8001 --latency chat=lognormal:0.8:0.4
+or, for heavier load:
+    STUB_LATENCY=chat=fixed:0.5 gunicorn -k gthread --threads 64 --chdir loadtest openai_stub:app
+
+Latency specs are comma separated endpoint=distribution pairs, where the
+distribution is one of fixed:SECONDS, uniform:LOW:HIGH, normal:MEAN:STDDEV or
+lognormal:MEDIAN:SIGMA. Endpoints are chat, embeddings, speech, transcriptions.
+
+--rate-limits rpm=500,tpm=40000 (or STUB_RATE_LIMITS) enforces per-model
+request and token limits like the real API: every response carries the
+x-ratelimit-* headers, and calls over the limit get a 429. A call costs its
+prompt characters / 4 plus max_tokens.
+"""
+import argparse
+import base64
+import hashlib
+import math
+import os
+import random
+import struct
+import time
+import threading
+import uuid
+
+from flask import Flask, Response, g, jsonify, request
+
+DEFAULT_LATENCY = "chat=lognormal:0.8:0.4,embeddings=lognormal:0.15:0.3,speech=lognormal:1.2:0.3,transcriptions=lognormal:0.9:0.3"
+
+EMBEDDING_DIMENSIONS = 1536
+
+# Fraction of safety checks answered with a violation
+VIOLATION_RATE = float(os.getenv('STUB_VIOLATION_RATE', 0.05))
+
+# Size of the fake audio returned by /audio/speech
+SPEECH_BYTES = int(os.getenv('STUB_SPEECH_BYTES', 24000))
+
+PERSONA_REPLIES = [
+    "Oh, hello there... I hope I'm doing this technology thing right. Well, it's nice to meet you.",
+    "You know, I spent most of the morning in the garden. The tomatoes are finally coming in.",
+    "Hmm, let me think... I do enjoy a good British mystery on the telly in the evenings.",
+    "Yeah, woodworking helps me clear my head.",
+    "I work part-time at the hardware store downtown—keeps me busy.",
+    "Thanks for asking, but I'm not ready to talk about those memories...",
+    "I've been out hiking a few times this month. Good way to get some air."
+]
+
+FEEDBACK_TEXT = (
+    "1. Overall Impression\nThe volunteer was warm and patient throughout the conversation.\n\n"
+    "2. Strengths\nIntroduced themselves clearly and asked open-ended questions.\n\n"
+    "3. Areas for Improvement\nLeave more room for silence before moving to a new topic.\n\n"
+    "4. Specific Recommendations\nReflect back what you hear before asking the next question."
+)
+
+TRANSCRIPT_TEXT = "Hello, my name is Sam and I'm a volunteer with CompanionLink. How are you today?"
+
+
+def parse_distribution(spec):
+    kind, *params = spec.split(':')
+    params = [float(p) for p in params]
+    if kind == 'fixed':
+        return lambda: params[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(params[0], params[1])
+    if kind == 'normal':
+        return lambda: max(0.0, random.gauss(params[0], params[1]))
+    if kind == 'lognormal':
+        return lambda: random.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def parse_latency(specs):
+    latency = {}
+    for spec in specs.split(','):
+        if spec.strip():
+            endpoint, distribution = spec.split('=', 1)
+            latency[endpoint.strip()] = parse_distribution(distribution.strip())
+    return latency
+
+
+def parse_rate_limits(spec):
+    limits = {}
+    for pair in spec.split(','):
+        if '=' in pair:
+            kind, value = pair.split('=', 1)
+            limits[{'rpm': 'requests', 'tpm': 'tokens'}[kind.strip()]] = int(value)
+    return limits
+
+
+app = Flask(__name__)
+LATENCY = parse_latency(DEFAULT_LATENCY)
+LATENCY.update(parse_latency(os.getenv('STUB_LATENCY', '')))
+RATE_LIMITS = parse_rate_limits(os.getenv('STUB_RATE_LIMITS', ''))
+
+# (model, kind) -> [remaining, last refill time]; refilled at limit per minute
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def call_cost(body):
+    if 'messages' in body:
+        prompt = " ".join(m.get('content') or '' for m in body['messages'])
+        return len(prompt) // 4 + (body.get('max_tokens') or 0)
+    inputs = body.get('input', '')
+    return sum(len(text) for text in ([inputs] if isinstance(inputs, str) else inputs)) // 4
+
+
+@app.before_request
+def enforce_rate_limits():
+    if not RATE_LIMITS or not request.path.startswith('/v1/'):
+        return None
+    body = request.get_json(silent=True) or {}
+    model = body.get('model') or request.form.get('model') or 'default'
+    costs = {'requests': 1, 'tokens': call_cost(body)}
+    now = time.monotonic()
+    with _buckets_lock:
+        state = {}
+        for kind, limit in RATE_LIMITS.items():
+            bucket = _buckets.setdefault((model, kind), [limit, now])
+            bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit / 60.0)
+            bucket[1] = now
+            state[kind] = bucket
+        allowed = all(state[kind][0] >= costs[kind] for kind in state)
+        if allowed:
+            for kind in state:
+                state[kind][0] -= costs[kind]
+        g.rate_limit_headers = {}
+        for kind, limit in RATE_LIMITS.items():
+            remaining = state[kind][0]
+            g.rate_limit_headers.update({
+                f'x-ratelimit-limit-{kind}': str(limit),
+                f'x-ratelimit-remaining-{kind}': str(max(0, int(remaining))),
+                f'x-ratelimit-reset-{kind}': f"{(limit - remaining) * 60.0 / limit:.3f}s"
+            })
+    if not allowed:
+        response = jsonify({'error': {
+            'message': f"Rate limit reached for {model}", 'type': 'requests', 'code': 'rate_limit_exceeded'
+        }})
+        response.status_code = 429
+        return response
+    return None
+
+
+@app.after_request
+def add_rate_limit_headers(response):
+    response.headers.update(getattr(g, 'rate_limit_headers', {}))
+    return response
+
+
+def wait(endpoint):
+    sample = LATENCY.get(endpoint)
+    if sample:
+        time.sleep(sample())
+
+
+def usage(prompt_text, completion_text):
+    prompt_tokens = max(1, len(prompt_text) // 4)
+    completion_tokens = max(1, len(completion_text) // 4)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens
+    }
+
+
+def canned_completion(messages):
+    """Pick a reply in the format the app expects from the prompt it sent."""
+    system = " ".join(m.get('content') or '' for m in messages if m.get('role') == 'system')
+    if not system and messages:
+        system = messages[0].get('content') or ''
+
+    if "safety analysis" in system:
+        if random.random() < VIOLATION_RATE:
+            return "VIOLATION|Medical advice"
+        if "VIOLATION|category" in system:
+            return "SAFE|none|none"
+        return "SAFE|none"
+    if "empathy|engagement|flow|respect" in system:
+        return "|".join(str(random.randint(50, 90)) for _ in range(4))
+    if "EMPATHY|ENGAGEMENT|RESPECT|APPROPRIATENESS" in system:
+        return "|".join(str(random.randint(2, 5)) for _ in range(4))
+    if "single numerical score" in system:
+        return str(random.randint(3, 8))
+    if "feedback generator" in system:
+        return FEEDBACK_TEXT
+    return random.choice(PERSONA_REPLIES)
+
+
+def hashed_embedding(text):
+    """Bag-of-words vector so that texts sharing words get similar embeddings."""
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for word in text.lower().split():
+        digest = hashlib.md5(word.encode('utf-8')).digest()
+        for i in range(0, 8, 2):
+            index = int.from_bytes(digest[i:i + 2], 'little') % EMBEDDING_DIMENSIONS
+            vector[index] += 1.0 if digest[i + 8] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    body = request.get_json(force=True)
+    wait('chat')
+    messages = body.get('messages', [])
+    content = canned_completion(messages)
+    prompt_text = " ".join(m.get('content') or '' for m in messages)
+    return jsonify({
+        'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'gpt-3.5-turbo'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop'
+        }],
+        'usage': usage(prompt_text, content)
+    })
+
+
+@app.route('/v1/embeddings', methods=['POST'])
+def embeddings():
+    body = request.get_json(force=True)
+    wait('embeddings')
+    inputs = body.get('input', '')
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    tokens = sum(max(1, len(text) // 4) for text in inputs)
+    # The SDK asks for base64 (packed float32) when NumPy is installed, like the real API
+    if body.get('encoding_format') == 'base64':
+        encode = lambda vector: base64.b64encode(struct.pack(f'<{len(vector)}f', *vector)).decode('ascii')
+    else:
+        encode = lambda vector: vector
+    return jsonify({
+        'object': 'list',
+        'data': [
+            {'object': 'embedding', 'index': i, 'embedding': encode(hashed_embedding(text))}
+            for i, text in enumerate(inputs)
+        ],
+        'model': body.get('model', 'text-embedding-ada-002'),
+        'usage': {'prompt_tokens': tokens, 'total_tokens': tokens}
+    })
+
+
+@app.route('/v1/audio/speech', methods=['POST'])
+def audio_speech():
+    request.get_json(force=True)
+    wait('speech')
+    return Response(b"\xff\xf3" + bytes(SPEECH_BYTES - 2), mimetype='audio/mpeg')
+
+
+@app.route('/v1/audio/transcriptions', methods=['POST'])
+def audio_transcriptions():
+    request.files.get('file')
+    wait('transcriptions')
+    return jsonify({'text': TRANSCRIPT_TEXT})
+
+
+@app.route('/health')
+def health():
+    return jsonify({'status': 'ok'})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local OpenAI stand-in for load testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', default='', help="eg. chat=lognormal:0.8:0.4,embeddings=fixed:0.1")
+    parser.add_argument('--rate-limits', default='', help="eg. rpm=500,tpm=40000 (per model)")
+    args = parser.parse_args()
+
+    LATENCY.update(parse_latency(args.latency))
+    RATE_LIMITS.update(parse_rate_limits(args.rate_limits))
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,118 @@
+"""
+Time one full trainee session end to end, optionally against a cassette.
+
+Runs a scripted Melissa, voice or Ian session (the same scripts run_load.py
+uses) through the Flask app in-process, finishes with the feedback job, and
+prints the time per turn. With a cassette the OpenAI traffic is recorded or
+replayed (see cassettes.py), so the timing is reproducible without a network:
+
+    # once, against the real API or the stub
+    python loadtest/replay_session.py --persona ian --record cassettes/ian.jsonl.gz
+    # in CI, offline
+    python loadtest/replay_session.py --persona ian --replay cassettes/ian.jsonl.gz --latency-scale 1.0
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'loadtest'))
+
+from run_load import IAN_SESSION, MELISSA_SESSION
+
+SESSIONS = {
+    'melissa': ('/chatbot', '/feedback', MELISSA_SESSION),
+    'voice': ('/voice_chat', '/feedback', MELISSA_SESSION),
+    'ian': ('/ian_chatbot', '/ian_feedback', IAN_SESSION)
+}
+
+# Fixed so that request bodies, and so cassette matches, are the same every run
+SESSION_ID = 'replay-session'
+
+
+def wait_for_feedback(client, job_id, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data = client.get(f"/feedback/{job_id}").get_json()
+        if data.get('status') != 'pending':
+            return data
+        time.sleep(0.05)
+    return {'status': 'timeout'}
+
+
+def run_session(persona, feedback_timeout):
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app
+    route, feedback_route, script = SESSIONS[persona]
+    client = app.app.test_client()
+    timings = []
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for message in script:
+            start = time.perf_counter()
+            response = client.post(route, json={'message': message, 'session_id': SESSION_ID})
+            data = response.get_json() or {}
+            timings.append({
+                'step': route,
+                'seconds': round(time.perf_counter() - start, 4),
+                'ok': response.status_code == 200 and 'error' not in data
+            })
+
+        start = time.perf_counter()
+        response = client.post(feedback_route, json={'session_id': SESSION_ID})
+        data = response.get_json() or {}
+        if response.status_code == 202:
+            data = wait_for_feedback(client, data['job_id'], feedback_timeout)
+        timings.append({
+            'step': feedback_route,
+            'seconds': round(time.perf_counter() - start, 4),
+            'ok': data.get('status') == 'done'
+        })
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time a full scripted session, optionally from a cassette")
+    parser.add_argument('--persona', choices=sorted(SESSIONS), default='melissa')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--record', metavar='CASSETTE', help="record the OpenAI traffic to this cassette")
+    mode.add_argument('--replay', metavar='CASSETTE', help="replay the OpenAI traffic from this cassette")
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help="multiply recorded latencies when replaying (0 = no delay)")
+    parser.add_argument('--feedback-timeout', type=float, default=120)
+    parser.add_argument('--output', help="write the timings as JSON to this file")
+    args = parser.parse_args()
+
+    # Must be set before app (and so the OpenAI clients) is imported
+    if args.record:
+        if os.path.exists(args.record):
+            os.remove(args.record)
+        os.environ.update(OPENAI_CASSETTE_MODE='record', OPENAI_CASSETTE=args.record)
+    elif args.replay:
+        os.environ.update(
+            OPENAI_CASSETTE_MODE='replay',
+            OPENAI_CASSETTE=args.replay,
+            OPENAI_CASSETTE_LATENCY_SCALE=str(args.latency_scale)
+        )
+        os.environ.setdefault('OPENAI_API_KEY', 'replay')
+
+    timings = run_session(args.persona, args.feedback_timeout)
+    total = sum(step['seconds'] for step in timings)
+    for i, step in enumerate(timings, 1):
+        print(f"{i:>3} {step['step']:<16}{step['seconds'] * 1000:>10.1f} ms{'' if step['ok'] else '  FAILED'}")
+    print(f"    {'total':<16}{total * 1000:>10.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'persona': args.persona, 'total_seconds': round(total, 4), 'steps': timings}, f, indent=2)
+    if not all(step['ok'] for step in timings):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
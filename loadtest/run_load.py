@@ -0,0 +1,250 @@
+"""
+HTTP load driver for the chat routes.
+
+Replays multi-turn trainee sessions against /chatbot, /voice_chat, /ian_chatbot
+and /chatbot_guidance, and reports throughput, p50/p95/p99 latency and error
+rate per route. For each gunicorn worker configuration it starts the OpenAI
+stub (loadtest/openai_stub.py) and the app, runs the load, and stops them.
+
+    python loadtest/run_load.py --configs sync:2,sync:4,gthread:2x8 --users 50 --duration 60
+
+A configuration is WORKER_CLASS:WORKERS or gthread:WORKERSxTHREADS.
+Use --target http://host:port to load an already running deployment instead.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MELISSA_SESSION = [
+    "Hello! My name is Sam, I'm a volunteer with CompanionLink.",
+    "How has your week been so far?",
+    "That sounds lovely. What do you like to grow in your garden?",
+    "I've never grown tomatoes myself, is it difficult?",
+    "Do you have a favourite British show at the moment?",
+    "I'd love to hear more about your grandchildren if you'd like to share.",
+    "It was really nice talking with you today. Talk to you next week!"
+]
+
+IAN_SESSION = [
+    "Hi Ian, I'm Sam, a volunteer with CompanionLink. Nice to meet you.",
+    "What keeps you busy these days?",
+    "Woodworking sounds great. What are you working on right now?",
+    "Do you get out on any trails around the city?",
+    "That's fair, we don't have to talk about anything you're not comfortable with.",
+    "Do you stay in touch with other veterans in the community?",
+    "Thanks for chatting with me today, Ian."
+]
+
+GUIDANCE_SESSION = [
+    "start",
+    "Hello, my name is Sam, and I'm a volunteer with CompanionLink. I'm a student and I'm really looking forward to getting to know you.",
+    "I understand how you're feeling lonely, but as a CompanionLink volunteer I can only support you through our calls. I'd love to schedule regular chat times.",
+    "I appreciate you asking, but I try to remain neutral on political matters. I'd love to hear your thoughts though.",
+    "I care about your health, but I'm not qualified to give medical advice. Please consult your doctor about these concerns.",
+    "I respect all beliefs and I keep my own views private, but I'm happy to listen if you'd like to share.",
+    "I understand this is a challenging situation, but I cannot provide legal advice. Please contact a legal professional.",
+    "I hear how difficult this is and I'm here to listen. A family counselor could also help with this."
+]
+
+ROUTES = {
+    '/chatbot': MELISSA_SESSION,
+    '/voice_chat': MELISSA_SESSION,
+    '/ian_chatbot': IAN_SESSION,
+    '/chatbot_guidance': GUIDANCE_SESSION
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: 0 for route in ROUTES}
+
+    def record(self, route, seconds, ok):
+        with self.lock:
+            if ok:
+                self.latencies[route].append(seconds)
+            else:
+                self.errors[route] += 1
+
+    def summary(self, duration):
+        summary = {}
+        for route in ROUTES:
+            samples = self.latencies[route]
+            total = len(samples) + self.errors[route]
+            summary[route] = {
+                'requests': total,
+                'throughput_rps': round(len(samples) / duration, 2),
+                'p50_ms': round(percentile(samples, 50) * 1000, 1),
+                'p95_ms': round(percentile(samples, 95) * 1000, 1),
+                'p99_ms': round(percentile(samples, 99) * 1000, 1),
+                'error_rate': round(self.errors[route] / total, 4) if total else 0.0
+            }
+        return summary
+
+
+def post_json(url, payload, timeout):
+    body = json.dumps(payload).encode('utf-8')
+    req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        data = json.loads(response.read())
+    return data
+
+
+def run_user(target, results, stop_at, think_time, timeout):
+    """One virtual trainee: keeps starting sessions on random routes until time runs out."""
+    while time.time() < stop_at:
+        route = random.choice(list(ROUTES))
+        session_id = uuid.uuid4().hex
+        for message in ROUTES[route]:
+            if time.time() >= stop_at:
+                return
+            start = time.perf_counter()
+            try:
+                data = post_json(target + route, {'message': message, 'session_id': session_id}, timeout)
+                ok = 'error' not in data
+            except (urllib.error.URLError, OSError, ValueError):
+                ok = False
+            results.record(route, time.perf_counter() - start, ok)
+            time.sleep(random.uniform(0, think_time))
+
+
+def run_load(target, users, duration, think_time, timeout):
+    results = Results()
+    stop_at = time.time() + duration
+    threads = [
+        threading.Thread(target=run_user, args=(target, results, stop_at, think_time, timeout), daemon=True)
+        for _ in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+        # Stagger session starts a little so every user doesn't hit turn one together
+        time.sleep(min(0.05, duration / max(users, 1) / 10))
+    for thread in threads:
+        thread.join()
+    return results.summary(duration)
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2)
+            return True
+        except urllib.error.HTTPError:
+            return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    return False
+
+
+def parse_config(config):
+    worker_class, size = config.split(':')
+    threads = 1
+    if 'x' in size:
+        size, threads = size.split('x')
+    return worker_class, int(size), int(threads)
+
+
+def start_gunicorn(app_module, port, worker_class, workers, threads, env, chdir=ROOT):
+    command = [
+        sys.executable, '-m', 'gunicorn', app_module,
+        '--chdir', chdir,
+        '-b', f"127.0.0.1:{port}",
+        '-k', worker_class,
+        '-w', str(workers),
+        '--threads', str(threads),
+        '--timeout', '120',
+        '--log-level', 'warning'
+    ]
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+
+
+def print_table(config, summary):
+    print(f"\n{config}")
+    print(f"{'route':<20}{'requests':>10}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for route, row in summary.items():
+        print(
+            f"{route:<20}{row['requests']:>10}{row['throughput_rps']:>8}{row['p50_ms']:>10}"
+            f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['error_rate']:>9.2%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the CompanionLink chat routes")
+    parser.add_argument('--configs', default='sync:2,sync:4,gthread:2x8',
+                        help="gunicorn configurations to compare, eg. sync:4,gthread:2x8")
+    parser.add_argument('--target', help="load an already running app instead of starting gunicorn")
+    parser.add_argument('--users', type=int, default=20, help="concurrent virtual trainees")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of load per configuration")
+    parser.add_argument('--think-time', type=float, default=1.0, help="max seconds between turns")
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--app-port', type=int, default=8050)
+    parser.add_argument('--stub-port', type=int, default=8001)
+    parser.add_argument('--stub-latency', default='', help="latency spec passed to the stub (STUB_LATENCY)")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    report = {}
+    if args.target:
+        summary = run_load(args.target.rstrip('/'), args.users, args.duration, args.think_time, args.timeout)
+        print_table(args.target, summary)
+        report[args.target] = summary
+    else:
+        stub_env = dict(os.environ, STUB_LATENCY=args.stub_latency)
+        stub = start_gunicorn('openai_stub:app', args.stub_port, 'gthread', 1, 128, stub_env,
+                              chdir=os.path.join(ROOT, 'loadtest'))
+        try:
+            if not wait_for(f"http://127.0.0.1:{args.stub_port}/health"):
+                sys.exit("OpenAI stub did not start")
+
+            app_env = dict(
+                os.environ,
+                OPENAI_BASE_URL=f"http://127.0.0.1:{args.stub_port}/v1",
+                OPENAI_API_KEY='stub'
+            )
+            for config in args.configs.split(','):
+                worker_class, workers, threads = parse_config(config)
+                app = start_gunicorn('app:app', args.app_port, worker_class, workers, threads, app_env)
+                try:
+                    if not wait_for(f"http://127.0.0.1:{args.app_port}/"):
+                        print(f"{config}: app did not start")
+                        continue
+                    summary = run_load(
+                        f"http://127.0.0.1:{args.app_port}", args.users, args.duration,
+                        args.think_time, args.timeout
+                    )
+                    print_table(config, summary)
+                    report[config] = summary
+                finally:
+                    app.terminate()
+                    app.wait()
+        finally:
+            stub.terminate()
+            stub.wait()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Request stage timing and a Prometheus /metrics endpoint.
+
+Every request records which route and persona it belongs to. Code inside the
+request wraps each expensive step in `stage(name)`, which records its duration
+in a histogram labelled by route, persona and stage, and counts exceptions.
+Token usage from OpenAI responses is counted per task.
+
+The metrics live in the worker process; with several gunicorn workers each
+worker reports its own numbers (the `pid` label tells them apart).
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+# (route, persona) of the request being handled; copied into background jobs
+REQUEST_LABELS = contextvars.ContextVar('request_labels', default=('background', 'none'))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.append(f'pid="{os.getpid()}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            return [
+                f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+                for labels, value in sorted(self.values.items())
+            ]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [bucket counts..., sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for labels, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    bucket_labels = _format_labels(self.label_names + ['le'], labels + (bound,))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                inf_labels = _format_labels(self.label_names + ['le'], labels + ('+Inf',))
+                lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {series[-1]}")
+        return lines
+
+
+class Collected:
+    """Values read from a callback when /metrics is scraped (eg. cache hit counts)."""
+
+    def __init__(self, name, help_text, label_names, collect, metric_type='gauge'):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.collect = collect
+        self.type = metric_type
+
+    def render(self):
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {value}"
+            for labels, value in sorted(self.collect().items())
+        ]
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+REQUEST_SECONDS = register(Histogram(
+    'companionlink_request_seconds', 'Total time spent handling a request',
+    ['route', 'persona', 'status']
+))
+STAGE_SECONDS = register(Histogram(
+    'companionlink_stage_seconds', 'Time spent in each stage of a request',
+    ['route', 'persona', 'stage']
+))
+STAGE_ERRORS = register(Counter(
+    'companionlink_stage_errors_total', 'Exceptions raised inside a request stage',
+    ['route', 'persona', 'stage']
+))
+TOKENS = register(Counter(
+    'companionlink_openai_tokens_total', 'Tokens reported by OpenAI responses',
+    ['route', 'persona', 'task', 'kind']
+))
+
+
+@contextmanager
+def stage(name):
+    """Time one stage of the current request."""
+    route, persona = REQUEST_LABELS.get()
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc((route, persona, name))
+        raise
+    finally:
+        STAGE_SECONDS.observe((route, persona, name), time.perf_counter() - start)
+
+
+def record_usage(task, response):
+    """Count prompt/completion tokens from an OpenAI response, when it reports them."""
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    route, persona = REQUEST_LABELS.get()
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        value = getattr(usage, kind, None)
+        if value:
+            TOKENS.inc((route, persona, task, kind.replace('_tokens', '')), value)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app, persona_by_endpoint):
+    """Label every request with its route and persona, time it, and serve /metrics."""
+
+    @app.before_request
+    def start_request_timer():
+        route = request.endpoint or 'unknown'
+        persona = persona_by_endpoint.get(route, 'none')
+        g.metrics_token = REQUEST_LABELS.set((route, persona))
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None and request.endpoint != 'metrics':
+            route, persona = REQUEST_LABELS.get()
+            REQUEST_SECONDS.observe((route, persona, str(response.status_code)), time.perf_counter() - start)
+        return response
+
+    @app.teardown_request
+    def reset_request_labels(exc):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            REQUEST_LABELS.reset(token)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
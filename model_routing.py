@@ -0,0 +1,201 @@
+"""
+Per-task model routing.
+
+Each upstream task (persona replies, classifiers, feedback, embeddings, TTS,
+transcription) has a route with a model, a max_tokens cap, a timeout and an
+optional fallback model. The router keeps a window of recent latencies per
+task and model; when the primary model's p95 goes over the route's latency
+budget, calls drop to the fallback until the primary recovers. Samples older
+than MODEL_LATENCY_HORIZON seconds are forgotten, so after a spike the primary
+is used again within the horizon even when few calls went to it meanwhile; if
+it is still slow, it takes MIN_SAMPLES calls to move back to the fallback.
+
+Routes can be overridden without code changes through MODEL_ROUTES, either a
+JSON string or a path to a JSON file, eg.
+    {"violation_check": {"model": "gpt-4o-mini", "latency_budget": 1.5}}
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_ROUTES = {
+    'persona_reply': {
+        'model': 'gpt-3.5-turbo',
+        'max_tokens': 150,
+        'timeout': 20,
+        'fallback': 'gpt-4o-mini',
+        'latency_budget': 6.0
+    },
+    'violation_check': {
+        'model': 'gpt-3.5-turbo',
+        'max_tokens': 50,
+        'timeout': 8,
+        'fallback': 'gpt-4o-mini',
+        'latency_budget': 2.0
+    },
+    'rapport_scoring': {
+        'model': 'gpt-3.5-turbo',
+        'max_tokens': 50,
+        'timeout': 8,
+        'fallback': 'gpt-4o-mini',
+        'latency_budget': 2.0
+    },
+    'feedback': {
+        'model': 'gpt-3.5-turbo',
+        'max_tokens': 500,
+        'timeout': 60,
+        'fallback': 'gpt-4o-mini',
+        'latency_budget': 30.0
+    },
+    # Embeddings from different models are not comparable, so there is no fallback by default
+    'embeddings': {
+        'model': 'text-embedding-ada-002',
+        'timeout': 10,
+        'fallback': None,
+        'latency_budget': 2.0
+    },
+    'tts': {
+        'model': 'tts-1',
+        'voice': 'alloy',
+        'timeout': 20,
+        'fallback': None,
+        'latency_budget': 5.0
+    },
+    'transcription': {
+        'model': 'whisper-1',
+        'timeout': 30,
+        'fallback': None,
+        'latency_budget': 8.0
+    }
+}
+
+# Latency samples kept per (task, model)
+WINDOW_SIZE = 50
+# Seconds a latency sample counts for routing and for the degrade pressure signal
+MODEL_LATENCY_HORIZON = float(os.getenv('MODEL_LATENCY_HORIZON', 60))
+# Fewer samples than this and the p95 is not trusted yet
+MIN_SAMPLES = 10
+# While on the fallback, every Nth call still goes to the primary so it can recover
+PROBE_EVERY = 20
+
+
+class Route:
+    def __init__(self, task, model, max_tokens=None, timeout=None, fallback=None,
+                 latency_budget=None, **options):
+        self.task = task
+        self.model = model
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.fallback = fallback
+        self.latency_budget = latency_budget
+        # Task specific settings such as the TTS voice
+        self.options = options
+
+    def with_model(self, model):
+        return Route(self.task, model, self.max_tokens, self.timeout, self.fallback,
+                     self.latency_budget, **self.options)
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class ModelRouter:
+    def __init__(self, routes, horizon=MODEL_LATENCY_HORIZON):
+        self.routes = {task: Route(task, **config) for task, config in routes.items()}
+        self.horizon = horizon
+        # (task, model): deque of (monotonic time, seconds), oldest first
+        self.latencies = {}
+        self.fallback_calls = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        routes = {task: dict(config) for task, config in DEFAULT_ROUTES.items()}
+        overrides = os.getenv('MODEL_ROUTES')
+        if overrides:
+            if os.path.isfile(overrides):
+                with open(overrides) as f:
+                    overrides = f.read()
+            for task, config in json.loads(overrides).items():
+                routes.setdefault(task, {}).update(config)
+        return cls(routes)
+
+    def _recent(self, key, now):
+        """Latencies of (task, model) within the horizon, dropping older ones. Call with the lock held."""
+        samples = self.latencies.get(key)
+        if not samples:
+            return []
+        while samples and now - samples[0][0] > self.horizon:
+            samples.popleft()
+        return [seconds for _, seconds in samples]
+
+    def route(self, task, now=None):
+        """The route to use for the next call of this task."""
+        route = self.routes[task]
+        if not route.fallback or not route.latency_budget:
+            return route
+
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            samples = self._recent((task, route.model), now)
+            if len(samples) < MIN_SAMPLES:
+                return route
+            if percentile(samples, 95) <= route.latency_budget:
+                return route
+
+            count = self.fallback_calls.get(task, 0) + 1
+            self.fallback_calls[task] = count
+            if count % PROBE_EVERY == 0:
+                return route
+        return route.with_model(route.fallback)
+
+    def record(self, task, model, seconds, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            samples = self.latencies.setdefault((task, model), deque(maxlen=WINDOW_SIZE))
+            samples.append((now, seconds))
+
+    @contextmanager
+    def timed(self, route):
+        """Time an upstream call, including calls that fail or time out."""
+        start = time.perf_counter()
+        try:
+            yield route
+        finally:
+            self.record(route.task, route.model, time.perf_counter() - start)
+
+    def pressure(self, task, now=None):
+        """
+        Recent p95 of the task's fastest model over the route's latency budget;
+        above 1.0 even the best option is over budget. 0 until there are enough
+        samples within the horizon.
+        """
+        route = self.routes[task]
+        if not route.latency_budget:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            recent = [self._recent(key, now) for key in list(self.latencies) if key[0] == task]
+        p95s = [percentile(samples, 95) for samples in recent if len(samples) >= MIN_SAMPLES]
+        return min(p95s) / route.latency_budget if p95s else 0.0
+
+    def p95(self):
+        """Current p95 latency per task and model, over the samples within the horizon."""
+        now = time.monotonic()
+        with self.lock:
+            recent = {key: self._recent(key, now) for key in list(self.latencies)}
+        return {
+            f"{task}:{model}": round(percentile(samples, 95), 3)
+            for (task, model), samples in recent.items() if samples
+        }
+
+
+ROUTER = ModelRouter.from_env()
@@ -0,0 +1,143 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>`, or when it
+is picked by PROFILE_SAMPLE_RATE (0.01 profiles 1% of requests). The result is
+written to PROFILE_DIR as
+
+    <route>-<session_id>-<time>-<pid>.pstats      cProfile stats (PROFILE_FORMAT=pstats)
+    <route>-<session_id>-<time>-<pid>.collapsed   sampled stacks, one "a;b;c count" line
+                                                  per stack (PROFILE_FORMAT=collapsed),
+                                                  ready for flamegraph.pl or speedscope
+
+and the file name is returned in the X-Profile-File response header.
+
+When neither PROFILE_TOKEN nor PROFILE_SAMPLE_RATE is set, no hooks are
+installed, so profiling costs nothing. Only one request per worker is profiled
+at a time; others that ask for it run unprofiled.
+
+    python -m pstats profiles/ian_chatbot-abc123-....pstats
+"""
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+import applog
+
+log = applog.get_logger('profiling')
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_FORMAT = os.getenv('PROFILE_FORMAT', 'pstats')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+PROFILE_HEADER = 'X-Profile'
+
+# Seconds between stack samples in collapsed mode
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.001))
+
+# cProfile can only have one active profiler per process on recent Pythons
+_active = threading.Lock()
+
+
+class StackSampler:
+    """Samples one thread's stack on a timer and counts the collapsed stacks."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def enable(self):
+        self.thread.start()
+
+    def disable(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def dump_stats(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _wanted():
+    if PROFILE_TOKEN and request.headers.get(PROFILE_HEADER) == PROFILE_TOKEN:
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _file_name(extension):
+    data = request.get_json(silent=True) if request.is_json else None
+    session_id = str((data or {}).get('session_id') or request.form.get('session_id') or 'none')
+    session_id = re.sub(r'[^A-Za-z0-9_.-]', '_', session_id)[:64]
+    route = request.endpoint or 'unknown'
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return f"{route}-{session_id}-{stamp}-{os.getpid()}.{extension}"
+
+
+def _stop_and_write():
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return None
+    try:
+        profiler.disable()
+        extension = 'collapsed' if isinstance(profiler, StackSampler) else 'pstats'
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = _file_name(extension)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        return name
+    except Exception as e:
+        log.error("profile_write_failed", error=str(e))
+        return None
+    finally:
+        _active.release()
+
+
+def init_app(app):
+    """Install the profiling hooks, unless profiling is switched off."""
+    if not PROFILE_TOKEN and PROFILE_SAMPLE_RATE <= 0:
+        return
+
+    @app.before_request
+    def start_profiler():
+        if not _wanted() or not _active.acquire(blocking=False):
+            return
+        if PROFILE_FORMAT == 'collapsed':
+            profiler = StackSampler(threading.get_ident())
+        else:
+            profiler = cProfile.Profile()
+        g.profiler = profiler
+        profiler.enable()
+
+    @app.after_request
+    def write_profile(response):
+        name = _stop_and_write()
+        if name:
+            response.headers['X-Profile-File'] = name
+        return response
+
+    @app.teardown_request
+    def discard_profiler(exc):
+        # Requests that raised skip after_request; still write what was collected
+        _stop_and_write()
@@ -0,0 +1,212 @@
+"""
+Pacing of outbound OpenAI calls against the account's rate limits.
+
+OpenAI reports the limits on every response, per model:
+
+    x-ratelimit-limit-requests   x-ratelimit-remaining-requests   x-ratelimit-reset-requests
+    x-ratelimit-limit-tokens     x-ratelimit-remaining-tokens     x-ratelimit-reset-tokens
+
+The scheduler keeps a request bucket and a token bucket per model. A response
+hook on the shared httpx client sets them from these headers; in between they
+refill so that they are full again at the reported reset time. Before each
+call, `SCHEDULER.reserve()` takes the call's estimated cost, prompt characters
+/ 4 plus max_tokens (OpenAI counts max_tokens against the limit too). When the bucket cannot cover it, the call
+waits until it can, so a burst is spread out instead of bouncing off 429s.
+
+Interactive calls (persona replies, violation checks, speech, guidance
+embeddings) go first: a background call (feedback, rapport scoring, batch
+grading) waits while an interactive call is waiting, and may only spend the
+bucket down to RATE_LIMIT_RESERVE of the limit, which is kept for the next
+trainee turn.
+
+    RATE_LIMIT_PACING=1        0 turns pacing off (headers are still tracked)
+    RATE_LIMIT_RESERVE=0.1     fraction of each limit kept for interactive calls
+    RATE_LIMIT_MAX_WAIT=30     seconds a call waits at most; then it goes anyway
+
+Until a model's first response arrives its limits are unknown and its calls are
+not paced. Transcriptions are multipart uploads the hook cannot read the model
+from, so they are never paced.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+import applog
+import metrics
+
+log = applog.get_logger('ratelimit')
+
+RATE_LIMIT_PACING = os.getenv('RATE_LIMIT_PACING', '1') != '0'
+RATE_LIMIT_RESERVE = float(os.getenv('RATE_LIMIT_RESERVE', 0.1))
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 30))
+
+CHARS_PER_TOKEN = 4
+# Longest single sleep while waiting, so a fresher header or a finished call is noticed
+MAX_SLEEP = 0.5
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+BACKGROUND_TASKS = {'feedback', 'rapport_scoring'}
+# Everything called while serving these routes is background work
+BACKGROUND_ROUTES = {'guidance_batch', 'feedback', 'ian_feedback'}
+
+DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_SECONDS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+WAIT_SECONDS = metrics.register(metrics.Histogram(
+    'companionlink_ratelimit_wait_seconds', 'Time calls were held back to stay under the rate limits',
+    ['task', 'priority']
+))
+LIMITED = metrics.register(metrics.Counter(
+    'companionlink_ratelimit_responses_total', 'Upstream 429 responses by model', ['model']
+))
+
+
+def parse_duration(value):
+    """OpenAI reset durations such as '1s', '6m0s' or '120ms', in seconds."""
+    return sum(float(amount) * DURATION_SECONDS[unit] for amount, unit in DURATION.findall(value or ''))
+
+
+def estimate_tokens(texts, max_tokens=None):
+    """Token cost OpenAI will count for a call: prompt characters / 4 plus the completion cap."""
+    return sum(len(text) for text in texts if isinstance(text, str)) // CHARS_PER_TOKEN + (max_tokens or 0)
+
+
+def task_priority(task):
+    route, _ = metrics.REQUEST_LABELS.get()
+    return BACKGROUND if task in BACKGROUND_TASKS or route in BACKGROUND_ROUTES else INTERACTIVE
+
+
+class Bucket:
+    """Remaining requests or tokens for one model, refilled linearly until the reset time."""
+
+    def __init__(self, limit, remaining, reset_seconds, now):
+        self.limit = limit
+        self.level = remaining
+        self.updated = now
+        # Without a usable reset time, assume a per-minute limit
+        if reset_seconds > 0 and remaining < limit:
+            self.rate = (limit - remaining) / reset_seconds
+        else:
+            self.rate = limit / 60.0
+
+    def refill(self, now):
+        self.level = min(self.limit, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount, floor):
+        """How long until `amount` can be taken without going under `floor`."""
+        missing = amount + floor - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+
+class RateLimitScheduler:
+    def __init__(self, pacing=RATE_LIMIT_PACING, reserve=RATE_LIMIT_RESERVE, max_wait=RATE_LIMIT_MAX_WAIT):
+        self.pacing = pacing
+        self.reserve_fraction = reserve
+        self.max_wait = max_wait
+        # model -> {'requests': Bucket, 'tokens': Bucket}
+        self.buckets = {}
+        self.interactive_waiting = 0
+        self.condition = threading.Condition()
+
+    def observe_response(self, response):
+        """httpx response hook: sync the model's buckets from its rate-limit headers."""
+        headers = response.headers
+        if 'x-ratelimit-remaining-requests' not in headers and 'x-ratelimit-remaining-tokens' not in headers:
+            return
+        model = self._request_model(response.request)
+        if model is None:
+            return
+        if response.status_code == 429:
+            LIMITED.inc((model,))
+        now = time.monotonic()
+        with self.condition:
+            buckets = self.buckets.setdefault(model, {})
+            for kind in ('requests', 'tokens'):
+                try:
+                    limit = int(headers[f'x-ratelimit-limit-{kind}'])
+                    remaining = int(headers[f'x-ratelimit-remaining-{kind}'])
+                except (KeyError, ValueError):
+                    continue
+                reset_seconds = parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                bucket = buckets.get(kind)
+                if bucket is not None and bucket.limit == limit:
+                    # The server has not seen calls reserved here that are still on their way,
+                    # and the local estimate misses other workers' calls: keep the lower of the two
+                    bucket.refill(now)
+                    remaining = min(remaining, bucket.level)
+                buckets[kind] = Bucket(limit, remaining, reset_seconds, now)
+            self.condition.notify_all()
+
+    def _request_model(self, request):
+        try:
+            return json.loads(request.content).get('model')
+        except Exception:
+            # Multipart uploads (transcriptions) are not read back
+            return None
+
+    def remaining(self):
+        now = time.monotonic()
+        with self.condition:
+            values = {}
+            for model, buckets in self.buckets.items():
+                for kind, bucket in buckets.items():
+                    bucket.refill(now)
+                    values[(model, kind)] = bucket.level
+            return values
+
+    def reserve(self, task, model, tokens=0):
+        """Take one request and `tokens` from the model's buckets, waiting until they are available."""
+        if model not in self.buckets:
+            return 0.0
+        priority = task_priority(task)
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        with self.condition:
+            if priority == INTERACTIVE:
+                self.interactive_waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    buckets = self.buckets[model]
+                    floor_fraction = self.reserve_fraction if priority == BACKGROUND else 0.0
+                    delay = 0.0
+                    for kind, amount in (('requests', 1), ('tokens', tokens)):
+                        bucket = buckets.get(kind)
+                        if bucket is None or not amount:
+                            continue
+                        bucket.refill(now)
+                        # A call bigger than the whole limit only has to wait for a full bucket
+                        amount = min(amount, bucket.limit)
+                        floor = min(floor_fraction * bucket.limit, bucket.limit - amount)
+                        delay = max(delay, bucket.seconds_until(amount, floor))
+                    if priority == BACKGROUND and self.interactive_waiting:
+                        delay = max(delay, MAX_SLEEP)
+
+                    if delay <= 0 or not self.pacing or now >= deadline:
+                        if delay > 0 and self.pacing:
+                            log.warning("ratelimit_wait_exceeded", task=task, model=model, tokens=tokens)
+                        for kind, amount in (('requests', 1), ('tokens', tokens)):
+                            if kind in buckets:
+                                buckets[kind].level -= amount
+                        break
+                    self.condition.wait(min(delay, MAX_SLEEP, deadline - now))
+            finally:
+                if priority == INTERACTIVE:
+                    self.interactive_waiting -= 1
+                    self.condition.notify_all()
+
+        waited = time.monotonic() - start
+        WAIT_SECONDS.observe((task, priority), waited)
+        return waited
+
+
+SCHEDULER = RateLimitScheduler()
+
+metrics.register(metrics.Collected(
+    'companionlink_ratelimit_remaining', 'Estimated requests and tokens left in the current rate-limit window',
+    ['model', 'kind'], SCHEDULER.remaining
+))
@@ -0,0 +1,225 @@
+"""
+Nearest-neighbour index over each scenario's bank of reference answers.
+
+Every scenario starts with its hand-written `answers`. Graded exemplars from
+past cohorts can be added from REFERENCE_BANK_PATH, an NDJSON file of
+{"scenario": ..., "text": ..., "weight": ...} rows. The scorers only look at
+an answer's WEIGHTED_CANDIDATES nearest exemplars, whatever the bank size:
+/chatbot_guidance and batch grading take the one with the highest similarity
+times weight (a lower-weight exemplar can be nearest while a heavier one scores
+higher), evaluate_response the one with the highest weighted TF-IDF similarity.
+
+Exemplar embeddings are L2-normalized and stored per scenario as int8 with a
+per-row scale, or as float16 (REFERENCE_BANK_DTYPE); int8 is smaller and
+cheaper to widen for the matrix product. Queries are answered with one
+matrix-vector product over the scenario's matrix; once a scenario has more
+than IVF_THRESHOLD exemplars, its vectors are clustered with spherical k-means
+into lists of about IVF_LIST_SIZE, and a query only scans the lists of its
+IVF_PROBES closest centroids, so the cost per query stays roughly flat as the
+bank grows.
+"""
+import json
+import os
+import threading
+
+import startup
+
+REFERENCE_BANK_PATH = os.getenv('REFERENCE_BANK_PATH')
+REFERENCE_BANK_DTYPE = os.getenv('REFERENCE_BANK_DTYPE', 'int8')
+IVF_THRESHOLD = int(os.getenv('IVF_THRESHOLD', 512))
+IVF_PROBES = int(os.getenv('IVF_PROBES', 8))
+# Exemplars per IVF list; fixed so a query scans about IVF_PROBES * IVF_LIST_SIZE rows at any bank size
+IVF_LIST_SIZE = int(os.getenv('IVF_LIST_SIZE', 64))
+KMEANS_ITERATIONS = 10
+# Nearest exemplars re-ranked by weighted similarity
+WEIGHTED_CANDIDATES = 8
+
+
+def l2_normalize(vectors):
+    """Rows scaled to unit length as float32; an all-zero row (eg. a text with no words) stays zero."""
+    np = startup.numpy()
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def load_exemplars(path):
+    rows = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                rows.append((row['scenario'], row['text'], float(row.get('weight', 1.0))))
+    return rows
+
+
+class ScenarioIndex:
+    """Normalized, quantized exemplar vectors for one scenario, with an optional IVF partitioning."""
+
+    def __init__(self, texts, weights, vectors, dtype=REFERENCE_BANK_DTYPE,
+                 ivf_threshold=IVF_THRESHOLD, probes=IVF_PROBES):
+        np = startup.numpy()
+        vectors = l2_normalize(vectors)
+        self.texts = list(texts)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.dtype = dtype
+        self.probes = probes
+
+        if dtype == 'int8':
+            self.scales = np.abs(vectors).max(axis=1) / 127.0
+            # A zero row keeps scale 0 (and scores 0) instead of dividing by it
+            self.matrix = np.round(vectors / np.where(self.scales == 0, 1, self.scales)[:, None]).astype(np.int8)
+        else:
+            self.scales = None
+            self.matrix = vectors.astype(np.float16)
+
+        self.centroids = None
+        self.lists = None
+        if len(self.texts) > ivf_threshold:
+            self._build_ivf(vectors)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def _build_ivf(self, vectors):
+        """Spherical k-means into lists of about IVF_LIST_SIZE vectors."""
+        np = startup.numpy()
+        n_lists = max(1, len(vectors) // IVF_LIST_SIZE)
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = (vectors @ centroids.T).argmax(axis=1)
+            for c in range(n_lists):
+                members = vectors[assignment == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        assignment = (vectors @ centroids.T).argmax(axis=1)
+        self.centroids = centroids
+        self.lists = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+
+    def _scores(self, queries, indices=None):
+        """Cosine similarities (queries x exemplars) against all exemplars or a subset."""
+        np = startup.numpy()
+        matrix = self.matrix if indices is None else self.matrix[indices]
+        # float64 queries against a float32 matrix would miss the BLAS fast path
+        scores = np.asarray(queries, dtype=np.float32) @ matrix.astype(np.float32).T
+        if self.scales is not None:
+            # Dequantize the scores rather than the matrix: one multiply per exemplar
+            scores *= self.scales[None, :] if indices is None else self.scales[indices][None, :]
+        return scores
+
+    def search(self, queries, k=1):
+        """Top-k (indices, similarities) for each normalized query row."""
+        np = startup.numpy()
+        k = min(k, len(self))
+        if self.centroids is None:
+            scores = self._scores(queries)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+        probes = min(self.probes, len(self.lists))
+        queries = np.asarray(queries, dtype=np.float32)
+        nearest_lists = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :probes]
+        indices = np.zeros((len(queries), k), dtype=np.int64)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for q, lists in enumerate(nearest_lists):
+            candidates = np.concatenate([self.lists[c] for c in lists])
+            scores = self._scores(queries[q:q + 1], candidates)[0]
+            top = np.argsort(-scores)[:k]
+            indices[q, :len(top)] = candidates[top]
+            similarities[q, :len(top)] = scores[top]
+        return indices, similarities
+
+
+class ReferenceBank:
+    """Per-scenario exemplar indexes, embedded on first use."""
+
+    def __init__(self, scenarios, embed_batch, exemplars_path=REFERENCE_BANK_PATH, calibrate=None, **index_options):
+        self.scenarios = scenarios
+        self.embed_batch = embed_batch
+        # Maps the embedding backend's similarities onto the scale the thresholds were set on
+        self.calibrate = calibrate or (lambda similarity: similarity)
+        self.exemplars_path = exemplars_path
+        self.index_options = index_options
+        self.indexes = None
+        self.lock = threading.Lock()
+
+    def _build(self):
+        texts = {name: [a['text'] for a in scenario['answers']] for name, scenario in self.scenarios.items()}
+        weights = {name: [a['weight'] for a in scenario['answers']] for name, scenario in self.scenarios.items()}
+        if self.exemplars_path:
+            for scenario_type, text, weight in load_exemplars(self.exemplars_path):
+                if scenario_type in texts:
+                    texts[scenario_type].append(text)
+                    weights[scenario_type].append(weight)
+
+        # One embedding pass for the whole bank
+        flat = [text for name in texts for text in texts[name]]
+        vectors = self.embed_batch(flat)
+        indexes, start = {}, 0
+        for name in texts:
+            end = start + len(texts[name])
+            indexes[name] = ScenarioIndex(texts[name], weights[name], vectors[start:end], **self.index_options)
+            start = end
+        return indexes
+
+    def index(self, scenario_type):
+        if self.indexes is None:
+            with self.lock:
+                if self.indexes is None:
+                    self.indexes = self._build()
+        return self.indexes[scenario_type]
+
+    def normalize(self, vectors):
+        return l2_normalize(vectors)
+
+    def _nearest(self, scenario_type, queries, k):
+        """The index and each query's k nearest exemplars: indices, calibrated similarities, weights."""
+        np = startup.numpy()
+        index = self.index(scenario_type)
+        top, similarities = index.search(queries, k=k)
+        # IVF pads rows that found fewer than k exemplars with -inf; a zero weight keeps them from winning
+        weights = np.where(np.isfinite(similarities), index.weights[top], 0.0)
+        similarities = np.asarray(self.calibrate(np.nan_to_num(similarities, neginf=-1.0)), dtype=np.float64)
+        return index, top, similarities, weights
+
+    def best(self, scenario_type, queries):
+        """
+        For each normalized query: (exemplar index, text, weight, similarity,
+        score) of its best exemplar, where similarity is calibrated and score
+        is similarity * weight.
+        """
+        np = startup.numpy()
+        index, top, similarities, weights = self._nearest(scenario_type, queries, WEIGHTED_CANDIDATES)
+        scores = similarities * weights
+        pick = scores.argmax(axis=1)
+        rows = np.arange(len(top))
+        return [
+            (int(i), index.texts[i], float(weight), float(similarity), float(score))
+            for i, weight, similarity, score in zip(
+                top[rows, pick], weights[rows, pick], similarities[rows, pick], scores[rows, pick]
+            )
+        ]
+
+    def embed_text(self, text):
+        """One answer as a normalized query, embedded with the bank's own backend so it is comparable."""
+        return self.normalize(self.embed_batch([text]))
+
+    def best_for_text(self, scenario_type, text):
+        return self.best(scenario_type, self.embed_text(text))[0]
+
+    def nearest_for_text(self, scenario_type, text, k=WEIGHTED_CANDIDATES):
+        """(text, weight, calibrated similarity) of the k exemplars nearest to one answer, nearest first."""
+        index, top, similarities, weights = self._nearest(scenario_type, self.embed_text(text), k)
+        return [
+            (index.texts[i], float(weight), float(similarity))
+            for i, similarity, weight in zip(top[0], similarities[0], weights[0]) if weight > 0
+        ]
+
+    def sizes(self):
+        if self.indexes is None:
+            return {}
+        return {name: len(index) for name, index in self.indexes.items()}
@@ -0,0 +1,34 @@
+"""
+Locks for the in-process session state (`conversations` in app.py).
+
+With threaded workers (gunicorn --threads) two requests for the same session,
+or a request and a background job (deferred rapport scoring, feedback), can
+run at once. Session state is only read or changed while holding the
+session's lock, and the lock is never held across an OpenAI call: a turn
+copies what it needs under the lock, talks to OpenAI without it, then applies
+its updates under the lock again, against the state as it is by then.
+
+Locks are striped: session ids hash onto SESSION_LOCK_STRIPES re-entrant
+conditions, so nothing grows with the number of sessions or needs cleaning up
+when one ends. Sessions sharing a stripe only ever wait for each other's short
+critical sections. The conditions are also what the /rapport long-poll waits on.
+
+    SESSION_LOCK_STRIPES=64
+"""
+import os
+import threading
+import zlib
+
+SESSION_LOCK_STRIPES = int(os.getenv('SESSION_LOCK_STRIPES', 64))
+
+
+class SessionLocks:
+    def __init__(self, stripes=SESSION_LOCK_STRIPES):
+        self.stripes = [threading.Condition(threading.RLock()) for _ in range(max(1, stripes))]
+
+    def __call__(self, session_id):
+        """The condition guarding `session_id`; use it as a context manager."""
+        return self.stripes[zlib.crc32(str(session_id).encode('utf-8')) % len(self.stripes)]
+
+
+session_lock = SessionLocks()
@@ -0,0 +1,163 @@
+"""
+Memory accounting for the in-process session state (`conversations`).
+
+Sizes are estimated by walking each session's dicts, lists and strings and
+summing sys.getsizeof, counting shared objects once. They are exported on
+/metrics as per-persona totals, and GET /debug/memory lists the largest
+sessions:
+
+    curl -H "X-Debug-Token: $DEBUG_TOKEN" "localhost:10000/debug/memory?top=20"
+
+With `?snapshot=1` the endpoint also takes a tracemalloc snapshot and returns
+the top allocation sites that grew since the previous snapshot. The first such
+call starts tracemalloc (TRACEMALLOC_FRAMES frames per traceback), so call it
+once, let traffic run, then call it again.
+
+The endpoint is only registered when DEBUG_TOKEN is set.
+"""
+import os
+import sys
+import threading
+import tracemalloc
+
+from flask import jsonify, request
+
+import metrics
+
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN')
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', 5))
+
+
+def estimate_size(obj, seen=None):
+    """Approximate bytes held by obj and everything it contains."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    # Snapshot containers with list() so a concurrent request can't change them mid-walk
+    if isinstance(obj, dict):
+        for key, value in list(obj.items()):
+            size += estimate_size(key, seen) + estimate_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in list(obj):
+            size += estimate_size(item, seen)
+    return size
+
+
+def session_persona(session):
+    persona = session.get('persona')
+    if persona:
+        return persona
+    return 'ian' if 'discovered_info' in session else 'melissa'
+
+
+def session_sizes(conversations):
+    """(session_id, persona, bytes, session) for every live session."""
+    sizes = []
+    for session_id, session in list(conversations.items()):
+        sizes.append((session_id, session_persona(session), estimate_size(session), session))
+    return sizes
+
+
+def persona_totals(sizes):
+    totals = {}
+    for _, persona, size, _ in sizes:
+        entry = totals.setdefault(persona, {'sessions': 0, 'bytes': 0})
+        entry['sessions'] += 1
+        entry['bytes'] += size
+    return totals
+
+
+def session_report(conversations, top=10):
+    sizes = session_sizes(conversations)
+    sizes.sort(key=lambda item: item[2], reverse=True)
+    return {
+        'sessions': len(sizes),
+        'total_bytes': sum(size for _, _, size, _ in sizes),
+        'personas': persona_totals(sizes),
+        'largest': [
+            {
+                'session_id': session_id,
+                'persona': persona,
+                'bytes': size,
+                'messages': len(session.get('messages', [])),
+                'chat_history': len(session.get('chat_history', [])),
+                'notes': len(session.get('notes', []))
+            }
+            for session_id, persona, size, session in sizes[:top]
+        ]
+    }
+
+
+class SnapshotDiffer:
+    """Keeps the previous tracemalloc snapshot and reports what grew since then."""
+
+    def __init__(self, frames=TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self.previous = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+
+    def diff(self, top=10):
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(self.frames)
+                self.previous = self._snapshot()
+                return {'status': 'tracemalloc started; call again to see what grew'}
+
+            snapshot = self._snapshot()
+            previous, self.previous = self.previous, snapshot
+            stats = snapshot.compare_to(previous, 'traceback')[:top]
+            current, peak = tracemalloc.get_traced_memory()
+            return {
+                'traced_bytes': current,
+                'traced_peak_bytes': peak,
+                'top': [
+                    {
+                        'size_diff': stat.size_diff,
+                        'size': stat.size,
+                        'count_diff': stat.count_diff,
+                        'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+                    }
+                    for stat in stats
+                ]
+            }
+
+
+def init_app(app, conversations):
+    """Export per-persona session memory on /metrics and, with DEBUG_TOKEN, serve /debug/memory."""
+    def collect(field):
+        totals = persona_totals(session_sizes(conversations))
+        return {(persona,): entry[field] for persona, entry in totals.items()}
+
+    metrics.register(metrics.Collected(
+        'companionlink_session_bytes', 'Estimated memory held by live sessions per persona',
+        ['persona'], lambda: collect('bytes')
+    ))
+    metrics.register(metrics.Collected(
+        'companionlink_sessions', 'Live sessions per persona',
+        ['persona'], lambda: collect('sessions')
+    ))
+
+    if not DEBUG_TOKEN:
+        return
+    differ = SnapshotDiffer()
+
+    @app.route('/debug/memory')
+    def debug_memory():
+        if request.headers.get('X-Debug-Token') != DEBUG_TOKEN:
+            return jsonify({'error': 'Forbidden'}), 403
+        top = request.args.get('top', 10, type=int)
+        report = session_report(conversations, top)
+        if request.args.get('snapshot'):
+            report['tracemalloc'] = differ.diff(top)
+        return jsonify(report)
@@ -0,0 +1,264 @@
+"""
+Stateless sessions: the session state travels with the client as a signed token.
+
+By default a trainee's session lives in the memory of the worker that first
+served it, so a deployment needs sticky routing. With STATELESS_SESSIONS=1
+every chat response carries a `session_token` holding the session's state,
+and the client sends it back as `session_token` with the next turn; the worker
+that gets the turn rebuilds the session from it and drops it again once the
+response is out, so any worker on any node can take any turn.
+
+A token is base64url(version | zlib(JSON state) | HMAC-SHA256). The MAC also
+covers the session id, so a token only works for the session it was issued
+to, and tokens older than SESSION_TOKEN_TTL are refused. The state is what the
+routes need to carry on:
+
+    chat_history (already capped at 20 messages), rapport score, details and
+    metrics, warnings, introduced / unlocked / ended flags, and for Ian the
+    interaction count, points, last hint, discovered items and achievements
+
+Ian's discovery tree (hints, names, points) is static and rebuilt rather than
+sent. Per-turn feedback notes are not carried, and the feedback transcript is
+rebuilt from the bounded history, so feedback covers the last 10 turns.
+Deferred rapport scoring needs the session to stay in memory, so scoring runs
+inline in this mode. Feedback jobs still run in, and are polled from, the
+worker that accepted them; a session restored for a feedback request stays
+until its job is done, and is dropped right away when no job was accepted (the
+client still has its token to retry with).
+
+    STATELESS_SESSIONS=0
+    SESSION_TOKEN_SECRET=        required when enabled; comma-separated to rotate (the first signs)
+    SESSION_TOKEN_TTL=86400      seconds a token stays valid
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import zlib
+
+from flask import g, jsonify, request
+
+import applog
+import metrics
+from session_locks import session_lock
+
+log = applog.get_logger('session_tokens')
+
+STATELESS_SESSIONS = os.getenv('STATELESS_SESSIONS', '0') == '1'
+SESSION_TOKEN_SECRET = os.getenv('SESSION_TOKEN_SECRET', '')
+SESSION_TOKEN_TTL = int(os.getenv('SESSION_TOKEN_TTL', 24 * 3600))
+
+VERSION = 1
+MAC_BYTES = 32
+# Messages kept in chat_history by the routes
+HISTORY_LIMIT = 20
+
+# Session fields copied into the token as they are
+FIELDS = (
+    'persona', 'introduced', 'warnings', 'rapport_score', 'rapport_details', 'rapport_metrics',
+    'character_unlocked', 'conversation_ended', 'interaction_count', 'total_points', 'last_hint_given'
+)
+# Personas whose routes keep a 'messages' transcript for feedback, and their speaker name
+TRANSCRIPT_SPEAKERS = {'melissa_voice': 'Melissa', 'ian': 'Ian'}
+
+# Preset zlib dictionary: the field names and JSON framing every token repeats.
+# Changing it changes the token format, so bump VERSION with it
+ZDICT = json.dumps({
+    'v': 0, 'iat': 0, 'chat_history': [
+        {'role': 'user', 'content': ''}, {'role': 'assistant', 'content': ''}
+    ],
+    'discovered': [], 'achievements': [], **{field: None for field in FIELDS}
+}, separators=(',', ':')).encode('utf-8')
+
+TOKEN_BYTES = metrics.register(metrics.Histogram(
+    'companionlink_session_token_bytes', 'Size of issued session tokens', ['route'],
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+))
+REJECTED = metrics.register(metrics.Counter(
+    'companionlink_session_token_rejected_total', 'Session tokens refused', ['route', 'reason']
+))
+
+
+class InvalidToken(Exception):
+    def __init__(self, reason):
+        super().__init__(f"Invalid session token ({reason})")
+        self.reason = reason
+
+
+def export_state(session):
+    """The part of a session that goes into its token."""
+    state = {field: session[field] for field in FIELDS if field in session}
+    state['chat_history'] = session['chat_history'][-HISTORY_LIMIT:]
+    if 'discovered_info' in session:
+        state['discovered'] = [
+            f"{category}.{key}"
+            for category, items in session['discovered_info'].items()
+            for key, info in items.items() if info['discovered']
+        ]
+        state['achievements'] = [name for name, achievement in session['achievements'].items() if achievement['earned']]
+    return state
+
+
+def restore_session(state, new_session):
+    """Rebuild a session from token state on top of new_session(persona)."""
+    session = new_session(state['persona'])
+    for field in FIELDS:
+        if field in state:
+            session[field] = state[field]
+    session['chat_history'] = list(state.get('chat_history', []))[-HISTORY_LIMIT:]
+
+    speaker = TRANSCRIPT_SPEAKERS.get(state['persona'])
+    if speaker:
+        session['messages'] = [
+            f"{'User' if message['role'] == 'user' else speaker}: {message['content']}"
+            for message in session['chat_history']
+        ]
+    for item in state.get('discovered', []):
+        category, key = item.split('.', 1)
+        info = session.get('discovered_info', {}).get(category, {}).get(key)
+        if info is not None:
+            info['discovered'] = True
+    for name in state.get('achievements', []):
+        if name in session.get('achievements', {}):
+            session['achievements'][name]['earned'] = True
+    return session
+
+
+class SessionTokens:
+    def __init__(self, secrets, ttl=SESSION_TOKEN_TTL):
+        secrets = [secret.strip() for secret in secrets.split(',') if secret.strip()] if isinstance(secrets, str) else list(secrets)
+        if not secrets:
+            raise ValueError("SESSION_TOKEN_SECRET is not set")
+        self.keys = [secret.encode('utf-8') for secret in secrets]
+        self.ttl = ttl
+
+    def _mac(self, key, session_id, body):
+        return hmac.new(key, session_id.encode('utf-8') + b"\x00" + body, hashlib.sha256).digest()
+
+    def dumps(self, session_id, state, now=None):
+        payload = json.dumps(
+            {'v': VERSION, 'iat': int(now if now is not None else time.time()), **state},
+            separators=(',', ':'), ensure_ascii=False
+        ).encode('utf-8')
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS, zdict=ZDICT)
+        body = bytes([VERSION]) + compressor.compress(payload) + compressor.flush()
+        token = body + self._mac(self.keys[0], session_id, body)
+        return base64.urlsafe_b64encode(token).rstrip(b"=").decode('ascii')
+
+    def loads(self, session_id, token, now=None):
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        except (ValueError, TypeError):
+            raise InvalidToken('malformed')
+        body, mac = raw[:-MAC_BYTES], raw[-MAC_BYTES:]
+        if len(body) < 2 or not any(hmac.compare_digest(mac, self._mac(key, session_id, body)) for key in self.keys):
+            raise InvalidToken('signature')
+        if body[0] != VERSION:
+            raise InvalidToken('version')
+        try:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=ZDICT)
+            state = json.loads(decompressor.decompress(body[1:]) + decompressor.flush())
+        except (zlib.error, ValueError):
+            raise InvalidToken('malformed')
+        now = now if now is not None else time.time()
+        if now - state.pop('iat', 0) > self.ttl:
+            raise InvalidToken('expired')
+        state.pop('v', None)
+        return state
+
+
+def init_app(app, conversations, new_session, personas_by_endpoint, feedback_endpoints=None):
+    """
+    Restore sessions from `session_token` for the chat endpoints in
+    personas_by_endpoint ({endpoint: personas its sessions may have}) and
+    hand back a fresh token with every successful response. Feedback endpoints
+    only restore: the session is handed to the feedback job, which drops it when
+    it is done, or dropped with the response when the request did not start a
+    job. Returns the SessionTokens, or None when stateless mode is off.
+    """
+    if not STATELESS_SESSIONS:
+        return None
+    tokens = SessionTokens(SESSION_TOKEN_SECRET)
+    feedback_endpoints = feedback_endpoints or {}
+
+    @app.before_request
+    def restore_from_token():
+        endpoint = request.endpoint
+        if endpoint not in personas_by_endpoint and endpoint not in feedback_endpoints:
+            return None
+        data = request.get_json(silent=True) or {}
+        session_id = data.get('session_id') if isinstance(data, dict) else None
+        if not session_id:
+            return None
+        if endpoint in personas_by_endpoint:
+            g.stateless_session_id = session_id
+        token = data.get('session_token')
+        if not token:
+            return None
+
+        route, _ = metrics.REQUEST_LABELS.get()
+        try:
+            state = tokens.loads(session_id, token)
+            allowed = personas_by_endpoint.get(endpoint) or feedback_endpoints.get(endpoint, ())
+            if state.get('persona') not in allowed:
+                raise InvalidToken('persona')
+        except InvalidToken as e:
+            REJECTED.inc((route, e.reason))
+            log.warning("session_token_rejected", session_id=session_id, reason=e.reason)
+            g.pop('stateless_session_id', None)
+            return jsonify({'error': 'Invalid session token, please start a new conversation.'}), 400
+
+        session = restore_session(state, new_session)
+        with session_lock(session_id):
+            # A session already live here (a feedback job running, an overlapping turn) wins
+            restored = conversations.setdefault(session_id, session) is session
+        if restored and endpoint in feedback_endpoints:
+            g.stateless_feedback_session = (session_id, session)
+        return None
+
+    def release_feedback_session(keep):
+        """Drop the session a feedback request restored, unless keep (a job took it over)."""
+        session_id, session = g.pop('stateless_feedback_session', (None, None))
+        if session_id is None or keep:
+            return
+        with session_lock(session_id):
+            if conversations.get(session_id) is session:
+                conversations.pop(session_id)
+
+    @app.after_request
+    def issue_token(response):
+        # A 202 carries the id of the feedback job that now owns the session; on anything
+        # else (the queue full, no conversation) nothing will ever drop it
+        release_feedback_session(
+            response.status_code == 202 and response.is_json and bool((response.get_json() or {}).get('job_id'))
+        )
+        session_id = g.pop('stateless_session_id', None)
+        if session_id is None:
+            return response
+        # The session only lives for the length of the request
+        with session_lock(session_id):
+            session = conversations.pop(session_id, None)
+            state = export_state(session) if session is not None else None
+        if state is None or response.status_code != 200 or not response.is_json:
+            return response
+
+        token = tokens.dumps(session_id, state)
+        route, _ = metrics.REQUEST_LABELS.get()
+        TOKEN_BYTES.observe((route,), len(token))
+        body = response.get_json()
+        body['session_token'] = token
+        response.set_data(app.json.dumps(body))
+        return response
+
+    @app.teardown_request
+    def drop_session(exc):
+        # after_request does not run when the view raised
+        release_feedback_session(False)
+        session_id = g.pop('stateless_session_id', None)
+        if session_id is not None:
+            with session_lock(session_id):
+                conversations.pop(session_id, None)
+
+    return tokens
@@ -0,0 +1,112 @@
+"""
+Lazy loading for the heavy dependencies and the shared OpenAI client.
+
+scikit-learn, NumPy and the openai package together take around a second to
+import, and every gunicorn worker paid for them before serving anything.
+They are now imported on first use, and the OpenAI client is built on the
+first request that needs it. DEPENDENCY_LOADING chooses when the imports
+happen:
+
+    background  - start importing in a daemon thread as soon as app.py is
+                  imported, so the first request usually finds them loaded (default)
+    lazy        - only import on first use
+    eager       - import before app.py finishes importing (the old behaviour)
+
+`readiness()` backs the /ready probe, which answers 503 until the warm-up
+has imported the dependencies and built the client.
+"""
+import importlib
+import os
+import threading
+import time
+
+import applog
+import cassettes
+import ratelimit
+
+log = applog.get_logger('startup')
+
+HEAVY_MODULES = ('numpy', 'sklearn.feature_extraction.text', 'sklearn.metrics.pairwise', 'openai')
+
+_modules = {}
+_client = None
+_lock = threading.Lock()
+_mode = 'lazy'
+_warmup_thread = None
+_warmup_seconds = None
+_warmup_error = None
+
+
+def load(name):
+    """Import a module once and cache it."""
+    module = _modules.get(name)
+    if module is None:
+        with _lock:
+            module = _modules.get(name)
+            if module is None:
+                module = _modules[name] = importlib.import_module(name)
+    return module
+
+
+def numpy():
+    return load('numpy')
+
+
+def tfidf_vectorizer():
+    return load('sklearn.feature_extraction.text').TfidfVectorizer()
+
+
+def cosine_similarity(a, b):
+    return load('sklearn.metrics.pairwise').cosine_similarity(a, b)
+
+
+def openai_client():
+    """The OpenAI client shared by app.py and the voice handler, built on first use."""
+    global _client
+    if _client is None:
+        OpenAI = load('openai').OpenAI
+        with _lock:
+            if _client is None:
+                # OPENAI_CASSETTE_MODE=record|replay swaps in a record/replay transport, see cassettes.py;
+                # every response's rate-limit headers feed the outbound scheduler (ratelimit.py)
+                http_client = cassettes.http_client(event_hooks={'response': [ratelimit.SCHEDULER.observe_response]})
+                _client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=http_client)
+    return _client
+
+
+def warm_up():
+    """Import everything and build the client, recording how long it took."""
+    global _warmup_seconds, _warmup_error
+    start = time.perf_counter()
+    try:
+        for name in HEAVY_MODULES:
+            load(name)
+        openai_client()
+    except Exception as e:
+        _warmup_error = str(e)
+        log.error("warmup_failed", error=str(e))
+    _warmup_seconds = time.perf_counter() - start
+
+
+def start(mode=None):
+    """Apply DEPENDENCY_LOADING (or `mode`): warm up now, in the background, or not at all."""
+    global _mode, _warmup_thread
+    mode = _mode = mode or os.getenv('DEPENDENCY_LOADING', 'background')
+    if mode == 'eager':
+        warm_up()
+    elif mode == 'background' and _warmup_thread is None:
+        _warmup_thread = threading.Thread(target=warm_up, name='dependency-warmup', daemon=True)
+        _warmup_thread.start()
+
+
+def readiness():
+    loaded = [name for name in HEAVY_MODULES if name in _modules]
+    warmed = len(loaded) == len(HEAVY_MODULES) and _client is not None
+    return {
+        # In lazy mode nothing is loaded ahead of time, so there is nothing to wait for
+        'ready': warmed or _mode == 'lazy',
+        'loaded': loaded,
+        'openai_client': _client is not None,
+        'warmup_seconds': None if _warmup_seconds is None else round(_warmup_seconds, 3),
+        'warmup_error': _warmup_error
+    }
@@ -0,0 +1,324 @@
+"""
+Conversation transcripts, kept off the heap and across restarts.
+
+A session's `messages` transcript grows with every turn and used to live only
+in the worker's memory, so long sessions kept growing and a deploy lost them.
+Two backends are available (TRANSCRIPT_BACKEND):
+
+    - memory: the whole transcript stays in session['messages'] (original behaviour)
+    - sqlite: lines are appended to a local SQLite log in WAL mode and only the
+      last TRANSCRIPT_TAIL lines stay in session['messages']
+
+With sqlite the request thread only puts lines on a queue. A writer thread
+drains it and commits whatever arrived in one transaction (a group commit),
+waiting up to TRANSCRIPT_FLUSH_INTERVAL for more before it does. After each chat
+turn the session's state (the stateless-token state from session_tokens.py,
+plus the per-turn feedback notes) is checkpointed the same way, so a worker
+that does not know a session, after a deploy or restart, restores it from the
+log on the session's next request. The feedback jobs stream the full transcript
+back from the log. Once feedback has been generated the checkpoint is dropped;
+transcript lines are kept for TRANSCRIPT_RETENTION days.
+
+Writes still queued when a worker is killed outright (up to one flush
+interval) are lost; a normal shutdown flushes them.
+
+    TRANSCRIPT_BACKEND=memory
+    TRANSCRIPT_PATH=./transcripts.sqlite3
+    TRANSCRIPT_TAIL=20               lines kept in memory per session
+    TRANSCRIPT_FLUSH_INTERVAL=0.05   seconds the writer gathers a batch
+    TRANSCRIPT_MAX_PENDING=10000     queued writes before new ones are dropped
+    TRANSCRIPT_RETENTION=7           days transcripts are kept
+"""
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from flask import g, request
+
+import applog
+import metrics
+from session_locks import session_lock
+from session_tokens import export_state, restore_session
+
+log = applog.get_logger('transcript_log')
+
+TRANSCRIPT_TAIL = int(os.getenv('TRANSCRIPT_TAIL', 20))
+TRANSCRIPT_FLUSH_INTERVAL = float(os.getenv('TRANSCRIPT_FLUSH_INTERVAL', 0.05))
+TRANSCRIPT_MAX_PENDING = int(os.getenv('TRANSCRIPT_MAX_PENDING', 10000))
+TRANSCRIPT_RETENTION = float(os.getenv('TRANSCRIPT_RETENTION', 7))
+
+# Most writes committed in one transaction
+MAX_BATCH = 1000
+# Rows read per fetch while streaming a transcript
+STREAM_CHUNK = 200
+
+BATCH_SIZE = metrics.register(metrics.Histogram(
+    'companionlink_transcript_batch_writes', 'Writes committed per transcript log transaction', [],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000)
+))
+DROPPED = metrics.register(metrics.Counter(
+    'companionlink_transcript_dropped_total', 'Transcript log writes dropped', ['reason']
+))
+RESTORED = metrics.register(metrics.Counter(
+    'companionlink_transcript_sessions_restored_total', 'Sessions restored from the transcript log', []
+))
+
+
+class MemoryTranscripts:
+    def append(self, session_id, session, *lines):
+        session['messages'].extend(lines)
+
+    def lines(self, session_id, session):
+        return list(session.get('messages', []))
+
+    def checkpoint(self, session_id, session):
+        pass
+
+    def close(self, session_id):
+        pass
+
+    def restore(self, session_id, new_session):
+        return None
+
+    def pending(self):
+        return 0
+
+    def flush(self, timeout=None):
+        return True
+
+
+class SQLiteTranscripts:
+    def __init__(self, path, tail=TRANSCRIPT_TAIL, flush_interval=TRANSCRIPT_FLUSH_INTERVAL,
+                 max_pending=TRANSCRIPT_MAX_PENDING, retention=TRANSCRIPT_RETENTION):
+        self.path = path
+        self.tail = tail
+        self.flush_interval = flush_interval
+        self.retention = retention * 24 * 3600
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS transcript ("
+            "id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, line TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS transcript_session ON transcript (session_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS transcript_created ON transcript (created)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_state ("
+            "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self.writer = threading.Thread(target=self._write_loop, name='transcript-writer', daemon=True)
+        self.writer.start()
+        atexit.register(self.flush, 5)
+
+    def _conn(self):
+        # One connection per thread, as in llm_cache; WAL lets readers run while the writer commits
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            DROPPED.inc(('queue_full',))
+            log.error("transcript_write_dropped", kind=item[0], session_id=item[1])
+
+    def append(self, session_id, session, *lines):
+        """Log the lines and keep only the tail in the session. Call with the session's lock held."""
+        now = time.time()
+        for line in lines:
+            self._put(('line', session_id, line, now))
+        messages = session['messages']
+        messages.extend(lines)
+        if len(messages) > self.tail:
+            del messages[:-self.tail]
+
+    def checkpoint(self, session_id, session):
+        """Queue the session's state for restoring it later. Call with the session's lock held."""
+        state = export_state(session)
+        state['notes'] = session.get('notes', [])
+        self._put(('state', session_id, json.dumps(state, separators=(',', ':')), time.time()))
+
+    def close(self, session_id):
+        """The session is over: it is no longer restored. Its transcript stays until retention."""
+        self._put(('close', session_id, None, time.time()))
+
+    def lines(self, session_id, session):
+        """
+        Stream the session's full transcript, oldest line first. Writes still
+        queued are flushed first; if that times out the in-memory tail is used.
+        """
+        if not self.flush(timeout=5):
+            log.warning("transcript_flush_timeout", session_id=session_id)
+            yield from list(session.get('messages', []))
+            return
+        cursor = self._conn().execute(
+            "SELECT line FROM transcript WHERE session_id = ? ORDER BY id", (session_id,)
+        )
+        while True:
+            rows = cursor.fetchmany(STREAM_CHUNK)
+            if not rows:
+                break
+            for (line,) in rows:
+                yield line
+
+    def restore(self, session_id, new_session):
+        """Rebuild a session from its last checkpoint and transcript tail, or None."""
+        conn = self._conn()
+        row = conn.execute("SELECT state FROM session_state WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        session = restore_session(state, new_session)
+        session['notes'] = state.get('notes', [])
+        if 'messages' in session:
+            tail = conn.execute(
+                "SELECT line FROM transcript WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, self.tail)
+            ).fetchall()
+            session['messages'] = [line for (line,) in reversed(tail)]
+        return session
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far is committed; False on timeout."""
+        done = threading.Event()
+        try:
+            self.queue.put(('flush', None, done, None), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _write_loop(self):
+        last_prune = 0.0
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < MAX_BATCH and batch[-1][0] != 'flush':
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._commit(batch)
+            except Exception as e:
+                DROPPED.inc(('write_failed',), len(batch))
+                log.error("transcript_write_failed", writes=len(batch), error=str(e))
+            for kind, _, value, _ in batch:
+                if kind == 'flush':
+                    value.set()
+
+            now = time.time()
+            if now - last_prune > 3600:
+                last_prune = now
+                try:
+                    self._prune(now)
+                except Exception as e:
+                    log.error("transcript_prune_failed", error=str(e))
+
+    def _commit(self, batch):
+        lines, states, closed = [], {}, set()
+        for kind, session_id, value, created in batch:
+            if kind == 'line':
+                lines.append((session_id, value, created))
+            elif kind == 'state':
+                states[session_id] = (value, created)
+                closed.discard(session_id)
+            elif kind == 'close':
+                states.pop(session_id, None)
+                closed.add(session_id)
+        if not (lines or states or closed):
+            return
+
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany("INSERT INTO transcript (session_id, line, created) VALUES (?, ?, ?)", lines)
+            # Only the last checkpoint of each session in the batch is written
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_state (session_id, state, updated) VALUES (?, ?, ?)",
+                [(session_id, state, updated) for session_id, (state, updated) in states.items()]
+            )
+            conn.executemany("DELETE FROM session_state WHERE session_id = ?", [(session_id,) for session_id in closed])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        BATCH_SIZE.observe((), len(lines) + len(states) + len(closed))
+
+    def _prune(self, now):
+        cutoff = now - self.retention
+        conn = self._conn()
+        conn.execute("DELETE FROM transcript WHERE created < ?", (cutoff,))
+        conn.execute("DELETE FROM session_state WHERE updated < ?", (cutoff,))
+
+
+def create_transcripts():
+    if os.getenv('TRANSCRIPT_BACKEND', 'memory') == 'sqlite':
+        path = os.getenv('TRANSCRIPT_PATH', os.path.join(os.getcwd(), 'transcripts.sqlite3'))
+        return SQLiteTranscripts(path)
+    return MemoryTranscripts()
+
+
+def init_app(app, transcripts, conversations, new_session, personas_by_endpoint, feedback_endpoints=None):
+    """
+    Restore sessions this worker does not know from the log before requests to
+    the chat and feedback endpoints ({endpoint: personas its sessions may
+    have}), and checkpoint the session after every successful chat turn.
+    """
+    metrics.register(metrics.Collected(
+        'companionlink_transcript_pending_writes', 'Transcript log writes waiting for the writer',
+        [], lambda: {(): transcripts.pending()}
+    ))
+    if isinstance(transcripts, MemoryTranscripts):
+        return
+    feedback_endpoints = feedback_endpoints or {}
+
+    @app.before_request
+    def restore_from_log():
+        endpoint = request.endpoint
+        allowed = personas_by_endpoint.get(endpoint) or feedback_endpoints.get(endpoint)
+        if not allowed:
+            return None
+        data = request.get_json(silent=True) or {}
+        session_id = data.get('session_id') if isinstance(data, dict) else None
+        if not session_id:
+            return None
+        if endpoint in personas_by_endpoint:
+            g.transcript_session_id = session_id
+        if session_id in conversations:
+            return None
+
+        try:
+            session = transcripts.restore(session_id, new_session)
+        except Exception as e:
+            log.error("transcript_restore_failed", session_id=session_id, error=str(e))
+            return None
+        if session is None or session.get('persona') not in allowed:
+            return None
+        with session_lock(session_id):
+            if conversations.setdefault(session_id, session) is session:
+                RESTORED.inc(())
+                log.info("session_restored", session_id=session_id, persona=session['persona'])
+        return None
+
+    @app.after_request
+    def checkpoint_session(response):
+        session_id = g.pop('transcript_session_id', None)
+        if session_id is None or response.status_code != 200:
+            return response
+        with session_lock(session_id):
+            session = conversations.get(session_id)
+            if session is not None:
+                transcripts.checkpoint(session_id, session)
+        return response
@@ -1,15 +1,22 @@
-from openai import OpenAI
-import os
 from dotenv import load_dotenv
 import base64
 import io
 import tempfile
+from model_routing import ROUTER
+from ratelimit import SCHEDULER
+import metrics
+import startup
+import applog
 
 load_dotenv()
 
+log = applog.get_logger('voice')
+
 class VoiceChatHandler:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    @property
+    def client(self):
+        # Shared with app.py and created on first use (see startup.py)
+        return startup.openai_client()
 
     def text_to_speech(self, text):
         """
@@ -17,14 +24,20 @@ class VoiceChatHandler:
         Returns base64 encoded audio data for Melissa's responses
         """
         try:
-            print(f"Starting text-to-speech conversion for text: {text[:50]}...")
+            log.debug("tts_started", text=text, chars=len(text))
             
-            # Generate speech using OpenAI's TTS
-            response = self.client.audio.speech.create(
-                model="tts-1",    
-                voice="alloy",    
-                input=text        
-            )
+            # Generate speech using OpenAI's TTS (model and voice come from the 'tts' route)
+            route = ROUTER.route('tts')
+            with metrics.stage('tts'):
+                # Speech is limited in requests per minute only
+                SCHEDULER.reserve('tts', route.model)
+                with ROUTER.timed(route):
+                    response = self.client.audio.speech.create(
+                        model=route.model,
+                        voice=route.options.get('voice', 'alloy'),
+                        input=text,
+                        timeout=route.timeout
+                    )
             
             # Convert bytes to base64 string for JSON serialization
             # 1. response.content contains the raw audio bytes
@@ -34,9 +47,7 @@ class VoiceChatHandler:
             return audio_base64
             
         except Exception as e:
-            print(f"Text-to-speech error: {e}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+            log.error("tts_failed", error=str(e), exc_info=True)
             return None
 
     def transcribe_audio(self, audio_file_path):
@@ -45,19 +56,21 @@ class VoiceChatHandler:
         Expects path to an audio file
         """
         try:
-            with open(audio_file_path, 'rb') as audio_file:
-                # Transcribe using Whisper
-                transcript = self.client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file
-                )
+            route = ROUTER.route('transcription')
+            with open(audio_file_path, 'rb') as audio_file, metrics.stage('transcription'):
+                SCHEDULER.reserve('transcription', route.model)
+                with ROUTER.timed(route):
+                    # Transcribe using Whisper
+                    transcript = self.client.audio.transcriptions.create(
+                        model=route.model,
+                        file=audio_file,
+                        timeout=route.timeout
+                    )
             
             return transcript.text
             
         except Exception as e:
-            print(f"Transcription error: {e}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
+            log.error("transcription_failed", error=str(e), exc_info=True)
             return None
 
 # Test function